@@ -28,6 +28,8 @@ from reddwarf.common import exception
 from reddwarf.common import utils
 from reddwarf.common import wsgi
 from reddwarf.admin import models
+from reddwarf.database import models as database_models
+from reddwarf.database import quota
 
 CONFIG = config.Config
 LOG = logging.getLogger(__name__)
@@ -65,9 +67,11 @@ class AdminController(BaseController):
     
     def validate(self, req, tenant_id):
         """Determine whether a user request has proper admin permissions."""
+        roles = req.headers.get('X_ROLE', '').split(',')
         context = rd_context.ReddwarfContext(
                           auth_tok=req.headers["X-Auth-Token"],
-                          tenant=tenant_id)
+                          tenant=tenant_id,
+                          is_admin='mysql-admin' in [role.strip().lower() for role in roles])
 
         context = context.to_dict()
         LOG.debug("_validate() called with is_admin %s" % context['is_admin'])
@@ -104,6 +108,17 @@ class AdminController(BaseController):
          
         return wsgi.Result(None, 200)
     
+    def invalidate_service_config(self, req, tenant_id):
+        """Drop the cached service images, flavors, keypairs, zones and quotas."""
+        LOG.debug("Admin invalidate_service_config() called with %s" % tenant_id)
+
+        if not self.validate(req, tenant_id):
+             return wsgi.Result("Unauthorized", 401)
+
+        database_models.service_config_cache.invalidate()
+        quota.invalidate_limits()
+        return wsgi.Result({'version': database_models.service_config_cache.version}, 202)
+
     def index_instances(self, req, tenant_id):
         return wsgi.Result(None, 200)
     
@@ -16,8 +16,10 @@ import routes
 import logging
 
 from reddwarf.versions import VersionsController
+from reddwarf.admin.service import AdminController
 from reddwarf.common import wsgi
 from reddwarf.database.service import InstanceController
+from reddwarf.database.service import OperationController
 from reddwarf.database.service import SnapshotController
 from reddwarf.flavor.service import FlavorController
 from reddwarf.securitygroup.service import SecurityGroupController
@@ -34,9 +36,11 @@ class API(wsgi.Router):
         self._versions_router(mapper)
         self._instance_router(mapper)
         self._snapshot_router(mapper)
+        self._operation_router(mapper)
         self._flavor_router(mapper)
         self._security_group_router(mapper)
         self._security_group_rules_router(mapper)
+        self._admin_router(mapper)
         
     def _has_body(self, environ, result):
         LOG.debug("has body ENVIRON: %s" % environ)
@@ -120,6 +124,14 @@ class API(wsgi.Router):
                        action="delete", conditions=dict(method=["DELETE"],
                                                         function=self._has_no_body))  
 
+    def _operation_router(self, mapper):
+        operation_resource = OperationController().create_resource()
+        path = "/{tenant_id}/operations"
+        mapper.connect(path + "/{id}",
+                       controller=operation_resource,
+                       action="show", conditions=dict(method=["GET"],
+                                                      function=self._has_no_body))
+
     def _flavor_router(self, mapper):
         flavor_resource = FlavorController().create_resource()
         path = "/{tenant_id}/flavors"
@@ -163,6 +175,14 @@ class API(wsgi.Router):
                                                         function=self._has_no_body))
 
 
+    def _admin_router(self, mapper):
+        admin_resource = AdminController().create_resource()
+        path = "/{tenant_id}/mgmt"
+        mapper.connect(path + "/service-config/invalidate",
+                       controller=admin_resource,
+                       action="invalidate_service_config", conditions=dict(method=["POST"],
+                                                                           function=self._has_no_body))
+
 
 def app_factory(global_conf, **local_conf):
     return API()
\ No newline at end of file
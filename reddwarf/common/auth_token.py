@@ -30,15 +30,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import httplib2
+import hashlib
 import logging
+import random
 import webob.exc
 import json
 import time
 
+from eventlet import greenthread
+from eventlet import pools
+from eventlet.green import httplib
+
+from reddwarf.common import utils
+
+try:
+    import memcache
+except ImportError:
+    memcache = None
+
 
 LOG = logging.getLogger("reddwarf.common.auth_token")
 
+IDENTITY_ENV_KEY = 'reddwarf.identity'
+
 class InvalidUserToken(Exception):
     pass
 
@@ -53,7 +67,117 @@ class UnauthorizedError(Exception):
 
 class ServerError(Exception):
     pass
-    
+
+
+class TokenCache(object):
+    """Remembers the outcome of token validation.
+
+    Validated identities are kept until the token expires or for
+    token_cache_time seconds, whichever comes first. Rejected tokens are
+    kept for token_negative_cache_time seconds so a client retrying with a
+    bad token does not reach Keystone on every request. When
+    memcache_servers is set the cache is shared by every API worker,
+    otherwise each process keeps its own bounded LRU.
+    """
+
+    INVALID = 'invalid'
+
+    def __init__(self, conf):
+        self.cache_time = int(conf.get('token_cache_time', 300))
+        self.negative_cache_time = int(conf.get('token_negative_cache_time',
+                                                30))
+        self._memcache = None
+        self._local = None
+
+        servers = conf.get('memcache_servers')
+        if servers and memcache is not None:
+            LOG.info('Caching validated tokens in memcache at %s' % servers)
+            self._memcache = memcache.Client(servers.split(','))
+        else:
+            if servers:
+                LOG.warn('memcache_servers is set but python-memcached is '
+                         'not installed, caching tokens in process')
+            self._local = utils.LRUCache(int(conf.get('token_cache_size',
+                                                      1000)),
+                                         self.cache_time)
+
+    def get(self, token, tenant_name):
+        """Return the cached identity, INVALID, or None on a miss."""
+        key = self._key(token, tenant_name)
+        if self._memcache is not None:
+            value = self._memcache.get(key)
+            return json.loads(value) if value else None
+        return self._local.get(key)
+
+    def store(self, token, tenant_name, identity, expires=None):
+        ttl = self.cache_time
+        if expires is not None:
+            remaining = expires - utils.utcnow()
+            remaining = remaining.days * 86400 + remaining.seconds
+            ttl = min(ttl, remaining)
+        if ttl > 0:
+            self._set(self._key(token, tenant_name), identity, ttl)
+
+    def store_invalid(self, token, tenant_name):
+        if self.negative_cache_time > 0:
+            self._set(self._key(token, tenant_name), self.INVALID,
+                      self.negative_cache_time)
+
+    def _set(self, key, value, ttl):
+        if self._memcache is not None:
+            self._memcache.set(key, json.dumps(value), time=ttl)
+        else:
+            self._local.set(key, value, ttl)
+
+    def _key(self, token, tenant_name):
+        digest = hashlib.sha1('%s:%s' % (tenant_name, token)).hexdigest()
+        return 'reddwarf.auth_token/%s' % digest
+
+
+class CircuitBreaker(object):
+    """Stops calling Keystone for a while after repeated failures.
+
+    After failure_threshold consecutive failures the circuit opens and
+    allow() refuses calls for reset_seconds. Once that time has passed a
+    single trial call is let through; its outcome closes the circuit or
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.time() - self.opened_at >= self.reset_seconds:
+            # Half open: push the deadline out so only this caller probes.
+            self.opened_at = time.time()
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            LOG.info('Keystone is reachable again - closing circuit')
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                LOG.error('%s consecutive Keystone failures - opening '
+                          'circuit for %s seconds'
+                          % (self.failures, self.reset_seconds))
+            self.opened_at = time.time()
+
+
 class TokenBasedAuth(object):
     
     def __init__(self, app, conf):
@@ -65,14 +189,26 @@ class TokenBasedAuth(object):
         self.auth_port = int(conf.get('auth_port', 35357))
         self.auth_protocol = conf.get('auth_protocol', 'https')
         self.auth_version = conf.get('auth_version', 'v2.0')
+        self.auth_timeout = float(conf.get('auth_timeout', 10))
         self.retry_limit = int(conf.get('retry_limit', 3))
-        self.retry_count = 0
-        self.retry_sleep_seconds = int(conf.get('retry_sleep_seconds', 1))
+        self.retry_sleep_seconds = float(conf.get('retry_sleep_seconds', 1))
+        self.retry_max_sleep_seconds = float(conf.get(
+            'retry_max_sleep_seconds', 10))
+        self.token_cache = TokenCache(conf)
+        self.circuit = CircuitBreaker(
+            int(conf.get('circuit_failure_threshold', 5)),
+            float(conf.get('circuit_reset_seconds', 30)))
         
         if self.auth_protocol == 'http':
-            self.http_client_class = httplib2.HTTPConnectionWithTimeout
+            self.http_client_class = httplib.HTTPConnection
         else:
-            self.http_client_class = httplib2.HTTPSConnectionWithTimeout
+            self.http_client_class = httplib.HTTPSConnection
+
+        # Connections are kept open between requests and only created
+        # when every pooled one is busy.
+        self.connection_pool = pools.Pool(
+            max_size=int(conf.get('auth_pool_size', 10)),
+            create=self._get_http_connection)
             
 
     def __call__(self, env, start_response):
@@ -81,29 +217,22 @@ class TokenBasedAuth(object):
         Authenticate send downstream on success. Reject request if
         we can't authenticate.
         """
-        
-        self.user_token = ""
-        self.user_id = ""
-        self.user_username = ""
-        self.user_tenant_id = ""
-        self.user_tenant_username = ""
-        self.user_roles = ""
-        
         LOG.debug("Started Token Based Authentication")
         try:
-            self._authorize(env)
-            
+            identity = self._authorize(env)
+            env[IDENTITY_ENV_KEY] = identity
+
             user_headers = {
                 'X-Identity-Status': 'Confirmed',
-                'X-Tenant-Id': self.user_tenant_id,
-                'X-Tenant-Name': self.user_tenant_username,
-                'X-User-Id': self.user_id,
-                'X-User-Name': self.user_username,
-                'X-Roles': self.user_roles,
+                'X-Tenant-Id': identity['tenant_id'],
+                'X-Tenant-Name': identity['tenant_name'],
+                'X-User-Id': identity['user_id'],
+                'X-User-Name': identity['user_name'],
+                'X-Roles': identity['roles'],
                 # Deprecated
-                'X-User': self.user_username,
-                'X-Tenant': self.user_tenant_username,
-                'X-Role': self.user_roles
+                'X-User': identity['user_name'],
+                'X-Tenant': identity['tenant_name'],
+                'X-Role': identity['roles']
             }
             
             self._add_headers(env, user_headers)
@@ -137,76 +266,141 @@ class TokenBasedAuth(object):
 
 
     def _authorize(self, environment):
+        """Return the identity of the caller, validating the token if needed.
+
+        The identity is returned rather than kept on the middleware so that
+        concurrent requests never see each other's credentials.
+        """
 
         """Get the user token from the header"""
-        self.user_token = self._get_header(environment, 'X-Auth-Token')
-        self.user_tenant_username = self._get_header(environment, 'X-Auth-Project-Id')
+        user_token = self._get_header(environment, 'X-Auth-Token')
+        tenant_name = self._get_header(environment, 'X-Auth-Project-Id')
         
         """Check to see if our required headers are passed in"""
-        if self.user_token is None:
+        if user_token is None:
             msg = ("X-Auth-Token not supplied in request header.  ie : 'X-Auth-Token: [authentication token]'")
             LOG.warn(msg % locals())
             raise InvalidUserToken(msg, msg)
 
-        if self.user_tenant_username is None:
+        if tenant_name is None:
             msg = ("X-Auth-Project-Id not supplied in request header.  ie : 'X-Auth-Project-Id: [authentication tenant name]'")
             LOG.warn(msg % locals())
             raise InvalidUserToken(msg, msg)
-        
-        
+
+        cached = self.token_cache.get(user_token, tenant_name)
+        if cached == TokenCache.INVALID:
+            raise UnauthorizedError("User was not authenticated (cached)",
+                                    None)
+        if cached:
+            LOG.debug("Token found in cache - skipping validation")
+            return cached
+
+        return self._validate_token(user_token, tenant_name)
+
+    def _validate_token(self, user_token, tenant_name):
+        """Validate the token against Keystone, retrying transient errors.
+
+        Retries are counted per request and separated by a jittered,
+        exponentially growing green sleep so other requests keep being
+        served. While the circuit is open no call is made and the request
+        fails straight away with a 503.
+        """
+        unavailable = ("The authentication service is unavailable.  "
+                       "Please try again later.")
+        for attempt in range(self.retry_limit + 1):
+            if attempt:
+                delay = self._retry_delay(attempt)
+                LOG.info('Retrying validation - Sleeping for %.2f seconds'
+                         % delay)
+                greenthread.sleep(delay)
+
+            if not self.circuit.allow():
+                raise ServiceError("Keystone circuit is open", unavailable)
+
+            try:
+                response, data = self._request_token(user_token, tenant_name)
+            except ServiceError, (logMessage, publicMessage):
+                self.circuit.record_failure()
+                LOG.error('Error while validating token: %s' % logMessage)
+                continue
+
+            if response.status >= 500:
+                self.circuit.record_failure()
+                LOG.error('Bad response code while validating token: %s - %s'
+                          % (response.status, data))
+                continue
+
+            self.circuit.record_success()
+            return self._handle_token_response(user_token, tenant_name,
+                                               response, data)
+
+        raise ServiceError("Retry limit exceeded for token authorization",
+                           unavailable)
+
+    def _retry_delay(self, attempt):
+        ceiling = min(self.retry_max_sleep_seconds,
+                      self.retry_sleep_seconds * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _request_token(self, user_token, tenant_name):
         """Setup our json body to post"""
         params = {
             'auth': {
-                'tenantName': self.user_tenant_username,
+                'tenantName': tenant_name,
                 'token': {
-                    'id': self.user_token
+                    'id': user_token
                 }
             }
         }
         
         """Post our body to the server using JSON"""
-        response, data = self._json_request('POST',
-                                            '/%s/tokens' % self.auth_version,
-                                            body=params)
+        return self._json_request('POST', '/%s/tokens' % self.auth_version,
+                                  body=params)
 
+    def _handle_token_response(self, user_token, tenant_name, response,
+                               data):
         if response.status == 200:
-            remote_address = getattr(environment, 'REMOTE_ADDR', '127.0.0.1')
-            
             """Get the user and token information from response"""
             try :
                 user = data['access']['user']
                 token = data['access']['token']
-                self.user_id = user.get('id')
-                self.user_username = user.get('name')
-                self.user_tenant_id = token['tenant']['id']
-                self.user_tenant_username = token['tenant']['name']
-                self.user_roles = ','.join([role['name'] for role in user.get('roles', [])])
+                identity = {
+                    'user_id': user.get('id'),
+                    'user_name': user.get('name'),
+                    'tenant_id': token['tenant']['id'],
+                    'tenant_name': token['tenant']['name'],
+                    'roles': ','.join([role['name'] for role in user.get('roles', [])]),
+                }
             except : 
                 logMsg = ("Could not extract user_id and username from response data \n Response Data \n %s" % data)
                 pubMsg = ("There was an error processing your request.  Please try again later.")
                 raise ServerError(logMsg, pubMsg)
-            
+
+            self.token_cache.store(user_token, tenant_name, identity,
+                                   self._token_expiry(token))
             LOG.info("200 Authorized - Returned to client")
-            return True
+            return identity
         if response.status == 404:
             raise NotFoundError("Call not found?", None)
         if response.status == 401:
+            self.token_cache.store_invalid(user_token, tenant_name)
             raise UnauthorizedError("User was not authenticated", None)
-        else:
-            LOG.error('Bad response code while validating token: %s - %s' % 
-                         (response.status, data))
-
-        """Retry authentication here"""
-        if not (self.retry_count == self.retry_limit):
-            LOG.info('Retrying validation - Sleeping for %s seconds' % self.retry_sleep_seconds)
-            self.retry_count += 1
-            time.sleep(self.retry_sleep_seconds)
-            return self._authorize(environment)
-        else:
-            raise UnauthorizedError("Retry limit exceeded for token authorization", None)
+        LOG.error('Bad response code while validating token: %s - %s' %
+                  (response.status, data))
+        raise UnauthorizedError("Unexpected response while validating token",
+                                None)
+
+    def _token_expiry(self, token):
+        """Return when Keystone says the token expires, if it says."""
+        try:
+            expires = utils.parse_isotime(token['expires'])
+            return utils.normalize_time(expires).replace(tzinfo=None)
+        except Exception:
+            return None
         
     def _get_http_connection(self):
-        return self.http_client_class(self.auth_host, self.auth_port)
+        return self.http_client_class(self.auth_host, self.auth_port,
+                                      timeout=self.auth_timeout)
     
     def _header_to_env_var(self, key):
         """Convert header to wsgi env variable.
@@ -239,8 +433,6 @@ class TokenBasedAuth(object):
         :return (http response object, response body parsed as json)
 
         """
-        conn = self._get_http_connection()
-
         kwargs = {
             'headers': {
                 'Content-Type': 'application/json',
@@ -254,21 +446,24 @@ class TokenBasedAuth(object):
         if body:
             kwargs['body'] = json.dumps(body)
 
-        try:
-            conn.request(method, path, **kwargs)
-            response = conn.getresponse()
-            body = response.read()
-        except Exception, e:
-            logMsg = "HTTP Connection Exception : %s" % e
-            raise ServiceError(logMsg, None)
-        finally:
-            conn.close()
+        with self.connection_pool.item() as conn:
+            try:
+                conn.request(method, path, **kwargs)
+                response = conn.getresponse()
+                body = response.read()
+            except Exception, e:
+                # Drop the socket; the connection reopens on its next use.
+                conn.close()
+                logMsg = "HTTP Connection Exception : %s" % e
+                raise ServiceError(logMsg, None)
 
         try:
             data = json.loads(body)
         except ValueError:
             data = {}
-            raise ServerError("Keystone did not return json-encoded body", None)
+            if response.status < 500:
+                raise ServerError("Keystone did not return json-encoded body",
+                                  None)
 
         return response, data
     
@@ -51,8 +51,12 @@ class Snapshot():
     NO_BODY_INSTANCE_ID = "The request body must contain an instanceId key."
     NO_BODY_NAME = "The request body must contain a name key."    
 
+class Operation():
+    NOT_FOUND = "The requested operation does not exist."
+
 class Input():
     NONALLOWED_CHARACTERS_ID = "The id value contains non-allowed characters, or is not in a UUID format.  Only lower-case alphanumeric characters are allowed." 
     NONALLOWED_CHARACTERS_SNAPSHOT_ID = "The snapshotId value contains non-allowed characters, or is not in a UUID format.  Only lower-case alphanumeric characters are allowed."
     NONALLOWED_CHARACTERS_INSTANCE_ID = "The instanceId value contains non-allowed characters, or is not in a UUID format.  Only lower-case alphanumeric characters are allowed."    
-    NONINTEGER_VOLUME_SIZE = "The volume size must be an integer value."
\ No newline at end of file
+    NONINTEGER_VOLUME_SIZE = "The volume size must be an integer value."
+    NONINTEGER_LIMIT = "The limit value must be a positive integer."
\ No newline at end of file
@@ -53,6 +53,11 @@ class QuotaError(ReddwarfError):
 
     message = _("Quota exceeded")
 
+    def __init__(self, message=None, resource=None, limit=None, **kwargs):
+        self.resource = resource
+        self.limit = limit
+        super(QuotaError, self).__init__(message, **kwargs)
+
 class BadValue(ReddwarfError):
 
     message = _("Value could not be converted: %(msg)s")
@@ -38,6 +38,7 @@ class Launcher(object):
     def __init__(self):
         """Initialize the service launcher."""
         self._services = []
+        self._servers = []
 
     @staticmethod
     def run_server(server):
@@ -51,9 +52,13 @@ class Launcher(object):
         """Load and start the given server."""
         gt = eventlet.spawn(self.run_server, server)
         self._services.append(gt)
+        self._servers.append(server)
 
     def stop(self):
         """Stop all services which are currently running."""
+        for server in self._servers:
+            if hasattr(server, 'stop'):
+                server.stop()
         for service in self._services:
             service.kill()
 
@@ -16,6 +16,7 @@
 #    under the License.
 """I totally stole most of this from melange, thx guys!!!"""
 
+import collections
 import datetime
 import inspect
 import random
@@ -27,6 +28,7 @@ import urlparse
 import uuid
 
 from eventlet import event
+from eventlet import greenpool
 from eventlet import greenthread
 from eventlet import semaphore
 from eventlet.green import subprocess
@@ -40,6 +42,8 @@ import_object = openstack_utils.import_object
 bool_from_string = openstack_utils.bool_from_string
 execute = openstack_utils.execute
 isotime = openstack_utils.isotime
+parse_isotime = openstack_utils.parse_isotime
+normalize_time = openstack_utils.normalize_time
 
 
 def stringify_keys(dictionary):
@@ -230,6 +234,146 @@ def poll_until(retriever, condition=lambda value: value,
     lc = LoopingCall(f=poll_and_check).start(sleep_time, True)
     return lc.wait()
 
+class BackoffPoller(object):
+    """Calls a read-only probe until its result passes condition.
+
+    The delay between probes starts at initial_delay and is multiplied by
+    backoff after every attempt, up to max_delay, with +/- jitter applied so
+    concurrent callers do not probe in lock step. Once time_out seconds have
+    passed since wait() started, time spent in the probe included,
+    PollTimeOut is raised.
+
+    The number of probes made and the seconds spent sleeping are kept in
+    attempts and waited, for logging by the caller.
+
+    """
+
+    def __init__(self, probe, condition=lambda value: value,
+                 initial_delay=0.5, max_delay=8, backoff=2, jitter=0.2,
+                 time_out=None):
+        self.probe = probe
+        self.condition = condition
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.time_out = time_out
+        self.attempts = 0
+        self.waited = 0.0
+
+    def _next_delay(self, remaining=None):
+        delay = min(self.max_delay,
+                    self.initial_delay * self.backoff ** (self.attempts - 1))
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return max(delay, 0)
+
+    def wait(self):
+        from reddwarf.common import exception
+
+        deadline = None
+        if self.time_out is not None:
+            deadline = time.time() + self.time_out
+        while True:
+            self.attempts += 1
+            value = self.probe()
+            if self.condition(value):
+                return value
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise exception.PollTimeOut
+            delay = self._next_delay(remaining)
+            greenthread.sleep(delay)
+            self.waited += delay
+
+
+def run_concurrently(steps):
+    """Runs independent steps on a GreenPool and waits for all of them.
+
+    Each step is a (function, args, compensate) tuple. The results are
+    returned in step order. If any step raises, compensate(result) is called
+    for every step that succeeded (compensate may be None) and the first
+    failure, in step order, is re-raised once all steps have finished.
+
+    """
+    pool = greenpool.GreenPool(len(steps))
+    threads = [pool.spawn(function, *args) for function, args, _ in steps]
+
+    results = []
+    failure = None
+    succeeded = []
+    for (function, args, compensate), thread in zip(steps, threads):
+        try:
+            result = thread.wait()
+        except Exception:
+            if failure is None:
+                failure = sys.exc_info()
+            results.append(None)
+        else:
+            results.append(result)
+            succeeded.append((compensate, result))
+
+    if failure is not None:
+        for compensate, result in succeeded:
+            if compensate is None:
+                continue
+            try:
+                compensate(result)
+            except Exception:
+                LOG.exception("Failed to roll back %s" % compensate)
+        raise failure[0], failure[1], failure[2]
+    return results
+
+
+class LRUCache(object):
+    """A bounded, in-process cache whose entries expire after a TTL.
+
+    When the cache is full the least recently used entry is evicted. All
+    operations are plain dict manipulations that never yield, so a single
+    instance can be shared safely between greenthreads. A ttl of 0 keeps
+    an entry until it is evicted.
+
+    """
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            expires_at, value = self._data.pop(key)
+        except KeyError:
+            return default
+        if expires_at is not None and expires_at <= time.time():
+            return default
+        self._data[key] = (expires_at, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._data.pop(key, None)
+        self._data[key] = (expires_at, value)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
 # Copied from nova.api.openstack.common in the old code.
 def get_id_from_href(href):
     """Return the id or uuid portion of a url.
@@ -128,9 +128,10 @@ class Request(openstack_wsgi.Request):
 
 class Result(object):
 
-    def __init__(self, data, status=200):
+    def __init__(self, data, status=200, headers=None):
         self._data = data
         self.status = status
+        self.headers = headers or {}
 
     def data(self, serialization_type):
         if (serialization_type == "application/xml" and
@@ -141,6 +142,20 @@ class Result(object):
         return self._data
 
 
+class SerializedResult(Result):
+    """A Result whose body was serialized ahead of time.
+
+    bodies maps each content type to its serialized body.
+    """
+
+    def __init__(self, bodies, status=200, headers=None):
+        super(SerializedResult, self).__init__(None, status, headers)
+        self._bodies = bodies
+
+    def body(self, serialization_type):
+        return self._bodies[serialization_type]
+
+
 class Resource(openstack_wsgi.Resource):
 
     def __init__(self, controller, deserializer, serializer,
@@ -318,6 +333,10 @@ class ReddwarfResponseSerializer(openstack_wsgi.ResponseSerializer):
         instead of the actual data.
 
         """
+        if isinstance(data, SerializedResult):
+            response.headers['Content-Type'] = content_type
+            response.body = data.body(content_type)
+            return
         if isinstance(data, Result):
             data = data.data(content_type)
         super(ReddwarfResponseSerializer, self).serialize_body(response,
@@ -331,6 +350,8 @@ class ReddwarfResponseSerializer(openstack_wsgi.ResponseSerializer):
             action)
         if isinstance(data, Result):
             response.status = data.status
+            for name, value in data.headers.items():
+                response.headers[name] = value
 
 
 class Fault(webob.exc.HTTPException):
@@ -25,15 +25,29 @@ def get_instance_by_hostname(hostname):
     instance = models.DBInstance().find_by(remote_hostname=hostname)
     return instance        
 
+def get_instances_by_hostnames(hostnames):
+    return models.DBInstance.find_all_by_hostnames(hostnames)
+
+def get_guest_hostnames(states):
+    return models.DBInstance.find_guest_hostnames(states)
+
+def get_operation(id):
+    return models.Operation.find_by(id=id, deleted=False)
+
 def get_snapshot(id):
     snapshot = models.Snapshot().find_by(id=id)
     return snapshot    
 
 def update_guest_status(instance_id, state):
-    guest = models.GuestStatus().find_by(instance_id=instance_id)
     # TODO: Handle situation where no matching record is found (e.g. if
     # a write to GuestStatus fails during create() for some reason)
-    return guest.update(state=state)
+    return models.GuestStatus.update_states([instance_id], state)
+
+def update_guest_statuses(instance_ids, state, from_states=None):
+    return models.GuestStatus.update_states(instance_ids, state, from_states)
+
+def record_guest_heartbeats(instance_ids, heartbeat_at):
+    return models.GuestStatus.record_heartbeats(instance_ids, heartbeat_at)
 
 def update_instance_with_ip(instance_id, public_ip):
     # public_ip might be public_ip or floating_ip
@@ -21,26 +21,56 @@ Handles all request to the Platform or Guest VM
 
 import logging
 
+import eventlet
+
 from reddwarf.database import dbutils
 from reddwarf.database import models
-from reddwarf.database import views
+from reddwarf.common import config
 from reddwarf.common import exception
 from reddwarf.common import result_state
+from reddwarf.common import utils
 from reddwarf.rpc import impl_kombu as rpc
 
 
+CONFIG = config.Config
 LOG = logging.getLogger(__name__)
 
+# Instance id -> remote hostname, kept for guest_routing_cache_ttl seconds
+_hostname_cache = utils.LRUCache(max_size=10000)
+
+
+def _get_hostname(id):
+    """Return the remote hostname of an instance, looking it up at most once."""
+    hostname = _hostname_cache.get(id)
+    if hostname is None:
+        hostname = dbutils.get_instance(id)['remote_hostname']
+        # hostnames are only assigned once the server is booted
+        if hostname:
+            _hostname_cache.set(id, hostname,
+                                ttl=int(CONFIG.get('guest_routing_cache_ttl', 300)))
+    return hostname
+
+
+def invalidate_routing_key(id=None):
+    """Drop the cached hostname of an instance, or of every instance."""
+    if id is None:
+        _hostname_cache.clear()
+    else:
+        _hostname_cache.delete(id)
+
+
+# Guest states the MySQL status sweep may probe and overwrite; building,
+# failed and in-progress guests are never marked unresponsive.
+SWEPT_STATES = ['running', 'unresponsive']
+
+
 class API():
     """API for interacting with the guest manager."""
     instance = {}
 
     def _get_routing_key(self, context, id):
         """Create the routing key based on the container id"""
-        #instance_ref = nova_dbapi.instance_get(context, id)
-        server = models.DBInstance().find_by(id=id)
-        instance_ref = views.DBInstanceView(server).show()
-        return "guest.%s" % instance_ref['instance']['remote_hostname'].split(".")[0]
+        return "guest.%s" % _get_hostname(id).split(".")[0]
 
     def upgrade(self, context, id):
         """Make an asynchronous call to self upgrade the guest agent"""
@@ -51,28 +81,85 @@ class API():
 
     def check_mysql_status(self, context, id):
         """Make a synchronous call to trigger smart agent for checking MySQL status"""
-        instance = dbutils.get_instance(id)
-        LOG.debug("Triggering smart agent on Instance %s (%s) to check MySQL status.", id, instance['remote_hostname'])
-        result = rpc.call(context, instance['remote_hostname'], {"method": "check_mysql_status"})
+        hostname = _get_hostname(id)
+        LOG.debug("Triggering smart agent on Instance %s (%s) to check MySQL status.", id, hostname)
+        result = rpc.call(context, hostname, {"method": "check_mysql_status"})
         # update instance state in guest_status table upon receiving smart agent response
         dbutils.update_guest_status(id, int(result))
         return result
 
+    def sweep_mysql_status(self, context):
+        """Check the MySQL status of every guest at once.
+
+        Only guests in SWEPT_STATES are probed, and their replies gathered
+        for up to guest_health_timeout seconds.  Responders are written with
+        one UPDATE per state and per guest_health_batch_size instances;
+        guests that stayed silent are marked unresponsive.  Rows another
+        writer moved out of SWEPT_STATES meanwhile are left alone.
+        Returns (states, silent ids).
+        """
+        calls = {}
+        for id, hostname in dbutils.get_guest_hostnames(SWEPT_STATES):
+            calls[id] = (hostname, {"method": "check_mysql_status"})
+        if not calls:
+            return {}, []
+        LOG.debug("Sweeping MySQL status of %d instances", len(calls))
+        results = rpc.scatter_call(context, calls,
+                                   float(CONFIG.get('guest_health_timeout', 10)))
+
+        states = {}
+        for id, result in results.iteritems():
+            try:
+                state = result_state.ResultState().name(int(result))
+            except (KeyError, TypeError, ValueError):
+                LOG.warn("Instance %s answered the status sweep with %r", id, result)
+                continue
+            # Treat running and success the same
+            if state == 'success':
+                state = 'running'
+            states.setdefault(state, []).append(id)
+        silent = [id for id in calls if id not in results]
+
+        batch_size = int(CONFIG.get('guest_health_batch_size', 500))
+        for state, ids in states.items() + [('unresponsive', silent)]:
+            for i in range(0, len(ids), batch_size):
+                dbutils.update_guest_statuses(ids[i:i + batch_size], state,
+                                              from_states=SWEPT_STATES)
+        answered = results.keys()
+        now = utils.utcnow()
+        for i in range(0, len(answered), batch_size):
+            dbutils.record_guest_heartbeats(answered[i:i + batch_size], now)
+        LOG.info("MySQL status sweep: %d answered, %d unresponsive",
+                 len(answered), len(silent))
+        return states, silent
+
     def reset_password(self, context, id, password):
         """Make a synchronous call to trigger smart agent for resetting MySQL password"""
         try:
-            instance = dbutils.get_instance(id)
+            hostname = _get_hostname(id)
         except exception.ReddwarfError, e:
             raise exception.NotFound("Instance with id %s not found", id)
 
-        LOG.debug("Triggering smart agent to reset password on Instance %s (%s).", id, instance['remote_hostname'])
-        return rpc.call(context, instance['remote_hostname'],
+        LOG.debug("Triggering smart agent to reset password on Instance %s (%s).", id, hostname)
+        return rpc.call(context, hostname,
                 {"method": "reset_password", "args": {"password": password}})
 
+    def reset_password_async(self, context, id, password, operation_id):
+        """Cast a password reset; the agent phones home with operation_id
+        once it is done."""
+        try:
+            hostname = _get_hostname(id)
+        except exception.ReddwarfError, e:
+            raise exception.NotFound("Instance with id %s not found", id)
+
+        LOG.debug("Casting password reset to Instance %s (%s) as operation %s.", id, hostname, operation_id)
+        rpc.cast(context, hostname,
+                 {"method": "reset_password",
+                  "args": {"password": password, "operation_id": operation_id}})
+
     def create_snapshot(self, context, instance_id, snapshot_id, credential, auth_url, snapshot_key):
         LOG.debug("Triggering smart agent to create Snapshot %s on Instance %s.", snapshot_id, instance_id)
-        instance = dbutils.get_instance(instance_id)
-        rpc.cast(context, instance['remote_hostname'],
+        rpc.cast(context, _get_hostname(instance_id),
                  {"method": "create_snapshot",
                   "args": {"sid": snapshot_id,
                            "tenant_id": context.tenant,
@@ -84,9 +171,8 @@ class API():
 
     def apply_snapshot(self, context, instance_id, snapshot_id, credential, auth_url):
         LOG.debug("Triggering smart agent to apply Snapshot %s on Instance %s.", snapshot_id, instance_id)
-        instance = dbutils.get_instance(instance_id)
         snapshot = dbutils.get_snapshot(snapshot_id)
-        rpc.cast(context, instance['remote_hostname'],
+        rpc.cast(context, _get_hostname(instance_id),
                  {"method": "apply_snapshot",
                   "args": {"storage_path": snapshot['storage_uri'],
                            "credential": {"user": credential['tenant_id']+":"+credential['user_name'],
@@ -96,25 +182,76 @@ class API():
 
 
 class PhoneHomeMessageHandler():
-    """Proxy class to handle phone home messages sent from smart agent."""
+    """Proxy class to handle phone home messages sent from smart agent.
+
+    Messages are handled on a bounded pool of green threads.  Instance
+    heartbeats are coalesced per hostname for phonehome_coalesce_window
+    seconds and written with one conditional UPDATE per state, which
+    leaves rows already in that state alone.  The instance id of each
+    host is cached; liveness goes to guest_status.heartbeat_at every
+    phonehome_heartbeat_interval seconds.
+
+    A message is acked only once it has been handled: heartbeats after
+    the flush that writes them, which requeues them if the write fails,
+    and other messages once their method has run.
+    """
     def __init__(self):
         LOG.debug("PhoneHomeMessageHandler() init")
         self.msg_count = 0
+        self._pool = eventlet.GreenPool(int(CONFIG.get('phonehome_pool_size', 50)))
+        self._window = float(CONFIG.get('phonehome_coalesce_window', 1))
+        self._pending = {}
+        # hostname -> deliveries waiting for the next flush
+        self._deliveries = {}
+        self._flusher = None
+        # hostname -> instance id
+        self._known = utils.LRUCache(
+            max_size=int(CONFIG.get('phonehome_host_cache_size', 100000)),
+            ttl=int(CONFIG.get('phonehome_host_cache_ttl', 300)))
+        self._seen = set()
+        self._heartbeat_interval = float(CONFIG.get('phonehome_heartbeat_interval', 60))
+        self._heartbeat_flusher = None
 
-    def __call__(self, msg):
+    def __call__(self, msg, delivery=None):
         """Called by the phone home consumer whenever a message from smart agent is received."""
         self.msg_count += 1
         LOG.info("Processing message %d: %s", self.msg_count, msg)
         try:
             self._validate(msg)
+            if msg['method'] == 'update_instance_state':
+                self._queue_instance_state(msg, delivery)
+                return
             # execute the requested method from the RPC message
             func = getattr(self, msg['method'], None)
             LOG.debug("Dispatching RPC method: %s", msg['method'])
             if callable(func):
-                func(msg)
+                # blocks while the pool is full, which holds back the ack
+                self._pool.spawn_n(self._dispatch, func, msg, delivery)
+                return
+        except Exception as e:
+            LOG.error("Error processing phone home message: %s", e)
+        self._settle([delivery], True)
+
+    def _dispatch(self, func, msg, delivery):
+        try:
+            func(msg)
         except Exception as e:
             LOG.error("Error processing phone home message: %s", e)
-            pass
+        finally:
+            self._settle([delivery], True)
+
+    def _settle(self, deliveries, handled):
+        """Ack the deliveries, or requeue them if they were not handled."""
+        for delivery in deliveries:
+            if delivery is None:
+                continue
+            try:
+                if handled:
+                    delivery.ack()
+                else:
+                    delivery.requeue()
+            except Exception as e:
+                LOG.error("Error acknowledging phone home message: %s", e)
 
     def _validate(self, msg):
         """Validate that the request has all the required parameters"""
@@ -134,48 +271,142 @@ class PhoneHomeMessageHandler():
                 break;
             
         return public_ip
-        
-    def update_instance_state(self, msg):
-        """Update instance state in guest_status table."""
-        LOG.debug("Updating instance state: %s", msg)
-        # validate input message
+
+    def _instance_state(self, msg):
+        """Validate an instance state message and return the state name."""
         if not msg['args']['hostname']:
             raise exception.NotFound("Required element/key 'hostname' was not specified in phone home message.")
         if '' == msg['args']['state']:
             raise exception.NotFound("Required element/key 'state' was not specified in phone home message.")
 
-        # update DB
-        instance = dbutils.get_instance_by_hostname(msg['args']['hostname'])
         state = result_state.ResultState().name(int(msg['args']['state']))
         
         # Treat running and success the same
         if state == 'running' or state == 'success':
             state = 'running'
-        
-        credential_id = instance['credential']
-        region = instance['availability_zone']
-        remote_uuid = instance['remote_uuid']
-        
-        if instance['address'] is None:
-            # Look up the public_ip for nova instance
-            credential = models.Credential.find_by(id=credential_id)
+        return state
+
+    def _update_public_ip(self, instance):
+        """Look up the public_ip for nova instance"""
+        credential = models.Credential.find_by(id=instance['credential'])
+        try:
+            remote_instance = models.Instance(credential=credential,
+                                              region=instance['availability_zone'],
+                                              uuid=instance['remote_uuid'])
+
+            # as of Oct 24, 2012, the phonehomehandler has not be executed anymore, app server does all the updates towards api db
+            public_ip = self._extract_public_ip(remote_instance.data())
+            LOG.debug("Updating Instance %s with IP: %s" % (instance['id'], public_ip))
+
+            dbutils.update_instance_with_ip(instance['id'], public_ip)
+        except exception.NotFound:
+            LOG.warn("Unable to find Remote instance and extract public ip")
+        except exception.ReddwarfError:
+            LOG.exception("Error occurred updating instance with public ip")
+
+    def _queue_instance_state(self, msg, delivery=None):
+        """Hold the latest state of a host until the next flush."""
+        hostname = msg['args']['hostname']
+        self._pending[hostname] = self._instance_state(msg)
+        self._deliveries.setdefault(hostname, []).append(delivery)
+        if self._flusher is None:
+            self._flusher = eventlet.spawn_after(self._window, self.flush)
+
+    def flush(self):
+        """Write the coalesced instance states, one UPDATE per state, then
+        ack their messages."""
+        self._flusher = None
+        pending, self._pending = self._pending, {}
+        deliveries, self._deliveries = self._deliveries, {}
+        if not pending:
+            return
+
+        failed = set()
+        try:
+            self._write_states(pending, failed)
+        except Exception as e:
+            LOG.error("Error looking up instances: %s", e)
+            failed.update(pending)
+        for hostname, host_deliveries in deliveries.iteritems():
+            self._settle(host_deliveries, hostname not in failed)
+
+    def _write_states(self, pending, failed):
+        """Write pending states, adding the hosts not written to failed."""
+        # state -> hostnames and their instance ids
+        by_state = {}
+        lookup = []
+        for hostname, state in pending.iteritems():
+            instance_id = self._known.get(hostname)
+            if instance_id is None:
+                lookup.append(hostname)
+                continue
+            self._seen.add(instance_id)
+            by_state.setdefault(state, []).append((hostname, instance_id))
+
+        if lookup:
+            found = set()
+            for instance in dbutils.get_instances_by_hostnames(lookup):
+                hostname = instance['remote_hostname']
+                found.add(hostname)
+                self._known.set(hostname, instance['id'])
+                self._seen.add(instance['id'])
+                by_state.setdefault(pending[hostname], []).append(
+                    (hostname, instance['id']))
+                if instance['address'] is None:
+                    self._pool.spawn_n(self._update_public_ip, instance)
+
+            for hostname in set(lookup) - found:
+                LOG.warn("Phone home from unknown host %s", hostname)
+
+        for state, hosts in by_state.iteritems():
+            LOG.debug("Updating mysql instance state to %s for %d instances",
+                      state, len(hosts))
             try:
-                remote_instance = models.Instance(credential=credential, region=region, uuid=remote_uuid)
+                dbutils.update_guest_statuses(
+                    [instance_id for _, instance_id in hosts], state)
+            except Exception as e:
+                LOG.error("Error updating instance states: %s", e)
+                failed.update(hostname for hostname, _ in hosts)
 
-                # as of Oct 24, 2012, the phonehomehandler has not be executed anymore, app server does all the updates towards api db
-                public_ip = self._extract_public_ip(remote_instance.data())
-                LOG.debug("Updating Instance %s with IP: %s" % (instance['id'], public_ip))
+        if self._seen and self._heartbeat_flusher is None:
+            self._heartbeat_flusher = eventlet.spawn_after(
+                self._heartbeat_interval, self.flush_heartbeats)
 
-                dbutils.update_instance_with_ip(instance['id'], public_ip)
-            except exception.NotFound:
-                LOG.warn("Unable to find Remote instance and extract public ip")
-            except exception.ReddwarfError:
-                LOG.exception("Error occurred updating instance with public ip")
+    def flush_heartbeats(self):
+        """Record when the instances heard from since the last call were seen."""
+        self._heartbeat_flusher = None
+        seen, self._seen = self._seen, set()
+        if not seen:
+            return
+        try:
+            dbutils.record_guest_heartbeats(list(seen), utils.utcnow())
+        except Exception as e:
+            LOG.error("Error recording instance heartbeats: %s", e)
+
+    def drain(self):
+        """Flush pending states and wait for the messages in flight."""
+        for flusher in (self._flusher, self._heartbeat_flusher):
+            if flusher is not None:
+                flusher.cancel()
+        self.flush()
+        self.flush_heartbeats()
+        self._pool.waitall()
+
+    def update_operation_state(self, msg):
+        """Record the outcome of an asynchronous guest action."""
+        LOG.debug("Updating operation state: %s", msg)
+
+        # validate input message
+        if not msg['args']['operation_id']:
+            raise exception.NotFound("Required element/key 'operation_id' was not specified in phone home message.")
+        if '' == msg['args']['state']:
+            raise exception.NotFound("Required element/key 'state' was not specified in phone home message.")
+
+        # update DB
+        operation = dbutils.get_operation(msg['args']['operation_id'])
+        operation.update(state=result_state.ResultState().name(int(msg['args']['state'])),
+                         error=msg['args'].get('error'))
 
-        LOG.debug("Updating mysql instance state for Instance %s", instance['id'])
-        dbutils.update_guest_status(instance['id'], state)
-        
-    
     def update_snapshot_state(self, msg):
         """Update snapshot state in database_snapshots table."""
         LOG.debug("Updating snapshot state: %s", msg)
@@ -18,8 +18,12 @@
 
 """Model classes that form the core of instances functionality."""
 
+import datetime
 import logging
 import netaddr
+import time
+
+from eventlet import semaphore
 
 from reddwarf import db
 
@@ -28,7 +32,6 @@ from reddwarf.common import exception as rd_exceptions
 from reddwarf.common import utils
 from novaclient.v1_1.client import Client
 from novaclient import exceptions as nova_exceptions
-from sqlalchemy.sql import func as mysql_func
 
 CONFIG = config.Config
 LOG = logging.getLogger('reddwarf.database.models')
@@ -71,12 +74,156 @@ class ModelBase(object):
         return self.id.__hash__()
 
 
+class NovaClientCache(object):
+    """Process-wide cache of novaclient authentication state.
+
+    Tokens are keyed by (user, tenant, region) so every Nova call made with
+    the same proxy credential shares one Keystone token instead of doing a
+    full authentication round-trip per call. Tokens are refreshed shortly
+    before they expire and entries that have not been used for a while are
+    evicted.
+
+    Only the token and compute endpoint are shared; each caller still gets
+    its own Client because the underlying httplib2 connection is not safe
+    to use from several greenthreads at once. When a token is revoked early
+    novaclient re-authenticates once on the 401 and the new token is written
+    back here so later callers pick it up.
+
+    Locking is done with eventlet semaphores, one per key, so greenthreads
+    asking for different credentials never wait on each other and only one
+    greenthread authenticates a given key at a time.
+    """
+
+    class _Entry(object):
+
+        def __init__(self, auth_token, management_url, password, expires_at,
+                     last_used):
+            self.auth_token = auth_token
+            self.management_url = management_url
+            self.password = password
+            self.expires_at = expires_at
+            self.last_used = last_used
+
+    def __init__(self):
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = semaphore.Semaphore()
+
+    @property
+    def refresh_margin(self):
+        return int(CONFIG.get('nova_client_token_refresh_margin', 300))
+
+    @property
+    def idle_timeout(self):
+        return int(CONFIG.get('nova_client_idle_timeout', 1800))
+
+    @property
+    def default_ttl(self):
+        return int(CONFIG.get('nova_client_token_ttl', 3600))
+
+    def get(self, credential, region, factory):
+        """Return a client carrying a cached token, authenticating if needed.
+
+        :param factory: callable returning a new, unauthenticated client
+        """
+        key = self._key(credential, region)
+        password = credential['password']
+        now = time.time()
+        self._evict_idle(now)
+
+        with self._lock_for(key):
+            entry = self._entries.get(key)
+            if not self._is_usable(entry, password, now):
+                client = factory()
+                client.authenticate()
+                entry = self._store(key, client.client, password)
+            entry.last_used = now
+
+        client = factory()
+        client.client.auth_token = entry.auth_token
+        client.client.management_url = entry.management_url
+        self._track_reauthentication(key, client.client, password)
+        return client
+
+    def invalidate(self, credential, region):
+        with self._lock:
+            self._entries.pop(self._key(credential, region), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _key(self, credential, region):
+        return (credential['user_name'], credential['tenant_id'], region)
+
+    def _lock_for(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, semaphore.Semaphore())
+
+    def _is_usable(self, entry, password, now):
+        if entry is None or entry.password != password:
+            return False
+        return entry.expires_at - self.refresh_margin > now
+
+    def _store(self, key, http_client, password):
+        now = time.time()
+        entry = self._Entry(http_client.auth_token,
+                            http_client.management_url,
+                            password,
+                            self._token_expiry(http_client, now),
+                            now)
+        self._entries[key] = entry
+        LOG.debug("Cached novaclient token for %s, valid for %ds"
+                  % (key, entry.expires_at - now))
+        return entry
+
+    def _track_reauthentication(self, key, http_client, password):
+        """Write a token obtained by novaclient's 401 retry back to the cache."""
+        authenticate = http_client.authenticate
+
+        def _authenticate():
+            authenticate()
+            self._store(key, http_client, password)
+
+        http_client.authenticate = _authenticate
+
+    def _evict_idle(self, now):
+        with self._lock:
+            for key, entry in self._entries.items():
+                if now - entry.last_used > self.idle_timeout:
+                    LOG.debug("Evicting idle novaclient token for %s"
+                              % (key,))
+                    del self._entries[key]
+                    lock = self._key_locks.get(key)
+                    if lock is not None and not lock.locked():
+                        del self._key_locks[key]
+
+    def _token_expiry(self, http_client, now):
+        """Work out when the client's token expires as a unix timestamp.
+
+        Falls back to nova_client_token_ttl when the service catalog does
+        not carry an expiry we can parse.
+        """
+        try:
+            catalog = http_client.service_catalog.catalog
+            expires = utils.normalize_time(
+                utils.parse_isotime(catalog['access']['token']['expires']))
+            delta = expires - utils.utcnow()
+            return now + delta.days * 86400 + delta.seconds
+        except Exception:
+            LOG.debug("Could not determine novaclient token expiry, "
+                      "using default ttl of %ss" % self.default_ttl)
+            return now + self.default_ttl
+
+
 class RemoteModelBase(ModelBase):
 
     # This should be set by the remote model during init time
     # The data() method will be using this
     _data_object = None
 
+    _client_cache = NovaClientCache()
+
     @classmethod
     def get_client(cls, credential, region=None):
         # Quite annoying but due to a paste config loading bug.
@@ -94,20 +241,31 @@ class RemoteModelBase(ModelBase):
 
         if region is None:
             region = 'az-2.region-a.geo-1'
-        
-        try:
-            client = Client(credential['user_name'], credential['password'],
+
+        def new_client():
+            return Client(credential['user_name'], credential['password'],
                 credential['tenant_id'], PROXY_AUTH_URL,
                 #proxy_tenant_id=context.tenant,
                 #proxy_token=context.auth_tok,
                 region_name=region,
                 #service_type='compute',
                 service_name="Compute")
-            client.authenticate()
+
+        if not utils.bool_from_string(CONFIG.get('nova_client_cache', 'True')):
+            client = new_client()
+            try:
+                client.authenticate()
+            except Exception:
+                LOG.exception("Error authenticating with Novaclient")
+            return client
+
+        try:
+            return cls._client_cache.get(credential, region, new_client)
         except Exception:
+            # Hand back an unauthenticated client so the failure surfaces
+            # as a ClientException on first use, like it did before caching
             LOG.exception("Error authenticating with Novaclient")
-            
-        return client
+            return new_client()
 
     def data_item(self, data_object):
         data_fields = self._data_fields + self._auto_generated_attrs
@@ -155,9 +313,9 @@ class Instance(RemoteModelBase):
             raise rd_exceptions.ReddwarfError()
 
     @classmethod
-    def create(cls, credential, region, body, image_id, flavor_id, security_groups, key_name, userdata, files ):
+    def create(cls, credential, region, body, image_id, flavor_id, security_groups, key_name, userdata, files, name=None):
         # self.is_valid()
-        instance_name = utils.generate_uuid()
+        instance_name = name or utils.generate_uuid()
         srv = cls.get_client(credential, region).servers.create(instance_name,
                                                                 image_id,
                                                                 flavor_id,
@@ -167,6 +325,20 @@ class Instance(RemoteModelBase):
                                                                 userdata=userdata)
         return Instance(server=srv)
 
+    @classmethod
+    def find_by_name(cls, credential, region, name):
+        """Returns the server with the given name, or None."""
+        try:
+            servers = cls.get_client(credential, region).servers.list(
+                search_opts={'name': name})
+        except nova_exceptions.ClientException, e:
+            raise rd_exceptions.ReddwarfError(str(e))
+        for server in servers:
+            # Nova treats the name filter as a regex, so check for an exact match.
+            if server.name == name:
+                return Instance(server=server)
+        return None
+
     @classmethod
     def restart(cls, credential, region, uuid):
         try:
@@ -178,6 +350,14 @@ class Instance(RemoteModelBase):
             raise rd_exceptions.ReddwarfError() 
 
 
+def remote_poller(probe, time_out_key, default_time_out):
+    """Returns a BackoffPoller for waiting on a Nova resource."""
+    return utils.BackoffPoller(probe,
+        initial_delay=float(config.Config.get('remote_poll_initial_delay', 0.5)),
+        max_delay=float(config.Config.get('remote_poll_max_delay', 8)),
+        time_out=int(config.Config.get(time_out_key, default_time_out)))
+
+
 class FloatingIP(RemoteModelBase):
 
     _data_fields = ['instance_id', 'ip', 'fixed_ip', 'id']
@@ -225,27 +405,80 @@ class FloatingIP(RemoteModelBase):
 
         return FloatingIP(floating_ip=flip)
 
+    @classmethod
+    def find(cls, credential, region, id):
+        """Returns the floating ip with this id, or None."""
+        try:
+            flip = cls.get_client(credential, region).floating_ips.get(id)
+        except nova_exceptions.NotFound, e:
+            return None
+        except nova_exceptions.ClientException, e:
+            raise rd_exceptions.ReddwarfError(str(e))
+        return FloatingIP(floating_ip=flip)
+
+    @classmethod
+    def release(cls, credential, region, floating_ip):
+        """Gives a floating ip back to the pool.
+
+        Nova refuses to release an assigned ip; unassign it first.
+        """
+        try:
+            cls.get_client(credential, region).floating_ips.delete(floating_ip['id'])
+        except nova_exceptions.NotFound, e:
+            pass
+        except nova_exceptions.ClientException, e:
+            raise rd_exceptions.ReddwarfError(str(e))
+
+    @classmethod
+    def find_by_server(cls, credential, region, server_id):
+        """Returns the floating ip assigned to a server, or None."""
+        try:
+            for flip in cls.get_client(credential, region).floating_ips.list():
+                if flip.instance_id == server_id:
+                    return FloatingIP(floating_ip=flip)
+        except nova_exceptions.ClientException, e:
+            raise rd_exceptions.ReddwarfError(str(e))
+        return None
+
     @classmethod
     def assign(cls, credential, region, floating_ip, server_id):
         """Assigns a floating ip to a server"""
         client = cls.get_client(credential, region)
 
-        def floating_ip_is_attached():
+        # A floating ip can only be added once the server has a fixed ip
+        def server_has_fixed_ip():
             try:
-                client.servers.add_floating_ip(server_id, floating_ip['ip'])
-                return True
+                server = client.servers.get(server_id)
             except nova_exceptions.ClientException, e:
-#                raise rd_exceptions.ReddwarfError(str(e))
-                LOG.error(e)
+                LOG.debug(e)
                 return False
+            if server.status == 'ERROR':
+                raise rd_exceptions.FloatingIpAttachmentFailure("Server %s is in ERROR state" % server_id)
+            return bool(server.addresses)
 
+        poller = remote_poller(server_has_fixed_ip, 'floating_ip_attach_timeout', 20)
         try:
-            utils.poll_until(floating_ip_is_attached, sleep_time=2,
-                time_out=int(config.Config.get('floating_ip_attach_timeout', 20)))
-
+            poller.wait()
         except rd_exceptions.PollTimeOut as pto:
             LOG.error("Timeout trying to assign floating ip %s to instance %s" %(floating_ip['ip'], server_id))
             raise rd_exceptions.FloatingIpAttachmentFailure(str(pto))
+        finally:
+            LOG.debug("Waited %.1fs over %d probes for server %s to get a fixed ip"
+                      % (poller.waited, poller.attempts, server_id))
+
+        try:
+            client.servers.add_floating_ip(server_id, floating_ip['ip'])
+        except nova_exceptions.ClientException, e:
+            LOG.error(e)
+            raise rd_exceptions.FloatingIpAttachmentFailure(str(e))
+
+    @classmethod
+    def unassign(cls, credential, region, floating_ip, server_id):
+        """Removes a floating ip from a server"""
+        try:
+            cls.get_client(credential, region).servers.remove_floating_ip(server_id, floating_ip['ip'])
+        except nova_exceptions.ClientException, e:
+            raise rd_exceptions.ReddwarfError(str(e))
 
 class Volume(RemoteModelBase):
 
@@ -280,26 +513,37 @@ class Volume(RemoteModelBase):
     
     @classmethod
     def attach(cls, credential, region, volume, server_id, device):
-        """Assigns a floating ip to a server"""
+        """Attaches a volume to a server"""
         client = cls.get_client(credential, region)
         
-        # Poll until the volume is attached.
-        def volume_is_attached():
+        # The attach request is only accepted once the volume is available
+        # and the server has finished building.
+        def ready_to_attach():
             try:
-                client.volumes.create_server_volume(server_id, volume['id'], device)
-                return True
+                server = client.servers.get(server_id)
+                remote_volume = client.volumes.get(volume['id'])
             except nova_exceptions.ClientException as e:
                 LOG.debug(e)
                 return False
+            if server.status == 'ERROR' or remote_volume.status == 'error':
+                raise rd_exceptions.VolumeAttachmentFailure("Server %s or volume %s is in error state" % (server_id, volume['id']))
+            return server.status == 'ACTIVE' and remote_volume.status == 'available'
 
+        poller = remote_poller(ready_to_attach, 'volume_attach_time_out', 60)
         try:
-            # Attempt to attach volume
-            utils.poll_until(volume_is_attached, sleep_time=5,
-                             time_out=int(config.Config.get('volume_attach_time_out', 60)))
-            
+            poller.wait()
         except rd_exceptions.PollTimeOut as pto:
             LOG.error("Timeout trying to attach volume: %s" % volume['id'])
             raise rd_exceptions.VolumeAttachmentFailure(str(pto))
+        finally:
+            LOG.debug("Waited %.1fs over %d probes before attaching volume %s"
+                      % (poller.waited, poller.attempts, volume['id']))
+
+        try:
+            client.volumes.create_server_volume(server_id, volume['id'], device)
+        except nova_exceptions.ClientException as e:
+            LOG.error(e)
+            raise rd_exceptions.VolumeAttachmentFailure(str(e))
         
     @classmethod
     def detach(cls, credential, region, server_id, volume_id):
@@ -325,12 +569,12 @@ class Volume(RemoteModelBase):
             except nova_exceptions.ClientException as e:
                 LOG.debug(e)
                 return False
+        poller = remote_poller(volume_is_detached, 'volume_detach_time_out', 30)
         try:
             # Wait until volume is detached, before issuing delete
-            utils.poll_until(volume_is_detached, sleep_time=2,
-                             time_out=int(config.Config.get('volume_detach_time_out', 30))) 
+            poller.wait()
         except rd_exceptions.PollTimeOut as pto:
-            LOG.error("Timeout waiting for volume to detach: %s" % volume_id)
+            LOG.error("Timeout waiting for volume to detach: %s after %d probes" % (volume_id, poller.attempts))
             
             # Failed waiting for volume to detach, attempt to delete anyway
             try:
@@ -364,7 +608,7 @@ class DatabaseModelBase(ModelBase):
     @classmethod
     def create(cls, **values):
         values['id'] = utils.generate_uuid()
-        values['created_at'] = mysql_func.now()
+        values['created_at'] = utils.utcnow()
 #        values['remote_hostname'] = None
 #        values['tenant_id'] = "12345"
 #        values['availability_zone'] = "1"
@@ -379,10 +623,12 @@ class DatabaseModelBase(ModelBase):
             raise rd_exceptions.InvalidModelError(self.errors)
 #        self._convert_columns_to_proper_type()
 #        self._before_save()
-        self['updated_at'] = mysql_func.now()
+        self['updated_at'] = utils.utcnow()
         LOG.debug("Saving %s: %s" % (self.__class__.__name__, self.__dict__))
-        instance = db.db_api.save(self)
-        return self.find_by(id=self['id'])
+        # Timestamps are set here, in UTC, rather than by the database, so
+        # the merged object is already complete and does not need to be read
+        # back. Migration 019 converted the rows written with MySQL NOW().
+        return db.db_api.save(self)
 
     def update(self, **values):
         attrs = utils.exclude(values, *self._auto_generated_attrs)
@@ -392,7 +638,7 @@ class DatabaseModelBase(ModelBase):
         return result
     
     def delete(self):
-        return self.update(deleted=True, deleted_at=mysql_func.now())   
+        return self.update(deleted=True, deleted_at=utils.utcnow())   
     
     def __init__(self, **kwargs):
         self.merge_attributes(kwargs)
@@ -432,6 +678,58 @@ class DBInstance(DatabaseModelBase):
                     'tenant_id', 'credential', 'address', 'port', 'flavor', 
                     'remote_hostname', 'availability_zone', 'deleted',
                     'updated_at', 'deleted_at']
+
+    @classmethod
+    def find_all_by_hostnames(cls, hostnames):
+        return db.db_api.find_all_in(cls, 'remote_hostname', hostnames,
+                                     deleted=False)
+
+    @classmethod
+    def find_guest_hostnames(cls, states):
+        return db.db_api.find_guest_hostnames(cls, states)
+
+    @classmethod
+    def find_detail_by(cls, **conditions):
+        """Load an instance with its guest state, flavor and security groups.
+
+        Everything comes back from one joined query and is returned as a
+        read-only InstanceDetail.
+        """
+        rows = db.db_api.find_instance_detail(
+            cls, **cls._process_conditions(conditions)).all()
+        if not rows:
+            raise rd_exceptions.ModelNotFoundError(_("%s Not Found") % cls.__name__)
+        instance, state, flavor_id = rows[0][0:3]
+        security_group_ids = []
+        for row in rows:
+            if row[3] is not None and row[3] not in security_group_ids:
+                security_group_ids.append(row[3])
+        return InstanceDetail(instance.data(), state, flavor_id,
+                              security_group_ids)
+
+
+class InstanceDetail(object):
+    """Read-only record of an instance as shown by the API.
+
+    Supports item access to the instance columns like the models do, and
+    carries the guest status, service flavor id and security groups that
+    DBInstanceView needs.
+    """
+
+    def __init__(self, instance_data, guest_state, flavor_id,
+                 security_group_ids):
+        self._data = instance_data
+        self.guest_status = None
+        if guest_state is not None:
+            self.guest_status = {'state': guest_state}
+        self.flavor_id = flavor_id
+        self.security_groups = [{'id': id} for id in security_group_ids] or None
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def data(self):
+        return dict(self._data)
     
 
 class User(DatabaseModelBase):
@@ -444,7 +742,28 @@ class Credential(DatabaseModelBase):
 
 class GuestStatus(DatabaseModelBase):
     _data_fields = ['instance_id', 'state', 'deleted', 
-                    'deleted_at', 'updated_at']
+                    'deleted_at', 'updated_at', 'heartbeat_at']
+
+    @classmethod
+    def update_states(cls, instance_ids, state, from_states=None):
+        """Set the state of many instances with a single UPDATE.
+
+        Only rows in a different state, and in one of from_states when it
+        is given, are written; returns their number.
+        """
+        within = {'state': from_states} if from_states is not None else None
+        return db.db_api.update_all_in(cls, 'instance_id', instance_ids,
+                                       {'deleted': False},
+                                       {'state': state,
+                                        'updated_at': utils.utcnow()},
+                                       changed=['state'], within=within)
+
+    @classmethod
+    def record_heartbeats(cls, instance_ids, heartbeat_at):
+        """Mark the instances as seen alive, without touching updated_at."""
+        return db.db_api.update_all_in(cls, 'instance_id', instance_ids,
+                                       {'deleted': False},
+                                       {'heartbeat_at': heartbeat_at})
     
     def guest_statuses_for_instances(self, instance_ids):
         self.find_all(instance_id.in_(instance_id))
@@ -466,6 +785,107 @@ class ServiceKeypair(DatabaseModelBase):
 class ServiceZone(DatabaseModelBase):
     _data_fields = ['service_name', 'tenant_id', 'availability_zone']
     
+
+
+class ServiceConfigCache(object):
+    """In-process copy of the service configuration tables.
+
+    The zones, images, flavors, keypairs and credentials used to boot
+    instances are only changed by operators, so they are loaded together,
+    indexed in dicts and kept for service_config_cache_ttl seconds. Each
+    reload bumps version. invalidate() drops the copy straight away so an
+    operator's edit is picked up by the next request.
+    """
+
+    class _Snapshot(object):
+
+        def __init__(self, version, loaded_at):
+            self.version = version
+            self.loaded_at = loaded_at
+            self.zones = {}
+            self.images = {}
+            self.flavors = {}
+            self.keypairs = {}
+            self.credentials = {}
+
+    def __init__(self):
+        self._snapshot = None
+        self._version = 0
+        self._lock = semaphore.Semaphore()
+
+    @property
+    def ttl(self):
+        return int(CONFIG.get('service_config_cache_ttl', 300))
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._version += 1
+        LOG.info("Service configuration cache invalidated, version %s"
+                 % self._version)
+
+    def find_zone(self, service_name, tenant_id):
+        return self._lookup('zones', (service_name, tenant_id))
+
+    def find_image(self, service_name, tenant_id, availability_zone):
+        return self._lookup('images',
+                            (service_name, tenant_id, availability_zone))
+
+    def find_flavor(self, service_name, flavor_id):
+        return self._lookup('flavors', (service_name, str(flavor_id)))
+
+    def find_keypair(self, service_name):
+        return self._lookup('keypairs', service_name)
+
+    def find_credential(self, type):
+        return self._lookup('credentials', type)
+
+    def _lookup(self, index, key):
+        model = getattr(self.snapshot(), index).get(key)
+        if model is None:
+            raise rd_exceptions.ModelNotFoundError(
+                _("%s %s Not Found") % (index, key))
+        return model
+
+    def snapshot(self):
+        """Returns the current copy of the tables, reloading it if expired."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.time() - snapshot.loaded_at < self.ttl:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.time() - snapshot.loaded_at >= self.ttl:
+                self._version += 1
+                snapshot = self._load(self._version)
+                self._snapshot = snapshot
+        return snapshot
+
+    def _load(self, version):
+        snapshot = self._Snapshot(version, time.time())
+        for zone in ServiceZone.find_all(deleted=False):
+            snapshot.zones.setdefault(
+                (zone['service_name'], zone['tenant_id']), zone)
+        for image in ServiceImage.find_all(deleted=False):
+            snapshot.images.setdefault((image['service_name'],
+                                        image['tenant_id'],
+                                        image['availability_zone']), image)
+        for flavor in ServiceFlavor.find_all(deleted=False):
+            snapshot.flavors.setdefault(
+                (flavor['service_name'], str(flavor['flavor_id'])), flavor)
+        for keypair in ServiceKeypair.find_all(deleted=False):
+            snapshot.keypairs.setdefault(keypair['service_name'], keypair)
+        for credential in Credential.find_all(deleted=False):
+            snapshot.credentials.setdefault(credential['type'], credential)
+        LOG.debug("Loaded service configuration cache version %s" % version)
+        return snapshot
+
+
+service_config_cache = ServiceConfigCache()
+
 class Snapshot(DatabaseModelBase):
     _data_fields = ['instance_id', 'name', 'state', 'user_id', 
                     'tenant_id', 'storage_uri', 'credential', 'storage_size',
@@ -482,6 +902,30 @@ class Snapshot(DatabaseModelBase):
 class Quota(DatabaseModelBase):
     _data_fields = ['tenant_id', 'resource', 'hard_limit']
     
+class QuotaUsage(DatabaseModelBase):
+    """Running total of a tenant's use of one quota resource.
+
+    in_use is what exists, reserved is what is being created right now.
+    """
+    _data_fields = ['tenant_id', 'resource', 'in_use', 'reserved',
+                    'deleted', 'updated_at']
+
+    @classmethod
+    def find_for_update(cls, tenant_id, resource):
+        """Read the usage row and lock it until the unit of work ends."""
+        return db.db_api.find_by_for_update(cls, tenant_id=tenant_id,
+                                            resource=resource)
+
+
+class Reservation(DatabaseModelBase):
+    """Quota held for a resource until it is created, or expire passes."""
+    _data_fields = ['usage_id', 'tenant_id', 'resource', 'delta', 'expire',
+                    'deleted', 'updated_at', 'deleted_at']
+
+    @classmethod
+    def find_expired(cls, now):
+        return db.db_api.find_expired_reservations(cls, now)
+
 class DBVolume(DatabaseModelBase):
     _data_fields = ['volume_id', 'instance_id', 'size', 'availability_zone']
     
@@ -495,6 +939,46 @@ class SecurityGroupRule(DatabaseModelBase):
 class SecurityGroupInstanceAssociation(DatabaseModelBase):
     _data_fields = ['security_group_id', 'instance_id']
        
+class ProvisioningTask(DatabaseModelBase):
+    """Progress of an instance being built by the task manager.
+
+    step is the next step to run (see STEPS), state is one of pending,
+    running, done or failed, and payload holds the JSON encoded boot
+    parameters the steps need.
+    """
+    _data_fields = ['instance_id', 'step', 'state', 'attempts', 'payload',
+                    'last_error', 'deleted', 'updated_at', 'deleted_at']
+
+    STEPS = ['security_group', 'server', 'floating_ip', 'volume', 'worker']
+
+
+class Operation(DatabaseModelBase):
+    """A guest action the API cast without waiting for the agent.
+
+    state is pending until the agent phones home with success or failed,
+    or until guest_operation_timeout seconds pass without an answer.
+    """
+    _data_fields = ['tenant_id', 'instance_id', 'action', 'state', 'error',
+                    'deleted', 'updated_at', 'deleted_at']
+
+    def expire_if_stale(self):
+        """Fail a pending operation the agent never reported on."""
+        timeout = int(CONFIG.get('guest_operation_timeout', 600))
+        cutoff = utils.utcnow() - datetime.timedelta(seconds=timeout)
+        if self['state'] == 'pending' and self['created_at'] < cutoff:
+            return self.update(state='failed',
+                               error='The guest did not report back in time.')
+        return self
+
+    @classmethod
+    def delete_for_instance(cls, instance_id):
+        """Soft-delete the operations of an instance, so they get archived."""
+        return db.db_api.update_all_in(cls, 'instance_id', [instance_id],
+                                       {'deleted': False},
+                                       {'deleted': True,
+                                        'deleted_at': utils.utcnow()})
+
+
 def persisted_models():
     return {
         'instance': DBInstance,
@@ -505,8 +989,12 @@ def persisted_models():
         'service_flavor': ServiceFlavor,
         'snapshot': Snapshot,
         'quota': Quota,
+        'quota_usage': QuotaUsage,
+        'reservation': Reservation,
         'service_secgroup': ServiceSecgroup,
         'service_keypair': ServiceKeypair,
         'service_zone': ServiceZone,
-        'volume' : DBVolume
+        'volume' : DBVolume,
+        'provisioning_task': ProvisioningTask,
+        'operation': Operation
     }
@@ -15,15 +15,28 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import datetime
 import logging
 
 from reddwarf import db
 from reddwarf.common import config
+from reddwarf.common import exception
+from reddwarf.common import utils
 from reddwarf.database import models
 
 CONFIG = config.Config
 LOG = logging.getLogger(__name__)
 
+# Hard limits per tenant, kept for quota_limits_cache_ttl seconds
+_limits_cache = utils.LRUCache(max_size=10000)
+
+# Error raised by reserve() for each resource
+LIMIT_EXCEEDED = {
+    'instances': 'InstanceLimitExceeded',
+    'snapshots': 'SnapshotLimitExceeded',
+    'volume_space': 'VolumeSizeLimitExceeded',
+}
+
 def _get_default_quotas():
     defaults = {
         'instances': CONFIG.get('quota_instances', 0),
@@ -37,64 +50,162 @@ def _get_default_quotas():
     return defaults
 
 def get_tenant_quotas(context, tenant_id):
-    defaults = _get_default_quotas()
-    quotas = models.Quota.find_all(tenant_id=tenant_id, deleted=False)
-    
-    if quotas is None:
-        return defaults
-    
-    for key in defaults.keys():
-        for quota in quotas:
-            if key == quota['resource']:
-                defaults[key] = quota['hard_limit']
-                break
-    return defaults
+    limits = _limits_cache.get(tenant_id)
+    if limits is None:
+        limits = _get_default_quotas()
+        overridden = set()
+        for quota in models.Quota.find_all(tenant_id=tenant_id, deleted=False) or []:
+            resource = quota['resource']
+            if resource in limits and resource not in overridden:
+                limits[resource] = quota['hard_limit']
+                overridden.add(resource)
+        _limits_cache.set(tenant_id, limits,
+                          ttl=int(CONFIG.get('quota_limits_cache_ttl', 30)))
+    return dict(limits)
 
-def allowed_instances(context, requested_instances):
-    """Check quota and return min(requested_instances, allowed_instances)."""
-    tenant_id = context.tenant
-    
-    usage = models.DBInstance.find_all(tenant_id=tenant_id, deleted=False).count()
-    quota = get_tenant_quotas(context, tenant_id)
-    LOG.debug('Quota for num of instances allowed to create %s, requested %s, used %s' % (quota, requested_instances, usage))
+def invalidate_limits(tenant_id=None):
+    """Drop the cached limits of a tenant, or of every tenant."""
+    if tenant_id is None:
+        _limits_cache.clear()
+    else:
+        _limits_cache.delete(tenant_id)
 
-    allowed_instances = quota['instances'] - usage
+def _count_usage(tenant_id, resource):
+    """Count what a tenant uses of a resource from the live tables."""
+    if resource == 'instances':
+        return models.DBInstance.find_all(tenant_id=tenant_id, deleted=False).count()
+    if resource == 'snapshots':
+        return models.Snapshot.find_all(tenant_id=tenant_id, deleted=False).count()
 
-    return min(requested_instances, allowed_instances)
+    return int(models.DBVolume.find_all(tenant_id=tenant_id, deleted=False).sum('size'))
 
-def allowed_snapshots(context, requested_snapshots):
-    """Check quota and return min(requested_snapshots, allowed_snapshots)."""
+def _get_usage(tenant_id, resource):
+    """Return the usage row of a resource, counting it on first use."""
+    usage = models.QuotaUsage.get_by(tenant_id=tenant_id, resource=resource)
+    if usage is None:
+        try:
+            usage = models.QuotaUsage.create(tenant_id=tenant_id,
+                                             resource=resource,
+                                             in_use=_count_usage(tenant_id, resource),
+                                             reserved=0)
+        except exception.DBConstraintError:
+            # Another request created it first
+            usage = models.QuotaUsage.find_by(tenant_id=tenant_id,
+                                              resource=resource)
+    return usage
+
+def _allowed(context, resource, requested):
+    """min(requested, what is left of the quota); requested if unlimited."""
     tenant_id = context.tenant
-    
-    usage = models.Snapshot.find_all(tenant_id=tenant_id, deleted=False).count()
+
+    usage = _get_usage(tenant_id, resource)
     quota = get_tenant_quotas(context, tenant_id)
-    LOG.debug('Quota for num of instances allowed to create %s, requested %s, used %s' % (quota, requested_snapshots, usage))
+    LOG.debug('Quota for %s allowed to create %s, requested %s, used %s'
+              % (resource, quota, requested, usage['in_use']))
 
-    allowed_snapshots = quota['snapshots'] - usage
+    limit = quota[resource]
+    if limit is None:
+        return requested
+    return min(requested, limit - usage['in_use'] - usage['reserved'])
 
-    return min(requested_snapshots, allowed_snapshots)
+def allowed_instances(context, requested_instances):
+    """Check quota and return min(requested_instances, allowed_instances)."""
+    return _allowed(context, 'instances', requested_instances)
+
+def allowed_snapshots(context, requested_snapshots):
+    """Check quota and return min(requested_snapshots, allowed_snapshots)."""
+    return _allowed(context, 'snapshots', requested_snapshots)
 
 def allowed_volume_size(context, requested_volume_size):
     """Check quota for volumes and return min(requested_volume_size, remaining_volume_size)"""
+    return _allowed(context, 'volume_space', requested_volume_size)
+
+def reserve(context, **deltas):
+    """Hold quota for resources that are about to be created.
+
+    deltas maps resource names to the amount wanted, e.g. instances=1.
+    The usage rows are locked while they are checked and updated, so two
+    concurrent requests cannot both take the last of a quota. Raises
+    QuotaError, reserving nothing, if any resource would go over its
+    limit. Returns the reservation ids to pass to commit or rollback.
+    """
     tenant_id = context.tenant
-    
-    usage = 0
-    volumes = models.DBVolume.find_all(tenant_id=tenant_id, deleted=False)
-    if volumes is not None:
-        for volume in volumes:
-            size = int(volume['size'])
-            usage += size
-            
+    # Usage rows are created outside the locking transaction
+    for resource in deltas:
+        _get_usage(tenant_id, resource)
     quota = get_tenant_quotas(context, tenant_id)
-    LOG.debug('Quota for volume space allowed to create %s, requested %s, used %s' % (quota, requested_volume_size, usage))
-
-    allowed_space = quota['volume_space'] - usage
-
-    return min(requested_volume_size, allowed_space)
-            
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+    expire = utils.utcnow() + datetime.timedelta(
+        seconds=int(CONFIG.get('quota_reservation_expire', 86400)))
+
+    reservations = []
+    with db.unit_of_work():
+        # Always lock in the same order so requests cannot deadlock
+        for resource in sorted(deltas):
+            delta = deltas[resource]
+            usage = models.QuotaUsage.find_for_update(tenant_id, resource)
+            limit = quota[resource]
+            if (limit is not None and delta > 0 and
+                usage['in_use'] + usage['reserved'] + delta > limit):
+                LOG.warn("Quota exceeded for %s, tried to reserve %s %s "
+                         "(limit %s, in use %s, reserved %s)"
+                         % (tenant_id, delta, resource, limit,
+                            usage['in_use'], usage['reserved']))
+                raise exception.QuotaError(LIMIT_EXCEEDED[resource],
+                                           resource=resource, limit=limit)
+            usage.update(reserved=usage['reserved'] + delta)
+            reservation = models.Reservation.create(usage_id=usage['id'],
+                                                    tenant_id=tenant_id,
+                                                    resource=resource,
+                                                    delta=delta,
+                                                    expire=expire)
+            reservations.append(reservation['id'])
+    return reservations
+
+def _finish(reservations, used):
+    """Remove reservations, adding them to in_use if they were used."""
+    with db.unit_of_work():
+        for reservation_id in reservations:
+            reservation = models.Reservation.get_by(id=reservation_id)
+            if reservation is None:
+                # Already committed, rolled back or expired
+                continue
+            usage = models.QuotaUsage.find_for_update(reservation['tenant_id'],
+                                                      reservation['resource'])
+            delta = reservation['delta']
+            in_use = usage['in_use']
+            if used:
+                in_use = max(in_use + delta, 0)
+            usage.update(in_use=in_use,
+                         reserved=max(usage['reserved'] - delta, 0))
+            db.db_api.delete(reservation)
+
+def commit(context, reservations):
+    """Turn reservations into usage.
+
+    Called in the unit of work that writes the new resource's rows, so
+    the usage changes together with them.
+    """
+    _finish(reservations, True)
+
+def rollback(context, reservations):
+    """Give back reservations that were not committed."""
+    _finish(reservations, False)
+
+def release(context, **deltas):
+    """Take deleted resources off the tenant's usage.
+
+    Called in the unit of work that deletes the resource's rows.
+    """
+    with db.unit_of_work():
+        for resource in sorted(deltas):
+            usage = models.QuotaUsage.find_for_update(context.tenant, resource)
+            # Without a row the usage is counted afresh on first use
+            if usage is not None:
+                usage.update(in_use=max(usage['in_use'] - deltas[resource], 0))
+
+def expire_reservations():
+    """Roll back reservations left behind by requests that died."""
+    expired = models.Reservation.find_expired(utils.utcnow())
+    if expired:
+        LOG.info("Expiring %s quota reservations" % len(expired))
+        rollback(None, [reservation['id'] for reservation in expired])
@@ -17,6 +17,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
 import logging
 import urlparse
 import routes
@@ -34,6 +35,7 @@ from reddwarf.common import wsgi
 from reddwarf.database import models
 from reddwarf.database import views
 from reddwarf.database import guest_api
+from reddwarf.database import taskmanager_api
 from reddwarf.database import worker_api
 from reddwarf.database import quota
 from reddwarf.admin import service as admin
@@ -50,6 +52,12 @@ CONFIG = config.Config
 LOG = logging.getLogger(__name__)
 Sanitizer = Sanitizer()
 
+def _prefers_async(req):
+    """Whether the client sent 'Prefer: respond-async' (RFC 7240)."""
+    prefer = req.headers.get('Prefer', '')
+    return 'respond-async' in [p.strip().lower() for p in prefer.split(',')]
+
+
 class InstanceController(wsgi.Controller):
     """Controller for instance functionality"""
     
@@ -92,27 +100,29 @@ class InstanceController(wsgi.Controller):
         context = req.context
         LOG.debug("Context: %s" % context.to_dict())
         
-        servers = models.DBInstance().find_all(tenant_id=tenant_id, deleted=False)
-        LOG.debug(servers)
-        
-        flavors = models.ServiceFlavor().find_all()
-        flavor_list = []  # add a dummy value to fill index 0
-        for flavor in flavors:
-            flavor_list.append(flavor)
-        LOG.debug(flavor_list)
-        
-        id_list = []
-        server_list = []
-        for server in servers:
-            id_list.append(server['id'])
-            server['flavor'] = flavor_list[int(server['flavor'])]['flavor_id']
-            server_list.append(server)
-            
-        guest_states = self.get_guest_state_mapping(id_list)    
-        
+        limits = self._extract_limits(req.GET)
+        max_limit = int(config.Config.get('max_instances_per_page', 200))
+        try:
+            limit = int(limits.get('limit', max_limit))
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            return wsgi.Result(errors.wrap(errors.Input.NONINTEGER_LIMIT), 400)
+        limit = min(limit, max_limit)
+
+        marker = limits.get('marker')
+        if marker is not None and not Sanitizer.whitelist_uuid(marker):
+            return wsgi.Result(errors.wrap(errors.Input.NONALLOWED_CHARACTERS_ID), 400)
+
+        # One joined query returns the page together with each instance's
+        # guest state and flavor id.
+        servers, next_marker = db.db_query.find_instance_summaries(
+            models.DBInstance, tenant_id=tenant_id, deleted=False)\
+            .paginated_collection(limit=limit, marker=marker)
+
         LOG.debug("Index() executed correctly")
         # TODO(cp16net): need to set the return code correctly
-        return wsgi.Result(views.DBInstancesView(server_list, guest_states, req, tenant_id).list(), 200)
+        return wsgi.Result(views.DBInstancesView(servers, req, tenant_id, limit, next_marker).list(), 200)
 
     def show(self, req, tenant_id, id):
         """Return a single instance."""
@@ -128,35 +138,25 @@ class InstanceController(wsgi.Controller):
             return wsgi.Result(errors.wrap(errors.Input.NONALLOWED_CHARACTERS_ID))
         
         try:
-            server = models.DBInstance().find_by(id=id, tenant_id=tenant_id, deleted=False)
+            server = models.DBInstance.find_detail_by(id=id, tenant_id=tenant_id, deleted=False)
         except exception.ReddwarfError, e:
             LOG.exception("Exception occurred when finding instance by id %s" % id)
             return wsgi.Result(errors.wrap(errors.Instance.NOT_FOUND), 404)
 
-        try:
-            guest_status = models.GuestStatus().find_by(instance_id=server['id'], deleted=False)
-        except exception.ReddwarfError, e:
-            LOG.exception("Exception occurred when finding instance guest_status by id %s" % id)
+        if server.guest_status is None:
+            LOG.error("No guest_status found for instance id %s" % id)
             return wsgi.Result(errors.wrap(errors.Instance.NOT_FOUND), 404)
-        
-        try:
-            flavor = models.ServiceFlavor().find_by(id=server['flavor'], deleted=False)
-        except exception.ReddwarfError, e:
-            LOG.exception("Exception occurred when finding service flavor for instance id %s" % id)
+
+        if server.flavor_id is None:
+            LOG.error("No service flavor found for instance id %s" % id)
             return wsgi.Result(errors.wrap(errors.Instance.FLAVOR_NOT_FOUND), 404)
 
-        # Find the security group associated with this server
-        secgroups = None
-        try:
-            secgroup_association = security_group_models.SecurityGroupInstances().find_by(instance_id=server['id'], deleted=False)
-            secgroups = [ security_group_models.SecurityGroup().find_by(id=secgroup_association['security_group_id'], deleted=False) ]
-        except exception.ModelNotFoundError as e:
-            # instances created prior to Security Groups feature will not have a security group
-            pass
+        # Instances created prior to the Security Groups feature have no
+        # security group, in which case server.security_groups is None.
 
         # TODO(cp16net): need to set the return code correctly
         LOG.debug("Show() executed correctly")
-        return wsgi.Result(views.DBInstanceView(server, guest_status, secgroups, req, tenant_id, flavor['flavor_id']).show(), 200)
+        return wsgi.Result(views.DBInstanceView(server, server.guest_status, server.security_groups, req, tenant_id, server.flavor_id).show(), 200)
 
     def delete(self, req, tenant_id, id):
         """Delete a single instance."""
@@ -213,43 +213,63 @@ class InstanceController(wsgi.Controller):
                           tenant=tenant_id)
         
         try:
-            num_instances = self._check_instance_quota(context, 1)
+            instance_reservations = self._reserve_instance_quota(context, 1)
         except exception.QuotaError, e:
             LOG.exception("Quota Error encountered for tenant %s" % tenant_id)
-            maximum_instances_allowed = quota.get_tenant_quotas(context, context.tenant)['instances']
+            maximum_instances_allowed = e.limit
             return wsgi.Result(errors.wrap(errors.Instance.QUOTA_EXCEEDED, "You are only allowed to create %s instances on you account." % maximum_instances_allowed), 413)
-        
-        # Extract any snapshot info from the request
-        snapshot = None
-        snapshot_support = CONFIG.get('reddwarf_snapshot_support', True)
-        if utils.bool_from_string(snapshot_support):
-            try:
-                snapshot = self._extract_snapshot(body, tenant_id)
-            except exception.ReddwarfError, e:
-                LOG.exception("Error creating new instance")
-                return wsgi.Result(errors.wrap(errors.Snapshot.NOT_FOUND), 500)
-            except Exception, e:
-                LOG.exception("Error creating new instance")
-                return wsgi.Result(errors.wrap(errors.Instance.MALFORMED_BODY), 500)
 
-        # Extract volume size info from the request and check Quota
+        # Extract volume size info from the request and reserve its Quota
         try:
             volume_size = self._extract_volume_size(body)
             if volume_size is None:
                 volume_size = config.Config.get('default_volume_size', 20)
             
-            self._check_volume_size_quota(context, volume_size)
+            volume_reservations = self._reserve_volume_size_quota(context, volume_size)
         except exception.BadValue, e:
             LOG.exception("Bad value for volume size")
+            quota.rollback(context, instance_reservations)
             return wsgi.Result(errors.wrap(errors.Instance.MALFORMED_BODY, 'Invalid volume size'), 400)
         except exception.QuotaError, e:
             LOG.exception("Unable to allocate volume, Volume Size Quota has been exceeded")
-            maximum_snapshots_allowed = quota.get_tenant_quotas(context, context.tenant)['volume_space']
+            quota.rollback(context, instance_reservations)
+            maximum_snapshots_allowed = e.limit
             return wsgi.Result(errors.wrap(errors.Instance.VOLUME_QUOTA_EXCEEDED, "You are only allowed to allocate %s GBs of Volume Space for your account." % maximum_snapshots_allowed), 413)
         except exception.ReddwarfError, e:
             LOG.exception()
+            quota.rollback(context, instance_reservations)
             return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE), 500)
-        
+
+        # Quota is committed together with the rows of what was created.
+        # Whatever is left is given back, except the volume space that an
+        # asynchronous create (202) hands on to the task manager.
+        reservations = instance_reservations + volume_reservations
+        try:
+            result = self._create_instance(req, body, tenant_id, context,
+                                           volume_size, instance_reservations,
+                                           volume_reservations)
+        except Exception:
+            quota.rollback(context, reservations)
+            raise
+        if result.status != 202:
+            quota.rollback(context, reservations)
+        return result
+
+    def _create_instance(self, req, body, tenant_id, context, volume_size,
+                         instance_reservations, volume_reservations):
+        # Extract any snapshot info from the request
+        snapshot = None
+        snapshot_support = CONFIG.get('reddwarf_snapshot_support', True)
+        if utils.bool_from_string(snapshot_support):
+            try:
+                snapshot = self._extract_snapshot(body, tenant_id)
+            except exception.ReddwarfError, e:
+                LOG.exception("Error creating new instance")
+                return wsgi.Result(errors.wrap(errors.Snapshot.NOT_FOUND), 500)
+            except Exception, e:
+                LOG.exception("Error creating new instance")
+                return wsgi.Result(errors.wrap(errors.Instance.MALFORMED_BODY), 500)
+
         # Extract flavor info from the request
         try:
             flavor_ref = body['instance']['flavorRef']
@@ -274,18 +294,38 @@ class InstanceController(wsgi.Controller):
             return wsgi.Result(errors.wrap(errors.Instance.MALFORMED_BODY), 500)
                     
             
-        # Fetch all boot parameters from Database
+        password = utils.generate_password()
+
+        async_provisioning = CONFIG.get('reddwarf_async_provisioning', 'False')
+        if utils.bool_from_string(async_provisioning):
+            # Fetch all boot parameters from Database
+            try:
+                image_id, flavor, keypair_name, region_az, credential = self._load_boot_params(tenant_id, flavor_id)
+            except exception.ModelNotFoundError:
+                return wsgi.Result(errors.wrap(errors.Instance.FLAVOR_NOT_FOUND_CREATE), 404)
+
+            return self._create_async(req, context, body, tenant_id,
+                                      credential, region_az, keypair_name,
+                                      image_id, flavor, snapshot, password,
+                                      volume_size, instance_reservations,
+                                      volume_reservations)
+
+        # The security group does not depend on the boot parameters, so it
+        # is created while they are fetched from the Database
+        secgroup = None
         try:
-            image_id, flavor, keypair_name, region_az, credential = self._load_boot_params(tenant_id, flavor_id)
+            boot_params, secgroup = utils.run_concurrently([
+                (self._load_boot_params, (tenant_id, flavor_id), None),
+                (self._try_create_security_group, (req, context, body['instance']['name'], 3306),
+                 lambda secgroup: self._delete_security_group(req, context, secgroup))])
+            image_id, flavor, keypair_name, region_az, credential = boot_params
         except exception.ModelNotFoundError:
             return wsgi.Result(errors.wrap(errors.Instance.FLAVOR_NOT_FOUND_CREATE), 404)
+        except exception.ReddwarfError, e:
+            LOG.exception("Error creating DBaaS Instance security group")
+            return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Instance creation failure"), 500)
 
-        password = utils.generate_password()
-        
-        
-        
         try:
-            secgroup = self._try_create_security_group(req, context, body['instance']['name'], 3306)
             db_secgroup = security_group_models.SecurityGroup().find_by(id=secgroup['security_group']['id'], deleted=False)
             
             remote_secgroups = [db_secgroup['remote_secgroup_name']]
@@ -299,7 +339,8 @@ class InstanceController(wsgi.Controller):
                                                                         image_id, 
                                                                         flavor, 
                                                                         snapshot, 
-                                                                        password)
+                                                                        password,
+                                                                        instance_reservations)
         except exception.SecurityGroupCreationFailure, e:
             LOG.exception("Error creating DBaaS Instance")
             return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Instance creation failure"), 500)
@@ -311,9 +352,8 @@ class InstanceController(wsgi.Controller):
                 LOG.exception("Error creating DBaaS instance")
                 #Cleanup
                 try:
-                    if secgroup is not None:
-                        secgroup = security_group.SecurityGroupController().delete(req, context.tenant, secgroup['security_group']['id'])
-                except exception.SecurityGroupDeletionFailure, e:
+                    self._delete_security_group(req, context, secgroup)
+                except exception.ReddwarfError, e:
                     LOG.error("Failed to delete Security Group after Instance Creation Failure. Ignoring..")
                     
                 return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Instance creation failure"), 500)
@@ -322,24 +362,25 @@ class InstanceController(wsgi.Controller):
             security_group_models.SecurityGroupInstances().create(security_group_id=secgroup['security_group']['id'],
                                                                   instance_id=instance['id'])
 
-        #Attempt to assign a floating ip to the server instance
+        # Assign a floating ip and attach a volume to the server instance at
+        # the same time; if either fails the other one is rolled back
         try:
-            floating_ip = self._try_assign_floating_ip(credential, region_az, instance['remote_id'])
+            floating_ip, db_volume = utils.run_concurrently([
+                (self._try_assign_floating_ip, (credential, region_az, instance['remote_id']),
+                 lambda floating_ip: self._release_floating_ip(credential, region_az, floating_ip, instance['remote_id'])),
+                (self._try_attach_volume, (context, body, credential, region_az, volume_size, instance, volume_reservations),
+                 lambda db_volume: self._detach_volume(credential, region_az, db_volume, instance))])
+        except (exception.VolumeCreationFailure, exception.VolumeAttachmentFailure), e:
+            LOG.exception("Error creating DBaaS instance - volume attachment failed")
+            return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Volume Attachment failure"), 500)
         except Exception as e:
             LOG.exception("Error obtaining or assigning floating ip for db instance")
             return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Floating ip fetch/attachment Failure"), 500)
-        else:
-            try:
-                instance.update(address=floating_ip['ip'])
-            except Exception as e:
-                LOG.error("Error updating DBass Instance table for floating ip")
 
-        # Attempt to attach a volume
         try:
-            self._try_attach_volume(context, body, credential, region_az, volume_size, instance)
-        except exception.ReddwarfError, e:
-            LOG.exception("Error creating DBaaS instance - volume attachment failed")
-            return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE, "Volume Attachment failure"), 500)
+            instance.update(address=floating_ip['ip'])
+        except Exception as e:
+            LOG.error("Error updating DBass Instance table for floating ip")
         
         # Invoke worker to ensure instance gets created
         worker_api.API().ensure_create_instance(None, instance, file_dict_as_userdata(file_dict))
@@ -429,6 +470,10 @@ class InstanceController(wsgi.Controller):
                           auth_tok=req.headers["X-Auth-Token"],
                           tenant=tenant_id)
 
+        if _prefers_async(req):
+            return self._reset_password_async(req, context, tenant_id, id,
+                                              password)
+
         # Dispatch the job to Smart Agent
         try:
             result = guest_api.API().reset_password(context, id, password)
@@ -447,22 +492,94 @@ class InstanceController(wsgi.Controller):
             return wsgi.Result(errors.wrap(errors.Instance.RESET_PASSWORD), 500)
 
 
-    def _try_create_server(self, context, body, credential, region, sec_groups, keypair, image_id, flavor, snapshot=None, password=None):
+    def _reset_password_async(self, req, context, tenant_id, id, password):
+        """Cast the reset and answer 202 with an operation to poll."""
+        operation = models.Operation().create(tenant_id=tenant_id,
+                                              instance_id=id,
+                                              action='reset-password',
+                                              state='pending')
+        try:
+            guest_api.API().reset_password_async(context, id, password,
+                                                 operation['id'])
+        except exception.NotFound as nf:
+            LOG.exception("unable to reset password for instance: %s" % id)
+            operation.delete()
+            return wsgi.Result(errors.wrap(errors.Instance.NOT_FOUND), 404)
+        except exception.ReddwarfError as e:
+            LOG.exception("Failed to cast password reset to Smart Agent.")
+            operation.update(state='failed', error=str(e))
+            return wsgi.Result(errors.wrap(errors.Instance.RESET_PASSWORD), 500)
+
+        view = views.OperationView(operation, req, tenant_id)
+        result = view.show()
+        result['password'] = password
+        return wsgi.Result(result, 202, headers={'Location': view.href()})
+
+
+    def _create_async(self, req, context, body, tenant_id, credential, region,
+                      keypair_name, image_id, flavor, snapshot, password,
+                      volume_size, instance_reservations, volume_reservations):
+        """Record the new instance and leave the building to the task manager.
+
+        Only database rows are written here. The security group, Nova
+        server, floating ip and volume are created by the task manager's
+        provisioning task, which is resumed if it is interrupted.
+        """
+        try:
+            file_dict = self._create_boot_config_file(snapshot, password)
+            payload = {'image_id': image_id,
+                       'flavor_id': flavor['flavor_id'],
+                       'keypair_name': keypair_name,
+                       'volume_size': volume_size,
+                       'volume_reservations': volume_reservations,
+                       'userdata': file_dict_as_userdata(file_dict)}
+
+            with db.unit_of_work():
+                instance = models.DBInstance().create(name=body['instance']['name'],
+                                         status='building',
+                                         user_id=context.user,
+                                         tenant_id=context.tenant,
+                                         credential=credential['id'],
+                                         port='3306',
+                                         flavor=flavor['id'],
+                                         availability_zone=region)
+                guest_status = models.GuestStatus().create(instance_id=instance['id'], state='scheduling')
+                task = models.ProvisioningTask().create(instance_id=instance['id'],
+                                                        step=models.ProvisioningTask.STEPS[0],
+                                                        state='pending',
+                                                        attempts=0,
+                                                        payload=json.dumps(payload))
+                quota.commit(context, instance_reservations)
+        except exception.ReddwarfError, e:
+            LOG.exception("Error creating DB Instance records")
+            return wsgi.Result(errors.wrap(errors.Instance.REDDWARF_CREATE), 500)
+
+        try:
+            taskmanager_api.API().provision_instance(context, task['id'])
+        except Exception:
+            # The task manager resumes tasks that were never picked up.
+            LOG.exception("Could not cast provisioning task %s" % task['id'])
+
+        return wsgi.Result(views.DBInstanceView(instance, guest_status, [], req, tenant_id, flavor['flavor_id']).create('dbas', password), 202)
+
+    def _try_create_server(self, context, body, credential, region, sec_groups, keypair, image_id, flavor, snapshot=None, password=None, reservations=None):
         """Create remote Server """
         # Create DB Instance record
         try:
-            instance = models.DBInstance().create(name=body['instance']['name'],
-                                     status='building',
-                                     user_id=context.user,
-                                     tenant_id=context.tenant,
-                                     credential=credential['id'],
-                                     port='3306',
-                                     flavor=flavor['id'],
-                                     availability_zone=region)
-
-            LOG.debug("Wrote DB Instance: %s" % instance)
-
-            guest_status = models.GuestStatus().create(instance_id=instance['id'], state='scheduling')
+            with db.unit_of_work():
+                instance = models.DBInstance().create(name=body['instance']['name'],
+                                         status='building',
+                                         user_id=context.user,
+                                         tenant_id=context.tenant,
+                                         credential=credential['id'],
+                                         port='3306',
+                                         flavor=flavor['id'],
+                                         availability_zone=region)
+
+                LOG.debug("Wrote DB Instance: %s" % instance)
+
+                guest_status = models.GuestStatus().create(instance_id=instance['id'], state='scheduling')
+                quota.commit(context, reservations or [])
         
         except exception.ReddwarfError, e:
             LOG.exception("Error creating DB Instance record")
@@ -486,11 +603,13 @@ class InstanceController(wsgi.Controller):
             else:
 
                 # update instance and guest_status
-                instance.update(remote_id=server['id'],
-                                remote_uuid=server['uuid'],
-                                remote_hostname=server['name'])
+                with db.unit_of_work():
+                    instance.update(remote_id=server['id'],
+                                    remote_uuid=server['uuid'],
+                                    remote_hostname=server['name'])
+                    guest_api.invalidate_routing_key(instance['id'])
                 
-                guest_status.update(state='building')
+                    guest_status.update(state='building')
                 
 
             LOG.debug("Wrote remote server: %s" % server)
@@ -503,6 +622,7 @@ class InstanceController(wsgi.Controller):
 
     def _try_assign_floating_ip(self, credential, region, server_id):
 
+        floating_ip = None
         try:
             # fetch a free floating ip or allocate one if none is available
             LOG.debug("Attempt to fetch a floating IP")
@@ -514,14 +634,27 @@ class InstanceController(wsgi.Controller):
 
         except Exception:
 #            eventlet.sleep(5)
-            LOG.error("Failed to assign IP %s to instance %s" % (floating_ip['ip'], server_id))
+            LOG.error("Failed to assign IP %s to instance %s" % (floating_ip and floating_ip['ip'], server_id))
+            if floating_ip is not None:
+                self._release_floating_ip(credential, region, floating_ip, server_id)
             raise exception.ReddwarfError(errors.Instance.IP_ASSIGN)
 
         else:
             return floating_ip
 
+    def _release_floating_ip(self, credential, region, floating_ip, server_id):
+        """Unassign a floating ip and give it back to the tenant's pool."""
+        try:
+            models.FloatingIP.unassign(credential, region, floating_ip, server_id)
+        except exception.ReddwarfError:
+            LOG.debug("Floating ip %s was not assigned to %s" % (floating_ip['ip'], server_id))
+        try:
+            models.FloatingIP.release(credential, region, floating_ip)
+        except exception.ReddwarfError:
+            LOG.exception("Failed to release floating ip %s" % floating_ip['ip'])
+
 
-    def _try_attach_volume(self, context, body, credential, region, volume_size, instance):
+    def _try_attach_volume(self, context, body, credential, region, volume_size, instance, reservations=None):
         
         volume_support = CONFIG.get('reddwarf_volume_support', 'False')
         if not utils.bool_from_string(volume_support):
@@ -537,11 +670,13 @@ class InstanceController(wsgi.Controller):
         else:
             LOG.debug("Created remote volume %s of size %s" % (volume['id'], volume_size))
             try:
-                db_volume = models.DBVolume().create(volume_id=volume['id'],
-                                                     size=volume_size,
-                                                     availability_zone=region,
-                                                     instance_id="TBD",
-                                                     tenant_id=context.tenant)
+                with db.unit_of_work():
+                    db_volume = models.DBVolume().create(volume_id=volume['id'],
+                                                         size=volume_size,
+                                                         availability_zone=region,
+                                                         instance_id="TBD",
+                                                         tenant_id=context.tenant)
+                    quota.commit(context, reservations or [])
                 
             except Exception as e:
                 LOG.exception("Failed to write DB Volume record for instance volume")
@@ -564,7 +699,7 @@ class InstanceController(wsgi.Controller):
                 LOG.exception("Failed to delete volume after attachment failure")
             else:
                 # Delete the DB volume record as well
-                db_volume.delete()
+                self._delete_db_volume(db_volume)
             
             raise exception.VolumeAttachmentFailure(e)
         else:
@@ -573,7 +708,27 @@ class InstanceController(wsgi.Controller):
                 db_volume.update(instance_id=instance['id'])
             except Exception as e:
                 LOG.exception("Failed to update DB Volume with instance id")
-                raise exception.ReddwarfError(e)
+                raise exception.VolumeAttachmentFailure(e)
+        return db_volume
+
+    def _detach_volume(self, credential, region, db_volume, instance):
+        """Detaches and deletes a volume attached by _try_attach_volume"""
+        if db_volume is None:
+            return
+        models.Volume.detach(credential, region, instance['remote_id'], db_volume['volume_id'])
+        models.Volume.delete(credential, region, db_volume['volume_id'])
+        self._delete_db_volume(db_volume)
+
+    def _delete_db_volume(self, db_volume):
+        """Delete a DB Volume record and give its space back to the quota"""
+        context = rd_context.ReddwarfContext(tenant=db_volume['tenant_id'])
+        with db.unit_of_work():
+            db_volume.delete()
+            quota.release(context, volume_space=int(db_volume['size']))
+
+    def _delete_security_group(self, req, context, secgroup):
+        if secgroup is not None:
+            security_group.SecurityGroupController().delete(req, context.tenant, secgroup['security_group']['id'])
 
     def _try_delete_instance(self, req, context, credential, server, db_volume):
         
@@ -610,7 +765,7 @@ class InstanceController(wsgi.Controller):
                 
                 # Delete the DB Volume Record
                 try:
-                    db_volume = db_volume.delete()
+                    self._delete_db_volume(db_volume)
                 except exception.ReddwarfError, e:
                     LOG.exception("Failed to Delete DB Volume record")
                     raise e
@@ -629,19 +784,17 @@ class InstanceController(wsgi.Controller):
                     pass
                     # This shouldn't happen, but ignore if we don't have a security group to delete
                 
-            # Try to delete the Reddwarf lite instance
-            try:
-                server = server.delete()
-            except exception.ReddwarfError, e:
-                LOG.exception("Failed to Delete DB Instance record")
-                raise e
-            
-            # Finally, try to delete the associated GuestStatus record
+            # Delete the Reddwarf lite instance and its GuestStatus record together
             try:
-                guest_status = models.GuestStatus().find_by(instance_id=server['id'])
-                guest_status.delete()
+                with db.unit_of_work():
+                    server = server.delete()
+                    guest_status = models.GuestStatus().find_by(instance_id=server['id'])
+                    guest_status.delete()
+                    models.Operation.delete_for_instance(server['id'])
+                    quota.release(context, instances=1)
+                guest_api.invalidate_routing_key(server['id'])
             except exception.ReddwarfError, e:
-                LOG.exception("Failed to Delete GuestStatus record")
+                LOG.exception("Failed to Delete DB Instance and GuestStatus records")
                 raise e
         else:
             raise exception.ReddwarfError("Failed to delete instance")
@@ -704,36 +857,36 @@ class InstanceController(wsgi.Controller):
         
         
     def _load_boot_params(self, tenant_id, flavor_id):
+        cache = models.service_config_cache
         try:
-            service_zone = models.ServiceZone.find_by(service_name='database', tenant_id=tenant_id, deleted=False)
+            service_zone = cache.find_zone('database', tenant_id)
         except exception.ModelNotFoundError, e:
             LOG.info("Service Zone for tenant %s not found, using zone for 'default_tenant'" % tenant_id)
-            service_zone = models.ServiceZone.find_by(service_name='database', tenant_id='default_tenant', deleted=False)
+            service_zone = cache.find_zone('database', 'default_tenant')
 
         region_az = service_zone['availability_zone']
 
         # Attempt to find Boot parameters for a specific tenant
         try:
-            service_image = models.ServiceImage.find_by(service_name="database", tenant_id=tenant_id, availability_zone=region_az, deleted=False)
+            service_image = cache.find_image('database', tenant_id, region_az)
         except exception.ModelNotFoundError, e:
             LOG.info("Service Image for tenant %s not found, using image for 'default_tenant'" % tenant_id)
-            service_image = models.ServiceImage.find_by(service_name="database", tenant_id='default_tenant', availability_zone=region_az, deleted=False)
+            service_image = cache.find_image('database', 'default_tenant', region_az)
 
         image_id = service_image['image_id']
         
         # Check to see if flavor exists
         try:
-            flavor = models.ServiceFlavor.find_by(service_name="database", flavor_id=flavor_id, deleted=False)
+            flavor = cache.find_flavor('database', flavor_id)
             LOG.debug("Searching by flavor id %s, found service flavor id %s" % (flavor_id, flavor['id']))
         except exception.ModelNotFoundError, e:
             LOG.exception("Error finding service flavor %s in database" % flavor_id)
             raise e
         
-        service_keypair = models.ServiceKeypair.find_by(service_name='database', deleted=False)
-        keypair_name = service_keypair['key_name']
+        keypair_name = cache.find_keypair('database')['key_name']
         
         # Get the credential to use for proxy compute resource
-        credential = models.Credential.find_by(type='compute', deleted=False)
+        credential = cache.find_credential('compute')
         
         LOG.debug("Using ImageID %s" % image_id)
         LOG.debug("Using FlavorID %s" % flavor['flavor_id'])
@@ -757,45 +910,38 @@ class InstanceController(wsgi.Controller):
             config = create_boot_config(CONFIG, None, storage_uri, password)
         return { '/home/nova/agent.config': config }
 
-    def _check_instance_quota(self, context, count=1):
-        num_instances = quota.allowed_instances(context, count)
-        LOG.debug('number of instances allowed to create %s' % num_instances)
-        if num_instances < count:
-            tid = context.tenant
-            if num_instances <= 0:
-                msg = _("Cannot create any more instances of this type.")
-            else:
-                msg = (_("Can only create %s more instances of this type.") %
-                       num_instances)
-            LOG.warn(_("Quota exceeded for %(tid)s,"
-                  " tried to create %(count)s instances. %(msg)s"), locals())
-            
-            raise exception.QuotaError("InstanceLimitExceeded")
-
-        return num_instances
+    def _reserve_instance_quota(self, context, count=1):
+        reservations = quota.reserve(context, instances=count)
+        LOG.debug('reserved quota for %s instances' % count)
+        return reservations
     
-    def _check_volume_size_quota(self, context, requested_size=1):
-        allowed_volume_size = quota.allowed_volume_size(context, requested_size)
-        LOG.debug('size of volume allowed to create %s' % allowed_volume_size)
-        if allowed_volume_size < requested_size:
-            tid = context.tenant
-            if allowed_volume_size <= 0:
-                msg = _("Cannot allocated any more volume space.")
-            else:
-                msg = (_("Can only allocated %s more space for volumes.") %
-                       allowed_volume_size)
-            LOG.warn(_("Quota exceeded for %(tid)s,"
-                  " tried to allocate %(requested_size)s volume space. %(msg)s"), locals())
-            
-            raise exception.QuotaError("VolumeSizeLimitExceeded")
-
-        return allowed_volume_size
+    def _reserve_volume_size_quota(self, context, requested_size=1):
+        reservations = quota.reserve(context, volume_space=requested_size)
+        LOG.debug('reserved quota for %s of volume space' % requested_size)
+        return reservations
         
-    def get_guest_state_mapping(self, id_list):
-        """Returns a dictionary of guest statuses keyed by guest ids."""
-        results = db.db_api.find_guest_statuses_for_instances(id_list)
-        return dict([(r.instance_id, r) for r in results])
-    
+
+class OperationController(wsgi.Controller):
+    """Controller for asynchronous guest operations"""
+
+    def show(self, req, tenant_id, id):
+        """Return the progress of an operation."""
+        LOG.debug("Operations.show() called with %s, %s" % (tenant_id, id))
+
+        # Sanitize id
+        if not Sanitizer.whitelist_uuid(id):
+            return wsgi.Result(errors.wrap(errors.Input.NONALLOWED_CHARACTERS_ID))
+
+        try:
+            operation = models.Operation.find_by(id=id, tenant_id=tenant_id,
+                                                 deleted=False)
+        except exception.ReddwarfError, e:
+            LOG.error("Could not find operation %s" % id)
+            return wsgi.Result(errors.wrap(errors.Operation.NOT_FOUND), 404)
+
+        operation = operation.expire_if_stale()
+        return wsgi.Result(views.OperationView(operation, req, tenant_id).show(), 200)
+
 
 class SnapshotController(wsgi.Controller):
     """Controller for snapshot functionality"""
@@ -906,7 +1052,9 @@ class SnapshotController(wsgi.Controller):
                 return wsgi.Result(errors.wrap(errors.Snapshot.SWIFT_DELETE), 500)
         
         try:
-            response = snapshot.delete()
+            with db.unit_of_work():
+                response = snapshot.delete()
+                quota.release(context, snapshots=1)
         except exception.ReddwarfError, e:
             LOG.exception("Failed to delete DB snapshot record")
             return wsgi.Result(errors.wrap(errors.Snapshot.DELETE), 500)
@@ -954,7 +1102,8 @@ class SnapshotController(wsgi.Controller):
 
         # Return when a snapshot is being created on the requested instance
         try:
-            snapshots = models.Snapshot().find_all(instance_id=instance_id)
+            snapshots = models.Snapshot().find_all(instance_id=instance_id,
+                                                   deleted=False)
             for snapshot in snapshots:
                 if snapshot['deleted_at'] is None and snapshot['state'] == 'building':
                     LOG.error("Unable to create snapshot, There is already a snapshot being created on Instance %s." % instance_id)
@@ -973,12 +1122,21 @@ class SnapshotController(wsgi.Controller):
 
         # Return if quota for snapshots has been reached
         try:
-            num_snapshots = self._check_snapshot_quota(context, 1)
+            reservations = self._reserve_snapshot_quota(context, 1)
         except exception.QuotaError, e:
             LOG.error("Unable to create snapshot, Snapshot Quota has been exceeded")
-            maximum_snapshots_allowed = quota.get_tenant_quotas(context, context.tenant)['snapshots']
+            maximum_snapshots_allowed = e.limit
             return wsgi.Result(errors.wrap(errors.Snapshot.QUOTA_EXCEEDED, "You are only allowed to create %s snapshots for you account." % maximum_snapshots_allowed), 413)
-        
+
+        try:
+            return self._create_snapshot(req, body, tenant_id, context,
+                                         instance_id, reservations)
+        finally:
+            # Quota not committed with the snapshot record is given back
+            quota.rollback(context, reservations)
+
+    def _create_snapshot(self, req, body, tenant_id, context, instance_id,
+                         reservations):
         SWIFT_AUTH_URL = CONFIG.get('reddwarf_proxy_swift_auth_url', 'localhost')
         
         try:
@@ -991,12 +1149,14 @@ class SnapshotController(wsgi.Controller):
             credential = models.Credential.find_by(type='object-store')
             LOG.debug("Got credential: %s" % credential)
 
-            snapshot = models.Snapshot().create(name=name,
-                                     instance_id=instance_id,
-                                     state='building',
-                                     user_id=context.user,
-                                     tenant_id=context.tenant,
-                                     credential=credential['id'])
+            with db.unit_of_work():
+                snapshot = models.Snapshot().create(name=name,
+                                         instance_id=instance_id,
+                                         state='building',
+                                         user_id=context.user,
+                                         tenant_id=context.tenant,
+                                         credential=credential['id'])
+                quota.commit(context, reservations)
             LOG.debug("Created snapshot model: %s" % snapshot)
             
             try:
@@ -1019,22 +1179,10 @@ class SnapshotController(wsgi.Controller):
         LOG.debug("Wrote snapshot: %s" % snapshot)
         return wsgi.Result(views.SnapshotView(snapshot, req, tenant_id).create(), 201)
               
-    def _check_snapshot_quota(self, context, count=1):
-        num_snapshots = quota.allowed_snapshots(context, count)
-        LOG.debug('number of snapshots allowed to create %s' % num_snapshots)
-        if num_snapshots < count:
-            tid = context.tenant
-            if num_snapshots <= 0:
-                msg = _("Cannot create any more snapshots of this type.")
-            else:
-                msg = (_("Can only create %s more snapshots of this type.") %
-                       num_snapshots)
-            LOG.warn(_("Quota exceeded for %(tid)s,"
-                  " tried to create %(count)s snapshots. %(msg)s"), locals())
-            
-            raise exception.QuotaError("InstanceLimitExceeded")
-
-        return num_snapshots
+    def _reserve_snapshot_quota(self, context, count=1):
+        reservations = quota.reserve(context, snapshots=count)
+        LOG.debug('reserved quota for %s snapshots' % count)
+        return reservations
    
     def _get_swift_connection(self, options):
         return swift_client.Connection(options['auth'],
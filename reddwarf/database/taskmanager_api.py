@@ -0,0 +1,41 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Handles all requests to the Task Manager
+"""
+
+import logging
+
+from reddwarf.common import config
+from reddwarf.rpc import impl_kombu as rpc
+
+
+LOG = logging.getLogger(__name__)
+
+
+class API():
+    """API for interacting with the task manager."""
+
+    def _topic(self):
+        return config.Config.get('taskmanager_topic', 'taskmanager')
+
+    def provision_instance(self, context, task_id):
+        LOG.debug("Casting provisioning task %s to the task manager", task_id)
+        rpc.cast(context, self._topic(),
+                 {"method": "provision_instance",
+                  "args": {"task_id": task_id}})
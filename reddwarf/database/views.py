@@ -17,6 +17,7 @@
 
 import logging
 import os
+import urllib
 
 from reddwarf.common.views import create_links
 
@@ -59,7 +60,7 @@ class DBInstanceView(object):
         self.security_groups = security_groups
         self.request = req
         self.tenant_id = tenant_id
-        instance['flavor'] = flavor
+        self.flavor = flavor
         
     def _build_create(self, initial_user, initial_password):
         credential = { "username" : initial_user,
@@ -143,13 +144,13 @@ class DBInstanceView(object):
     
     def _build_flavor_info(self):
         return {
-            "id": self.instance['flavor'],
+            "id": self.flavor,
             "links": self._build_flavor_links()
         }
         
     def _build_flavor_links(self):
         return create_links("flavors", self.request,
-                            self.instance['flavor'], self.tenant_id)        
+                            self.flavor, self.tenant_id)        
 
     def list(self):
         return self._build_list()
@@ -235,24 +236,34 @@ class InstancesView(object):
     
 class DBInstancesView(object):
 
-    def __init__(self, instances, guest_statuses, req, tenant_id):
+    def __init__(self, instances, req, tenant_id, limit=None,
+                 next_marker=None):
+        # Rows from find_instance_summaries: id, name, created_at, state
+        # and flavor_id.
         self.instances = instances
-        self.guest_statuses = guest_statuses
         self.request = req
         self.tenant_id = tenant_id
-        LOG.debug(dir(self.instances))
+        self.limit = limit
+        self.next_marker = next_marker
 
     def list(self):
         data = []
-        LOG.debug("Instances View Builder: %s" % self.instances)
-        # These are model instances
         for instance in self.instances:
-            LOG.debug("Instance to include into List: %s" % instance)
-            guest_status = self.guest_statuses[instance['id']]
-            LOG.debug("GuestStatus for instance: %s" % guest_status)
-            data.append(DBInstanceView(instance, guest_status, None, self.request, self.tenant_id, instance['flavor']).list())
-        LOG.debug("Returning from DBInstancesView.list()")
-        return {"instances": data}
+            row = dict(zip(instance.keys(), instance))
+            guest_status = {'state': row['state']}
+            data.append(DBInstanceView(row, guest_status, None, self.request, self.tenant_id, row['flavor_id']).list())
+        LOG.debug("Returning %s instances from DBInstancesView.list()"
+                  % len(data))
+        result = {"instances": data}
+        if self.next_marker is not None:
+            result["links"] = self._build_next_links()
+        return result
+
+    def _build_next_links(self):
+        params = urllib.urlencode({'limit': self.limit,
+                                   'marker': self.next_marker})
+        href = "%s?%s" % (self.request.path_url, params)
+        return [{'rel': 'next', 'href': href}]
 
 class SnapshotsView(object):
     
@@ -271,3 +282,29 @@ class SnapshotsView(object):
             data.append(SnapshotView(snapshot, self.request, self.tenant_id).list())
         LOG.debug("Returning from SnapshotsView.data()")
         return {"snapshots" : data}
+
+
+class OperationView(object):
+
+    def __init__(self, operation, req, tenant_id):
+        self.operation = operation
+        self.request = req
+        self.tenant_id = tenant_id
+
+    def href(self):
+        return os.path.join(_base_url(self.request), self.tenant_id,
+                            "operations", str(self.operation['id']))
+
+    def show(self):
+        operation = {
+            "id": self.operation['id'],
+            "action": self.operation['action'],
+            "status": self.operation['state'],
+            "created": self.operation['created_at'],
+            "updated": self.operation['updated_at'],
+            "instanceId": self.operation['instance_id'],
+            "links": [{'rel': 'self', 'href': self.href()}]
+            }
+        if self.operation['error']:
+            operation["error"] = self.operation['error']
+        return {"operation": operation}
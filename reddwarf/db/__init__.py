@@ -21,8 +21,13 @@ from reddwarf.common import utils
 from reddwarf.common import config
 
 
-db_api = utils.import_object(config.Config.get("db_api_implementation",
-    "reddwarf.db.sqlalchemy.api"))
+db_api = utils.import_object(config.Config.get(
+    "db_api_implementation", "reddwarf.db.sqlalchemy.api"))
+
+
+def unit_of_work():
+    """Context manager that commits the model writes in it together."""
+    return db_api.unit_of_work()
 
 
 class Query(object):
@@ -44,31 +49,34 @@ class Query(object):
     def count(self):
         return db_api.count(self._query_func, self._model, **self._conditions)
 
+    def sum(self, column):
+        return db_api.sum(self._query_func, self._model, column,
+                          **self._conditions)
+
     def __iter__(self):
         return iter(self.all())
 
     def update(self, **values):
         db_api.update_all(self._query_func, self._model, self._conditions,
-            values)
+                          values)
 
     def delete(self):
         db_api.delete_all(self._query_func, self._model, **self._conditions)
 
-    #TODO(hub-cap): Reenable pagination when we have a need for it
-    # def limit(self, limit=200, marker=None, marker_column=None):
-    #     return db_api.find_all_by_limit(self._query_func,
-    #         self._model,
-    #         self._conditions,
-    #         limit=limit,
-    #         marker=marker,
-    #         marker_column=marker_column)
-    #
-    # def paginated_collection(self, limit=200, marker=None,
-    #                          marker_column=None):
-    #     collection = self.limit(int(limit) + 1, marker, marker_column)
-    #     if len(collection) > int(limit):
-    #         return (collection[0:-1], collection[-2]['id'])
-    #     return (collection, None)
+    def limit(self, limit=200, marker=None, marker_column=None):
+        return db_api.find_all_by_limit(self._query_func,
+                                        self._model,
+                                        self._conditions,
+                                        limit=limit,
+                                        marker=marker,
+                                        marker_column=marker_column)
+
+    def paginated_collection(self, limit=200, marker=None,
+                             marker_column=None):
+        collection = self.limit(int(limit) + 1, marker, marker_column)
+        if len(collection) > int(limit):
+            return (collection[0:-1], collection[-2].id)
+        return (collection, None)
 
 
 class Queryable(object):
@@ -91,11 +99,11 @@ def add_options(parser):
                  "Reddwarf database.")
 
     group = optparse.OptionGroup(parser,
-        "Registry Database Options",
-        help_text)
+                                 "Registry Database Options",
+                                 help_text)
     group.add_option('--sql-connection',
-        metavar="CONNECTION",
-        default=None,
-        help="A valid SQLAlchemy connection string for the "
-             "registry database. Default: %default")
+                     metavar="CONNECTION",
+                     default=None,
+                     help="A valid SQLAlchemy connection string for the "
+                          "registry database. Default: %default")
     parser.add_option_group(group)
@@ -0,0 +1,69 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Archival of soft-deleted rows into shadow tables."""
+
+import datetime
+import logging
+
+from eventlet import greenthread
+
+from reddwarf import db
+from reddwarf.common import config
+from reddwarf.common import utils
+
+CONFIG = config.Config
+LOG = logging.getLogger(__name__)
+
+
+def archive_deleted_rows(age_days=None, batch_size=None, max_batches=None,
+                         pause=None):
+    """Move rows soft-deleted more than age_days ago into shadow tables.
+
+    Every table the migrations gave a shadow_<name> table is archived.
+    Each table is drained in batches of batch_size rows, one transaction
+    per batch, sleeping pause seconds between batches so the live tables
+    are never locked for long. At most max_batches batches are moved per
+    table; anything left over is picked up on the next run.
+
+    Returns a dict of the number of rows moved per table.
+    """
+    if age_days is None:
+        age_days = CONFIG.get('archive_deleted_after_days', 30)
+    if batch_size is None:
+        batch_size = CONFIG.get('archive_batch_size', 500)
+    if max_batches is None:
+        max_batches = CONFIG.get('archive_max_batches', 20)
+    if pause is None:
+        pause = CONFIG.get('archive_batch_pause', 1)
+    before = utils.utcnow() - datetime.timedelta(days=int(age_days))
+    batch_size = int(batch_size)
+
+    archived = {}
+    for table_name in db.db_api.archived_tables():
+        archived[table_name] = 0
+        for batch in range(int(max_batches)):
+            moved = db.db_api.archive_deleted_rows(table_name, before,
+                                                   batch_size)
+            archived[table_name] += moved
+            if moved < batch_size:
+                break
+            greenthread.sleep(float(pause))
+        if archived[table_name]:
+            LOG.info("Archived %s deleted rows from %s"
+                     % (archived[table_name], table_name))
+    return archived
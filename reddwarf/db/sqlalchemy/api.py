@@ -18,8 +18,12 @@ import logging
 
 import sqlalchemy.exc
 from sqlalchemy import and_
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import String
 from sqlalchemy import or_
 from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import false
 
 from reddwarf import database
 from reddwarf.common import exception
@@ -30,6 +34,7 @@ from reddwarf.db.sqlalchemy import session
 
 LOG = logging.getLogger(__name__)
 
+
 def list(query_func, *args, **kwargs):
     return query_func(*args, **kwargs).all()
 
@@ -38,6 +43,11 @@ def count(query, *args, **kwargs):
     return query(*args, **kwargs).count()
 
 
+def sum(query, model, column, **conditions):
+    total = query(model, **conditions).value(func.sum(getattr(model, column)))
+    return total or 0
+
+
 def find_all(model, **conditions):
     return _query_by(model, **conditions)
 
@@ -52,6 +62,36 @@ def find_by(model, **kwargs):
     return _query_by(model, **kwargs).first()
 
 
+def find_by_for_update(model, **kwargs):
+    return _query_by(model, **kwargs).with_lockmode('update').first()
+
+
+def find_all_in(model, column, values, **conditions):
+    return _query_by(model, **conditions).\
+           filter(getattr(model, column).in_(values)).all()
+
+
+def update_all_in(model, column, values, conditions, updates, changed=(),
+                  within=None):
+    """One UPDATE for every row whose column is in values.
+
+    Rows whose 'changed' columns already hold the new values are left
+    alone, and so are rows outside 'within', a dict of column -> allowed
+    values. Returns the number of rows written.
+    """
+    query = _query_by(model, **conditions).\
+        filter(getattr(model, column).in_(values))
+    for key, allowed in (within or {}).iteritems():
+        query = query.filter(getattr(model, key).in_(allowed))
+    for key in changed:
+        query = query.filter(getattr(model, key) != updates[key])
+    return query.update(updates, synchronize_session=False)
+
+
+def find_expired_reservations(model, now):
+    return _base_query(model).filter(model.expire < now).all()
+
+
 def save(model):
     try:
         db_session = session.get_session()
@@ -63,6 +103,10 @@ def save(model):
                                           error=str(error.orig))
 
 
+def unit_of_work():
+    return session.unit_of_work()
+
+
 def delete(model):
     db_session = session.get_session()
     model = db_session.merge(model)
@@ -104,6 +148,14 @@ def clean_db():
     session.clean_db()
 
 
+def archived_tables():
+    return session.archived_tables()
+
+
+def archive_deleted_rows(table_name, before, max_rows):
+    return session.archive_deleted_rows(table_name, before, max_rows)
+
+
 def db_sync(options, version=None, repo_path=None):
     migration.db_sync(options, version, repo_path)
 
@@ -144,3 +196,74 @@ def _limits(query_func, model, conditions, limit, marker, marker_column=None):
 def find_guest_statuses_for_instances(instance_ids):
     return _base_query(database.models.GuestStatus).\
            filter(database.models.GuestStatus.instance_id.in_(instance_ids))
+
+
+def find_instance_summaries(model, **conditions):
+    """Instances joined with their guest status and service flavor.
+
+    Only the columns needed to list instances are selected, so a tenant's
+    whole page comes back from a single query.
+    """
+    guest_status = database.models.GuestStatus
+    service_flavor = database.models.ServiceFlavor
+    query = session.get_session().query(model.id,
+                                        model.name,
+                                        model.created_at,
+                                        guest_status.state,
+                                        service_flavor.flavor_id).\
+        outerjoin(guest_status,
+                  and_(guest_status.instance_id == model.id,
+                       guest_status.deleted == false())).\
+        outerjoin(service_flavor,
+                  and_(service_flavor.id == cast(model.flavor, String),
+                       service_flavor.deleted == false()))
+    for key, value in conditions.iteritems():
+        query = query.filter(getattr(model, key) == value)
+    return query
+
+
+def find_guest_hostnames(model, states):
+    """(id, remote_hostname) of every live instance that has a hostname
+    and whose guest is in one of states.
+    """
+    guest_status = database.models.GuestStatus
+    query = session.get_session().query(model.id, model.remote_hostname).\
+        join(guest_status,
+             and_(guest_status.instance_id == model.id,
+                  guest_status.deleted == false())).\
+        filter(model.deleted == false()).\
+        filter(model.remote_hostname.isnot(None)).\
+        filter(guest_status.state.in_(states))
+    return query.all()
+
+
+def find_instance_detail(model, **conditions):
+    """An instance with its guest state, flavor id and security group ids.
+
+    Yields one row per security group (or a single row with None when the
+    instance has none).
+    """
+    from reddwarf.securitygroup import models as secgroup_models
+    guest_status = database.models.GuestStatus
+    service_flavor = database.models.ServiceFlavor
+    association = secgroup_models.SecurityGroupInstances
+    security_group = secgroup_models.SecurityGroup
+    query = session.get_session().query(model,
+                                        guest_status.state,
+                                        service_flavor.flavor_id,
+                                        security_group.id).\
+        outerjoin(guest_status,
+                  and_(guest_status.instance_id == model.id,
+                       guest_status.deleted == false())).\
+        outerjoin(service_flavor,
+                  and_(service_flavor.id == cast(model.flavor, String),
+                       service_flavor.deleted == false())).\
+        outerjoin(association,
+                  and_(association.instance_id == model.id,
+                       association.deleted == false())).\
+        outerjoin(security_group,
+                  and_(security_group.id == association.security_group_id,
+                       security_group.deleted == false()))
+    for key, value in conditions.iteritems():
+        query = query.filter(getattr(model, key) == value)
+    return query
@@ -46,6 +46,10 @@ def map(engine, models):
                Table('snapshots', meta, autoload=True))
     orm.mapper(models['quota'],
                Table('quotas', meta, autoload=True))
+    orm.mapper(models['quota_usage'],
+               Table('quota_usages', meta, autoload=True))
+    orm.mapper(models['reservation'],
+               Table('reservations', meta, autoload=True))
 
     orm.mapper(models['service_keypair'],
                Table('service_keypairs', meta, autoload=True))
@@ -56,6 +60,12 @@ def map(engine, models):
     orm.mapper(models['volume'],
                Table('volumes', meta, autoload=True))
 
+    orm.mapper(models['provisioning_task'],
+               Table('provisioning_tasks', meta, autoload=True))
+
+    orm.mapper(models['operation'],
+               Table('operations', meta, autoload=True))
+
     orm.mapper(models['security_group'],
                Table('security_groups', meta, autoload=True))
 
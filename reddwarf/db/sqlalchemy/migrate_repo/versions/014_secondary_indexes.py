@@ -0,0 +1,71 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import Index
+from sqlalchemy.schema import MetaData
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+
+
+# (table, index name, columns), in the order the queries filter on them.
+# deleted comes last: it is on nearly every lookup but selects little.
+INDEXES = [
+    ('instances', 'ix_instances_tenant_id_deleted', ['tenant_id', 'deleted']),
+    ('instances', 'ix_instances_remote_hostname', ['remote_hostname']),
+    ('guest_status', 'ix_guest_status_instance_id_deleted',
+     ['instance_id', 'deleted']),
+    ('snapshots', 'ix_snapshots_tenant_id_deleted', ['tenant_id', 'deleted']),
+    ('snapshots', 'ix_snapshots_instance_id_deleted',
+     ['instance_id', 'deleted']),
+    ('quotas', 'ix_quotas_tenant_id_deleted', ['tenant_id', 'deleted']),
+    ('volumes', 'ix_volumes_tenant_id_deleted', ['tenant_id', 'deleted']),
+    ('volumes', 'ix_volumes_instance_id_deleted', ['instance_id', 'deleted']),
+    ('security_groups', 'ix_security_groups_tenant_id_deleted',
+     ['tenant_id', 'deleted']),
+    ('security_group_rules', 'ix_security_group_rules_group_id_deleted',
+     ['security_group_id', 'deleted']),
+    ('security_group_instances',
+     'ix_security_group_instances_instance_id_deleted',
+     ['instance_id', 'deleted']),
+    ('provisioning_tasks', 'ix_provisioning_tasks_state_deleted',
+     ['state', 'deleted']),
+    ('credentials', 'ix_credentials_type_deleted', ['type', 'deleted']),
+    ('service_zones', 'ix_service_zones_service_name_tenant_id',
+     ['service_name', 'tenant_id', 'deleted']),
+    ('service_flavors', 'ix_service_flavors_service_name_flavor_name',
+     ['service_name', 'flavor_name', 'deleted']),
+]
+
+
+def _indexes(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    tables = {}
+    for table_name, index_name, columns in INDEXES:
+        if table_name not in tables:
+            tables[table_name] = Table(table_name, meta, autoload=True)
+        table = tables[table_name]
+        yield Index(index_name, *[table.c[column] for column in columns])
+
+
+def upgrade(migrate_engine):
+    for index in _indexes(migrate_engine):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    for index in _indexes(migrate_engine):
+        index.drop(migrate_engine)
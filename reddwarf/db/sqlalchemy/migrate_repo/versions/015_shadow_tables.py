@@ -0,0 +1,56 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import MetaData
+from sqlalchemy.types import NullType
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import BigInteger
+from reddwarf.db.sqlalchemy.migrate_repo.schema import create_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import drop_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+
+
+# Tables whose soft-deleted rows are archived into shadow_<name>. The
+# archiver finds them by that prefix, so later migrations add to the set by
+# creating their own shadow tables.
+ARCHIVED_TABLES = ['instances', 'guest_status', 'snapshots', 'volumes',
+                   'security_groups', 'security_group_rules',
+                   'security_group_instances', 'provisioning_tasks']
+
+
+def _shadow_tables(meta):
+    shadows = []
+    for name in ARCHIVED_TABLES:
+        table = Table(name, meta, autoload=True)
+        columns = [column.copy() for column in table.columns]
+        for column in columns:
+            # SQLite reflects BIGINT (snapshots.storage_size) as NullType.
+            if isinstance(column.type, NullType):
+                column.type = BigInteger()
+        shadows.append(Table('shadow_' + name, meta, *columns))
+    return shadows
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    create_tables(_shadow_tables(meta))
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    drop_tables([Table('shadow_' + name, meta, autoload=True)
+                 for name in ARCHIVED_TABLES])
@@ -0,0 +1,72 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import Index
+from sqlalchemy.schema import MetaData
+from sqlalchemy.schema import UniqueConstraint
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Boolean
+from reddwarf.db.sqlalchemy.migrate_repo.schema import create_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import DateTime
+from reddwarf.db.sqlalchemy.migrate_repo.schema import drop_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Integer
+from reddwarf.db.sqlalchemy.migrate_repo.schema import String
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+from sqlalchemy.sql.expression import false
+
+
+meta = MetaData()
+
+quota_usages = Table(
+    'quota_usages', meta,
+    Column('id', String(36), primary_key=True, nullable=False),
+    Column('tenant_id', String(255), nullable=False),
+    Column('resource', String(255), nullable=False),
+    Column('in_use', Integer(), nullable=False),
+    Column('reserved', Integer(), nullable=False),
+    Column('deleted', Boolean(), server_default=false()),
+    Column('created_at', DateTime()),
+    Column('updated_at', DateTime()),
+    Column('deleted_at', DateTime()),
+    UniqueConstraint('tenant_id', 'resource',
+                     name='uq_quota_usages_tenant_id_resource'))
+
+reservations = Table(
+    'reservations', meta,
+    Column('id', String(36), primary_key=True, nullable=False),
+    Column('usage_id', String(36), nullable=False),
+    Column('tenant_id', String(255), nullable=False),
+    Column('resource', String(255), nullable=False),
+    Column('delta', Integer(), nullable=False),
+    Column('expire', DateTime()),
+    Column('deleted', Boolean(), server_default=false()),
+    Column('created_at', DateTime()),
+    Column('updated_at', DateTime()),
+    Column('deleted_at', DateTime()))
+
+Index('ix_reservations_expire', reservations.c.expire)
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    create_tables([quota_usages, reservations])
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    drop_tables([reservations, quota_usages])
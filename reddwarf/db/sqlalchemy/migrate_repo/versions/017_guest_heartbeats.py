@@ -0,0 +1,40 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import MetaData
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import DateTime
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+
+
+# The shadow table has to keep the same columns for archiving.
+TABLES = ['guest_status', 'shadow_guest_status']
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for name in TABLES:
+        table = Table(name, meta, autoload=True)
+        Column('heartbeat_at', DateTime()).create(table)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for name in TABLES:
+        table = Table(name, meta, autoload=True)
+        table.c.heartbeat_at.drop()
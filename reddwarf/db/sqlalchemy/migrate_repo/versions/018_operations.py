@@ -0,0 +1,59 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import MetaData
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Boolean
+from reddwarf.db.sqlalchemy.migrate_repo.schema import create_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import DateTime
+from reddwarf.db.sqlalchemy.migrate_repo.schema import drop_tables
+from reddwarf.db.sqlalchemy.migrate_repo.schema import String
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Text
+from sqlalchemy.sql.expression import false
+
+
+meta = MetaData()
+
+operations = Table(
+    'operations', meta,
+    Column('id', String(36), primary_key=True, nullable=False),
+    Column('tenant_id', String(255), nullable=False),
+    Column('instance_id', String(36), nullable=False),
+    Column('action', String(length=64)),
+    Column('state', String(length=32)),
+    Column('error', Text()),
+    Column('deleted', Boolean(), server_default=false()),
+    Column('created_at', DateTime()),
+    Column('updated_at', DateTime()),
+    Column('deleted_at', DateTime()))
+
+# Deleted operations are archived like the tables of migration 015.
+shadow_operations = Table(
+    'shadow_operations', meta,
+    *[column.copy() for column in operations.columns])
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    create_tables([operations, shadow_operations])
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    drop_tables([shadow_operations, operations])
@@ -0,0 +1,65 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Convert the timestamps written by MySQL NOW() to UTC.
+
+Model timestamps used to be set by the database with NOW(), which returns
+the MySQL server's local time. They are now set in Python with
+utils.utcnow(), so rows written before this migration are shifted by the
+server's current UTC offset. Other backends wrote CURRENT_TIMESTAMP, which
+is already UTC, and are left alone.
+"""
+
+from sqlalchemy.schema import MetaData
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+
+
+# Tables that held rows written with NOW() before the switch to UTC.
+TABLES = ['instances', 'users', 'credentials', 'guest_status',
+          'service_images', 'service_flavors', 'service_secgroups',
+          'snapshots', 'quotas', 'service_keypairs', 'service_zones',
+          'volumes', 'security_group_instances', 'security_group_rules',
+          'security_groups', 'provisioning_tasks']
+
+COLUMNS = ['created_at', 'updated_at', 'deleted_at']
+
+
+def _shift(migrate_engine, sign):
+    if migrate_engine.name != 'mysql':
+        return
+    offset = migrate_engine.execute(
+        "SELECT TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW())").scalar()
+    if not offset:
+        return
+    meta = MetaData(bind=migrate_engine)
+    for name in TABLES:
+        table = Table(name, meta, autoload=True)
+        for column in COLUMNS:
+            if column not in table.c:
+                continue
+            migrate_engine.execute(
+                "UPDATE %s SET %s = %s - INTERVAL %d SECOND "
+                "WHERE %s IS NOT NULL"
+                % (name, column, column, sign * offset, column))
+
+
+def upgrade(migrate_engine):
+    _shift(migrate_engine, 1)
+
+
+def downgrade(migrate_engine):
+    _shift(migrate_engine, -1)
@@ -0,0 +1,46 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.schema import Index
+from sqlalchemy.schema import MetaData
+
+from reddwarf.db.sqlalchemy.migrate_repo.schema import Table
+
+
+# Secondary indexes for the operations table of migration 018, laid out
+# like migration 014: (index name, columns), deleted last.
+INDEXES = [
+    ('ix_operations_instance_id_deleted', ['instance_id', 'deleted']),
+    ('ix_operations_tenant_id_deleted', ['tenant_id', 'deleted']),
+]
+
+
+def _indexes(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    table = Table('operations', meta, autoload=True)
+    for index_name, columns in INDEXES:
+        yield Index(index_name, *[table.c[column] for column in columns])
+
+
+def upgrade(migrate_engine):
+    for index in _indexes(migrate_engine):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    for index in _indexes(migrate_engine):
+        index.drop(migrate_engine)
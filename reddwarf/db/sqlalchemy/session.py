@@ -17,8 +17,17 @@
 
 import contextlib
 import logging
+import time
+
+from eventlet import corolocal
+from eventlet import tpool
+from sqlalchemy import and_
 from sqlalchemy import create_engine
+from sqlalchemy import exc
 from sqlalchemy import MetaData
+from sqlalchemy import pool
+from sqlalchemy import Table
+from sqlalchemy.engine import url as sa_url
 from sqlalchemy.orm import sessionmaker
 
 from reddwarf import database
@@ -28,6 +37,9 @@ from reddwarf.db.sqlalchemy import mappers
 _ENGINE = None
 _MAKER = None
 
+# Session of the unit of work running in the current greenthread, if any
+_LOCAL = corolocal.local()
+
 
 LOG = logging.getLogger('reddwarf.db.sqlalchemy.session')
 
@@ -65,7 +77,78 @@ def configure_sqlalchemy_log(options):
         logger.setLevel(logging.INFO)
 
 
+class PoolStats(object):
+    """Counts how long callers wait to check a connection out of the pool."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if timed_out:
+            self.timeouts += 1
+
+    def data(self):
+        return {'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait}
+
+
+POOL_STATS = PoolStats()
+
+
+class TimedQueuePool(pool.QueuePool):
+    """A QueuePool that records checkout wait times in POOL_STATS."""
+
+    slow_checkout = 1.0
+
+    def _do_get(self):
+        start = time.time()
+        timed_out = False
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = time.time() - start
+            POOL_STATS.record(wait, timed_out)
+            if wait > self.slow_checkout:
+                LOG.warn("Waited %.2fs for a database connection (%s, "
+                         "totals since start %s)"
+                         % (wait, self.status(), POOL_STATS.data()))
+
+
+class TpoolDBAPI(object):
+    """Wraps a DBAPI module so connections run on eventlet's thread pool.
+
+    Every call on a connection or cursor is made from a native thread, so a
+    blocking C driver such as MySQLdb no longer stalls the eventlet hub.
+    Everything else is looked up on the wrapped module.
+    """
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def connect(self, *args, **kwargs):
+        connection = tpool.execute(self._module.connect, *args, **kwargs)
+        return tpool.Proxy(connection, autowrap_names=('cursor',))
+
+
 def _create_engine(options):
+    connection = options['sql_connection']
     engine_args = {
         "pool_recycle": config.get_option(options,
                                           'sql_idle_timeout',
@@ -76,12 +159,39 @@ def _create_engine(options):
                                   type='bool',
                                   default=False),
     }
+
+    # SQLite connections cannot move between threads and use their own pool
+    if not sa_url.make_url(connection).drivername.startswith('sqlite'):
+        engine_args.update({
+            "poolclass": TimedQueuePool,
+            "pool_size": config.get_option(options, 'sql_pool_size',
+                                           type='int', default=10),
+            "max_overflow": config.get_option(options, 'sql_max_overflow',
+                                              type='int', default=20),
+            "pool_timeout": config.get_option(options, 'sql_pool_timeout',
+                                              type='int', default=30),
+        })
+        if config.get_option(options, 'sql_tpool_enable', type='bool',
+                             default=False):
+            tpool.set_num_threads(config.get_option(options, 'sql_tpool_size',
+                                                    type='int', default=20))
+            dialect = sa_url.make_url(connection).get_dialect()
+            engine_args['module'] = TpoolDBAPI(dialect.dbapi())
+
     LOG.info("Creating SQLAlchemy engine with args: %s" % engine_args)
-    return create_engine(options['sql_connection'], **engine_args)
+    return create_engine(connection, **engine_args)
 
 
 def get_session(autocommit=True, expire_on_commit=False):
-    """Helper method to grab session."""
+    """Helper method to grab session.
+
+    Inside unit_of_work() the unit of work's session is returned instead of
+    a new one.
+    """
+
+    current = getattr(_LOCAL, 'session', None)
+    if current is not None:
+        return current
 
     global _MAKER, _ENGINE
     if not _MAKER:
@@ -92,6 +202,32 @@ def get_session(autocommit=True, expire_on_commit=False):
     return _MAKER()
 
 
+@contextlib.contextmanager
+def unit_of_work():
+    """Runs every database write in the block in a single transaction.
+
+    The transaction is committed when the block exits and rolled back if it
+    raises. A nested unit of work joins the outer one. Units of work are
+    local to the greenthread that started them.
+    """
+    if getattr(_LOCAL, 'session', None) is not None:
+        yield _LOCAL.session
+        return
+
+    db_session = get_session()
+    db_session.begin()
+    _LOCAL.session = db_session
+    try:
+        yield db_session
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        _LOCAL.session = None
+        db_session.close()
+
+
 def raw_query(model, autocommit=True, expire_on_commit=False):
     return get_session(autocommit, expire_on_commit).query(model)
 
@@ -108,6 +244,41 @@ def clean_db():
         trans.commit()
 
 
+def archived_tables():
+    """Names of the tables that have a shadow_<name> table to archive to."""
+    return sorted(name[len('shadow_'):] for name in _ENGINE.table_names()
+                  if name.startswith('shadow_'))
+
+
+def archive_deleted_rows(table_name, before, max_rows):
+    """Move soft-deleted rows of a table into its shadow table.
+
+    At most max_rows rows deleted before the given time are moved, oldest
+    first, in a single transaction. Returns the number of rows moved.
+    """
+    meta = MetaData(bind=_ENGINE)
+    table = Table(table_name, meta, autoload=True)
+    shadow = Table('shadow_' + table_name, meta, autoload=True)
+    with contextlib.closing(_ENGINE.connect()) as con:
+        trans = con.begin()
+        try:
+            rows = con.execute(table.select().
+                               where(and_(table.c.deleted == True,
+                                          table.c.deleted_at < before)).
+                               order_by(table.c.deleted_at).
+                               limit(max_rows)).fetchall()
+            if rows:
+                con.execute(shadow.insert(), [dict(row) for row in rows])
+                con.execute(table.delete().
+                            where(table.c.id.in_([row['id']
+                                                  for row in rows])))
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+    return len(rows)
+
+
 def drop_db(options):
     meta = MetaData()
     engine = _create_engine(options)
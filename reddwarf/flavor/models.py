@@ -17,13 +17,18 @@
 
 """Model classes that form the core of instance flavor functionality."""
 
+import hashlib
+
 from reddwarf import db
 
 from novaclient import exceptions as nova_exceptions
 from reddwarf.common import exception
 from reddwarf.common import utils
+from reddwarf.common import wsgi
+from reddwarf.database import models as database_models
 from reddwarf.database.models import Credential
 from reddwarf.database.models import RemoteModelBase
+from reddwarf.flavor import views
 
 
 class Flavor(object):
@@ -77,4 +82,82 @@ class Flavors(RemoteModelBase):
 
     def __iter__(self):
         for item in self.flavors:
-            yield item
\ No newline at end of file
+            yield item
+
+
+class FlavorCatalog(object):
+    """Serialized flavor responses, built once per tenant URL prefix.
+
+    Flavors come from the service configuration cache, so an entry is
+    rebuilt whenever that cache is reloaded or invalidated. Every body is
+    stored with its strong ETag so unchanged flavors can be answered with
+    304 Not Modified.
+    """
+
+    CONTENT_TYPES = ['application/json', 'application/xml']
+    MAX_ENTRIES = 1000
+
+    class _Entry(object):
+
+        def __init__(self):
+            self.index = None
+            self.detail = None
+            self.flavors = {}
+
+    def __init__(self):
+        self._entries = utils.LRUCache(max_size=self.MAX_ENTRIES, ttl=0)
+        self._serializer = wsgi.ReddwarfResponseSerializer(
+            body_serializers={'application/xml':
+                              wsgi.ReddwarfXMLDictSerializer()})
+
+    def index(self, request, tenant_id):
+        return self._entry(request, tenant_id).index
+
+    def index_detail(self, request, tenant_id):
+        return self._entry(request, tenant_id).detail
+
+    def show(self, request, tenant_id, flavor_id):
+        try:
+            return self._entry(request, tenant_id).flavors[int(flavor_id)]
+        except KeyError:
+            raise exception.NotFound(uuid=flavor_id)
+
+    def _entry(self, request, tenant_id):
+        snapshot = database_models.service_config_cache.snapshot()
+        key = (snapshot.version, request.application_url, tenant_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._build(snapshot, request, tenant_id)
+            self._entries.set(key, entry)
+        return entry
+
+    def _build(self, snapshot, request, tenant_id):
+        # Only live flavors of the database service are listed. Deleted
+        # rows and flavors of other services are left out, as they are
+        # when an instance is created.
+        flavors = sorted((flavor for (service_name, flavor_id), flavor
+                          in snapshot.flavors.items()
+                          if service_name == 'database'),
+                         key=lambda flavor: int(flavor['flavor_id']))
+        flavors_view = views.FlavorsView(flavors, tenant_id, request)
+
+        entry = self._Entry()
+        entry.index = self._serialize(flavors_view.index(), 'index')
+        entry.detail = self._serialize(flavors_view.index_detail(),
+                                       'index_detail')
+        for flavor in flavors:
+            entry.flavors[int(flavor['flavor_id'])] = self._serialize(
+                views.FlavorView(flavor, tenant_id, request).show(), 'show')
+        return entry
+
+    def _serialize(self, data, action):
+        """Returns {content_type: (body, etag)} for data."""
+        bodies = {}
+        for content_type in self.CONTENT_TYPES:
+            serializer = self._serializer.get_body_serializer(content_type)
+            body = serializer.serialize(data, action)
+            bodies[content_type] = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        return bodies
+
+
+catalog = FlavorCatalog()
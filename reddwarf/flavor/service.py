@@ -18,12 +18,12 @@
 import routes
 import webob.exc
 
-from reddwarf.common import context as rd_context
+from reddwarf.common import config
 from reddwarf.common import exception
-from reddwarf.common import utils
 from reddwarf.common import wsgi
-from reddwarf.database import models
-from reddwarf.flavor import views
+from reddwarf.flavor import models
+
+CONFIG = config.Config
 
 
 class FlavorController(wsgi.Controller):
@@ -31,38 +31,40 @@ class FlavorController(wsgi.Controller):
 
     def show(self, request, tenant_id, id):
         """Return a single flavor."""
-        context = rd_context.ReddwarfContext(
-                  auth_tok=request.headers["X-Auth-Token"],
-                  tenant=tenant_id)
-        
         self._validate_flavor_id(id)
-        flavor = models.ServiceFlavor().find_by(flavor_id=int(id))
         # Pass in the request to build accurate links.
-        return wsgi.Result(views.FlavorView(flavor, tenant_id, request).show(), 200)
+        return self._cached_result(request,
+                                   models.catalog.show(request, tenant_id, id))
 
     def index(self, request, tenant_id):
         """Return all flavors."""
-        context = rd_context.ReddwarfContext(
-                  auth_tok=request.headers["X-Auth-Token"],
-                  tenant=tenant_id)   
-        
-        flavors = models.ServiceFlavor().find_all()        
-        # Pass in the request to build accurate links.        
-        return wsgi.Result(views.FlavorsView(flavors, tenant_id, request).index(), 200)
+        return self._cached_result(request,
+                                   models.catalog.index(request, tenant_id))
     
     def index_detail(self, request, tenant_id):
         """Return all flavors with detail."""
-        context = rd_context.ReddwarfContext(
-                  auth_tok=request.headers["X-Auth-Token"],
-                  tenant=tenant_id) 
-        
-        flavors = models.ServiceFlavor().find_all()
-        # Pass in the request to build accurate links.        
-        return wsgi.Result(views.FlavorsView(flavors, tenant_id, request).index_detail(), 200)    
+        return self._cached_result(request,
+                                   models.catalog.index_detail(request, tenant_id))
+
+    def _cached_result(self, request, bodies):
+        """Answer from pre-serialized bodies, or 304 if the client's copy is current."""
+        body, etag = bodies[request.best_match_content_type()]
+        headers = {'ETag': etag,
+                   'Vary': 'Accept',
+                   'Cache-Control': 'private, max-age=%d'
+                   % int(CONFIG.get('flavor_cache_max_age', 300))}
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if etag in tags or '*' in tags:
+            return wsgi.Result(None, 304, headers)
+        return wsgi.SerializedResult(dict((content_type, serialized)
+                                          for content_type, (serialized, _)
+                                          in bodies.items()), 200, headers)
 
     def _validate_flavor_id(self, id):
         try:
             if int(id) != float(id):
                 raise exception.NotFound(uuid=id)
         except ValueError:
-            raise exception.NotFound(uuid=id)
\ No newline at end of file
+            raise exception.NotFound(uuid=id)
@@ -15,12 +15,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import os
 
 
 def build_flavor_href(request, tenant_id, flavor_id):
         """Using a flavor id, construct what the href for that flavor would be."""
-        base_url = request.application_url
-        href = os.path.join(base_url, tenant_id,
-                            "flavors", str(flavor_id))
-        return href
\ No newline at end of file
+        return "%s/%s/flavors/%s" % (request.application_url.rstrip('/'),
+                                     tenant_id, flavor_id)
\ No newline at end of file
@@ -16,7 +16,8 @@
 #    under the License.
 
 
-import os
+from reddwarf.flavor import utils
+
 
 class FlavorView(object):
 
@@ -38,9 +39,8 @@ class FlavorView(object):
 
     def _build_links(self):
         """Build the links for the flavor information."""
-        base_url = self.request.application_url
-        href = os.path.join(base_url, self.tenant_id,
-                            "flavors", str(self.flavor['flavor_id']))
+        href = utils.build_flavor_href(self.request, self.tenant_id,
+                                       self.flavor['flavor_id'])
         links= [
             {
                 'rel': 'self',
@@ -29,15 +29,19 @@ import ast
 import inspect
 import logging
 import sys
+import time
 import traceback
 import uuid
 
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
+from eventlet import semaphore
 
 from reddwarf.common import config
 from reddwarf.common import exception
 from reddwarf.common import local
+from reddwarf.common import utils
 import reddwarf.rpc.common as rpc_common
 from reddwarf.common import context
 
@@ -134,9 +138,13 @@ class ConnectionContext(rpc_common.Connection):
             raise exception.InvalidRPCConnectionReuse()
 
 
-def msg_reply(msg_id, connection_pool, reply=None, failure=None, ending=False):
+def msg_reply(msg_id, connection_pool, reply=None, failure=None, ending=False,
+              reply_q=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
+    When the caller named a reply_q, the reply goes to that queue and
+    carries msg_id so the caller can match it to the call.
+
     Failure should be a sys.exc_info() tuple.
 
     """
@@ -156,20 +164,25 @@ def msg_reply(msg_id, connection_pool, reply=None, failure=None, ending=False):
                     'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
 
 
 class RpcContext(context.ReddwarfContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, *args, **kwargs):
         self.msg_id = kwargs.pop('msg_id', None)
+        self.reply_q = kwargs.pop('reply_q', None)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, reply=None, failure=None, ending=False,
               connection_pool=None):
         if self.msg_id:
             msg_reply(self.msg_id, connection_pool, reply, failure,
-                      ending)
+                      ending, reply_q=self.reply_q)
             if ending:
                 self.msg_id = None
 
@@ -185,6 +198,7 @@ def unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     ctx = RpcContext.from_dict(context_dict)
     LOG.debug(_('unpacked context: %s'), ctx.to_dict())
     return ctx
@@ -271,7 +285,7 @@ class MulticallWaiter(object):
     def __init__(self, connection, timeout):
         self._connection = connection
         timeout = timeout or config.Config.get('rpc_response_timeout', 3600)
-        self._iterator = connection.iterconsume(timeout)
+        self._iterator = connection.iterconsume(timeout=timeout)
         self._result = None
         self._done = False
         self._got_ending = False
@@ -287,18 +301,7 @@ class MulticallWaiter(object):
     def __call__(self, data):
         """The consume() callback will call this.  Store the result."""
         LOG.debug("Message received from wire is: %r" % data)
-        try:
-            data = ast.literal_eval(data)
-        except Exception:
-            LOG.exception('Invalid string received from message.')
-            pass
-
-        if data['failure']:
-            self._result = rpc_common.RemoteError(*data['failure'])
-        elif data.get('ending', False):
-            self._got_ending = True
-        else:
-            self._result = data['result']
+        self._result, self._got_ending = _unpack_reply(_decode_reply(data))
 
     def __iter__(self):
         """Return a result until we get a 'None' response from consumer"""
@@ -316,6 +319,122 @@ class MulticallWaiter(object):
             yield result
 
 
+def _decode_reply(data):
+    """Replies from older agents arrive as the repr of a dict."""
+    if isinstance(data, basestring):
+        try:
+            data = ast.literal_eval(data)
+        except Exception:
+            LOG.exception('Invalid string received from message.')
+    return data
+
+
+def _unpack_reply(data):
+    """Return (result, ending) for a reply; a failure becomes RemoteError."""
+    if data['failure']:
+        return rpc_common.RemoteError(*data['failure']), False
+    elif data.get('ending', False):
+        return None, True
+    return data['result'], False
+
+
+class ReplyProxy(object):
+    """One long-lived reply queue per process for every rpc.call.
+
+    Calls send their msg_id and the queue name; replies carry the msg_id
+    back and are handed to the green thread waiting on it.  Replies for
+    calls nobody waits on any more are dropped, and waiters that heard
+    nothing for their whole timeout are swept when a new call starts.
+    """
+
+    def __init__(self, connection_pool):
+        self._waiters = {}
+        self._reply_q = 'reply_%s' % uuid.uuid4().hex
+        self.conn = ConnectionContext(connection_pool, pooled=False)
+        self.conn.declare_direct_consumer(self._reply_q, self._process_data)
+        self.conn.consume_in_thread()
+
+    @property
+    def reply_q(self):
+        return self._reply_q
+
+    def _process_data(self, data):
+        data = _decode_reply(data)
+        msg_id = data.get('_msg_id')
+        waiter = self._waiters.get(msg_id)
+        if waiter is None:
+            LOG.warn(_('No call waiting for reply to msg_id %s') % msg_id)
+            return
+        replies, timeout, deadline = waiter
+        self._waiters[msg_id] = (replies, timeout, time.time() + timeout)
+        replies.put(data)
+
+    def add_call_waiter(self, msg_id, timeout):
+        return self.add_call_waiters([msg_id], timeout)
+
+    def add_call_waiters(self, msg_ids, timeout):
+        """Wait on several calls at once; their replies share one queue."""
+        now = time.time()
+        for orphan, waiter in self._waiters.items():
+            if waiter[2] < now:
+                LOG.warn(_('Dropping expired call waiter %s') % orphan)
+                del self._waiters[orphan]
+        replies = queue.Queue()
+        for msg_id in msg_ids:
+            self._waiters[msg_id] = (replies, timeout, now + timeout)
+        return replies
+
+    def del_call_waiter(self, msg_id):
+        self._waiters.pop(msg_id, None)
+
+    def close(self):
+        self.conn.close()
+
+
+class ReplyWaiter(object):
+    """Iterates the replies of one call made through the ReplyProxy."""
+
+    def __init__(self, reply_proxy, msg_id, timeout):
+        self._reply_proxy = reply_proxy
+        self._msg_id = msg_id
+        self._timeout = float(timeout or
+                              config.Config.get('rpc_response_timeout', 3600))
+        self._replies = reply_proxy.add_call_waiter(msg_id, self._timeout)
+
+    def done(self):
+        self._reply_proxy.del_call_waiter(self._msg_id)
+
+    def __iter__(self):
+        """Return a result until the ending reply, failure or timeout."""
+        try:
+            while True:
+                try:
+                    data = self._replies.get(timeout=self._timeout)
+                except queue.Empty:
+                    raise rpc_common.Timeout()
+                result, ending = _unpack_reply(data)
+                if ending:
+                    return
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            # also runs when the caller drops the iterator early
+            self.done()
+
+
+_reply_proxy = None
+_reply_proxy_lock = semaphore.Semaphore()
+
+
+def _get_reply_proxy(connection_pool):
+    global _reply_proxy
+    with _reply_proxy_lock:
+        if _reply_proxy is None:
+            _reply_proxy = ReplyProxy(connection_pool)
+    return _reply_proxy
+
+
 def create_connection(new, connection_pool):
     """Create a connection"""
     return ConnectionContext(connection_pool, pooled=not new)
@@ -334,6 +453,19 @@ def multicall(context, topic, msg, timeout, connection_pool):
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     pack_context(msg, context)
 
+    if utils.bool_from_string(config.Config.get('rpc_single_reply_queue',
+                                                'False')):
+        reply_proxy = _get_reply_proxy(connection_pool)
+        msg['_reply_q'] = reply_proxy.reply_q
+        wait_msg = ReplyWaiter(reply_proxy, msg_id, timeout)
+        try:
+            with ConnectionContext(connection_pool) as conn:
+                conn.topic_send(topic, msg)
+        except Exception:
+            wait_msg.done()
+            raise
+        return wait_msg
+
     conn = ConnectionContext(connection_pool)
     wait_msg = MulticallWaiter(conn, timeout)
     conn.declare_direct_consumer(msg_id, wait_msg)
@@ -341,6 +473,81 @@ def multicall(context, topic, msg, timeout, connection_pool):
     return wait_msg
 
 
+def scatter_call(context, calls, timeout, connection_pool):
+    """Make many calls at once and gather the first reply of each.
+
+    calls maps a key to a (topic, msg) pair.  Every message goes out on
+    one connection with its own msg_id, and the replies are collected on
+    the process reply queue until all calls have answered or timeout
+    seconds have passed.  Returns a dict of key -> result for the calls
+    that answered; a call that failed maps to its RemoteError.
+
+    Without rpc_single_reply_queue the agents only answer on a queue per
+    call, so the calls are made concurrently through call() instead.
+    """
+    timeout = float(timeout or
+                    config.Config.get('rpc_response_timeout', 3600))
+    if not utils.bool_from_string(config.Config.get('rpc_single_reply_queue',
+                                                    'False')):
+        return _scatter_per_call(context, calls, timeout, connection_pool)
+    reply_proxy = _get_reply_proxy(connection_pool)
+    keys = dict((uuid.uuid4().hex, key) for key in calls)
+    replies = reply_proxy.add_call_waiters(keys.keys(), timeout)
+    LOG.debug(_('Making %d scattered calls ...'), len(keys))
+    results = {}
+    try:
+        with ConnectionContext(connection_pool) as conn:
+            with conn.confirm_batch():
+                for msg_id, key in keys.iteritems():
+                    topic, msg = calls[key]
+                    msg.update({'_msg_id': msg_id,
+                                '_reply_q': reply_proxy.reply_q})
+                    pack_context(msg, context)
+                    conn.topic_send(topic, msg)
+
+        deadline = time.time() + timeout
+        while len(results) < len(keys):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                data = replies.get(timeout=remaining)
+            except queue.Empty:
+                break
+            key = keys.get(data.get('_msg_id'))
+            if key is None or key in results:
+                continue
+            result, ending = _unpack_reply(data)
+            if not ending:
+                results[key] = result
+    finally:
+        for msg_id in keys:
+            reply_proxy.del_call_waiter(msg_id)
+    return results
+
+
+def _scatter_per_call(context, calls, timeout, connection_pool):
+    """scatter_call for agents that reply on a queue per call."""
+    results = {}
+
+    def _call(key):
+        topic, msg = calls[key]
+        try:
+            results[key] = call(context, topic, msg, timeout,
+                                connection_pool)
+        except rpc_common.RemoteError as e:
+            results[key] = e
+        except Exception:
+            LOG.exception(_('No reply from %s') % topic)
+
+    pool = greenpool.GreenPool(
+        int(config.Config.get('rpc_scatter_pool_size', 64)))
+    for key in calls:
+        pool.spawn_n(_call, key)
+    pool.waitall()
+    return results
+
+
 def call(context, topic, msg, timeout, connection_pool):
     """Sends a message on a topic and wait for a response."""
     rv = multicall(context, topic, msg, timeout, connection_pool)
@@ -394,4 +601,8 @@ def notify(context, topic, msg, connection_pool):
 
 
 def cleanup(connection_pool):
+    global _reply_proxy
+    if _reply_proxy is not None:
+        _reply_proxy.close()
+        _reply_proxy = None
     connection_pool.empty()
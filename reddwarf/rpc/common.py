@@ -56,6 +56,14 @@ class Timeout(exception.ReddwarfError):
     message = _("Timeout while waiting on RPC response.")
 
 
+class InvalidMessage(exception.ReddwarfError):
+    """Signifies that a message could not be decoded or is malformed.
+
+    Such messages are rejected without reaching the message handler.
+    """
+    message = _("Invalid RPC message: %(reason)s.")
+
+
 class Connection(object):
     """A connection, returned by rpc.create_connection().
 
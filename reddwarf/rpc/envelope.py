@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 HP Software, LLC
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Versioned envelope for messages sent by remote agents.
+
+A message is wrapped as {'version': '1.0', 'message': {...}} and
+encoded as JSON, or as msgpack when it is installed.  The encoding is
+named by the AMQP content-type header.  Bare messages and the Python
+literals older agents send are still accepted, unless
+rpc_legacy_messages is turned off.
+"""
+
+import ast
+import json
+
+from reddwarf.common import config
+from reddwarf.common import utils
+from reddwarf.rpc import common as rpc_common
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+VERSION = '1.0'
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+
+_DECODERS = {JSON: json.loads}
+_ENCODERS = {JSON: json.dumps}
+if msgpack is not None:
+    _DECODERS[MSGPACK] = msgpack.unpackb
+    _ENCODERS[MSGPACK] = msgpack.packb
+
+
+def serialize(msg, content_type=JSON):
+    """Wrap msg in the envelope and return the encoded body."""
+    try:
+        encode = _ENCODERS[content_type]
+    except KeyError:
+        raise rpc_common.InvalidMessage(
+            reason="unsupported content type %s" % content_type)
+    return encode({'version': VERSION, 'message': msg})
+
+
+def deserialize(body, content_type=None):
+    """Decode and validate a message body.
+
+    Raises InvalidMessage when the body cannot be decoded, is from an
+    unsupported envelope version or is not a method call.
+    """
+    decode = _DECODERS.get(content_type)
+    if decode is None:
+        return validate(_decode_legacy(body))
+
+    try:
+        envelope = decode(body)
+    except Exception as e:
+        raise rpc_common.InvalidMessage(reason="undecodable body: %s" % e)
+    if not isinstance(envelope, dict) or 'version' not in envelope:
+        # older agents publish the bare message, or its repr as a string
+        return validate(_decode_legacy(envelope))
+    if str(envelope['version']).split('.')[0] != VERSION.split('.')[0]:
+        raise rpc_common.InvalidMessage(
+            reason="unsupported version %s" % envelope['version'])
+    return validate(envelope.get('message'))
+
+
+def validate(msg):
+    """Check msg is a method call: a non-empty method and a dict of args."""
+    if not isinstance(msg, dict):
+        raise rpc_common.InvalidMessage(reason="message is not a mapping")
+    if not isinstance(msg.get('method'), basestring) or not msg['method']:
+        raise rpc_common.InvalidMessage(reason="missing method")
+    if not isinstance(msg.get('args'), dict):
+        raise rpc_common.InvalidMessage(reason="args is not a mapping")
+    return msg
+
+
+def _decode_legacy(body):
+    if not utils.bool_from_string(config.Config.get('rpc_legacy_messages',
+                                                    'True')):
+        raise rpc_common.InvalidMessage(reason="legacy messages are disabled")
+    if isinstance(body, dict):
+        return body
+    try:
+        return ast.literal_eval(body)
+    except Exception as e:
+        raise rpc_common.InvalidMessage(reason="undecodable body: %s" % e)
@@ -14,7 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import ast
+import contextlib
 import itertools
 import socket
 import ssl
@@ -31,8 +31,10 @@ import kombu.messaging
 import kombu.connection
 
 from reddwarf.common import config
+from reddwarf.common import utils
 from reddwarf.rpc import amqp as rpc_amqp
 from reddwarf.rpc import common as rpc_common
+from reddwarf.rpc import envelope
 
 LOG = logging.getLogger(__name__)
 SSL_VERSION = "SSLv2"
@@ -77,7 +79,7 @@ class ConsumerBase(object):
         a message is read.
 
         Messages will automatically be acked if the callback doesn't
-        raise an exception
+        raise an exception.  Messages that fail to decode are rejected.
         """
 
         options = {'consumer_tag': self.tag}
@@ -88,11 +90,26 @@ class ConsumerBase(object):
 
         def _callback(raw_message):
             message = self.channel.message_to_python(raw_message)
-            callback(message.payload)
-            message.ack()
+            try:
+                payload = self.decode(message)
+            except rpc_common.InvalidMessage as e:
+                LOG.error(_("Rejecting message on %(tag)s: %(err)s")
+                          % {'tag': self.tag, 'err': e})
+                message.reject()
+                return
+            self.deliver(callback, payload, message)
 
         self.queue.consume(*args, callback=_callback, **options)
 
+    def decode(self, message):
+        """Return the payload handed to the callback."""
+        return message.payload
+
+    def deliver(self, callback, payload, message):
+        """Hand the payload to the callback, then ack the message."""
+        callback(payload)
+        message.ack()
+
     def cancel(self):
         """Cancel the consuming from the queue, if it has started"""
         try:
@@ -140,7 +157,7 @@ class DirectConsumer(ConsumerBase):
 class PassiveConsumer(ConsumerBase):
     """Queue/consumer class for non-exclusive direct queue"""
 
-    def __init__(self, channel, topic, callback, tag, **kwargs):
+    def __init__(self, channel, topic, callback, tag, queue=None, **kwargs):
         """Init a non-exclusive 'direct' queue so
            it can be shared by different connections.
 
@@ -148,31 +165,46 @@ class PassiveConsumer(ConsumerBase):
         'topic' is the exchange name to listen on
         'callback' is the callback to call when messages are received
         'tag' is a unique ID for the consumer on the channel
+        'queue' is the queue name, the topic by default
 
-        Other kombu options may be passed
+        The queue is durable and outlives its consumers, so any number of
+        workers can compete for its messages and come and go without
+        losing any.  Other kombu options may be passed
         """
+        queue = queue or topic
 
         LOG.debug("Declaring PassiveConsumer exchange-name %s", topic)
         LOG.debug("Declaring PassiveConsumer routing-key %s", topic)
+        LOG.debug("Declaring PassiveConsumer queue %s", queue)
 
         # Default options
-        options = {'durable': False,
-                   'auto_delete': True,
+        options = {'durable': True,
+                   'auto_delete': False,
                    'exclusive': False}
         options.update(kwargs)
+        # declared the way the agents publishing to it declare it
         exchange = kombu.entity.Exchange(
             name=topic,
             type='direct',
-            durable=options['durable'],
-            auto_delete=options['auto_delete'])
+            durable=False,
+            auto_delete=True)
         super(PassiveConsumer, self).__init__(
             channel,
             callback,
             tag,
-            name=topic,
+            name=queue,
             exchange=exchange,
             routing_key=topic,
             **options)
+
+    def decode(self, message):
+        """Unwrap the agent's envelope, see reddwarf.rpc.envelope."""
+        return envelope.deserialize(message.body, message.content_type)
+
+    def deliver(self, callback, payload, message):
+        """Hand the payload and the message to the callback, which acks
+        the message once what it carries has been stored."""
+        callback(payload, message)
         
         
 class TopicConsumer(ConsumerBase):
@@ -363,6 +395,14 @@ class Connection(object):
         # max retry-interval = 30 seconds
         self.interval_max = 30
         self.memory_transport = False
+        self.prefetch_count = None
+        # (publisher class, topic, options) -> Publisher on self.channel
+        self.publishers = utils.LRUCache(
+            max_size=int(config.Config.get('rpc_publisher_cache_size', 64)),
+            ttl=0)
+        self.confirms = utils.bool_from_string(
+            config.Config.get('rabbit_publisher_confirms', 'False'))
+        self._batching = 0
 
         if server_params is None:
             server_params = {}
@@ -452,6 +492,11 @@ class Connection(object):
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
+        if self.prefetch_count:
+            self.channel.basic_qos(0, self.prefetch_count, False)
+        self.publishers.clear()
+        if self.confirms:
+            self._select_confirms()
         for consumer in self.consumers:
             consumer.reconnect(self.channel)
         LOG.debug("Params: %s" % self.params)
@@ -542,16 +587,69 @@ class Connection(object):
         self.connection = None
 
     def reset(self):
-        """Reset a connection so it can be used again"""
+        """Reset a connection so it can be used again.  A channel that
+        only published is kept, along with its declared publishers."""
         self.cancel_consumer_thread()
+        if not self.consumers and not self.prefetch_count:
+            return
         self.channel.close()
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
         self.consumers = []
+        self.prefetch_count = None
+        self.publishers.clear()
+        if self.confirms:
+            self._select_confirms()
+
+    def _select_confirms(self):
+        """Have the broker ack every message published on the channel."""
+        if not hasattr(self.channel, 'confirm_select'):
+            LOG.warn(_("The AMQP transport does not support publisher "
+                       "confirms"))
+            self.confirms = False
+            return
+        self.channel.confirm_select()
+        self.channel.events['basic_ack'].add(self._confirmed)
+        self._published = 0
+        self._acked = 0
+        self._acked_tags = set()
+
+    def _confirmed(self, delivery_tag, multiple):
+        if multiple:
+            self._acked = max(self._acked, delivery_tag)
+        else:
+            self._acked_tags.add(delivery_tag)
+        while self._acked + 1 in self._acked_tags:
+            self._acked += 1
+            self._acked_tags.discard(self._acked)
+
+    def wait_for_confirms(self):
+        """Block until the broker acked everything published so far."""
+        while self._acked < self._published:
+            self.channel.wait(allowed_methods=[(60, 80)])
+
+    @contextlib.contextmanager
+    def confirm_batch(self):
+        """Publish without waiting on each confirm inside the block, then
+        wait once for all of them."""
+        self._batching += 1
+        try:
+            yield self
+        finally:
+            self._batching -= 1
+        if self.confirms and not self._batching:
+            self.wait_for_confirms()
+
+    def set_prefetch_count(self, count):
+        """Limit how many unacknowledged messages the broker pushes to
+        this connection's consumers.  Kept across reconnects.
+        """
+        self.prefetch_count = count
+        self.channel.basic_qos(0, count, False)
 
-    def declare_consumer(self, consumer_cls, topic, callback):
+    def declare_consumer(self, consumer_cls, topic, callback, **kwargs):
         """Create a Consumer using the class that was passed in and
         add it to our list of consumers
         """
@@ -563,7 +661,7 @@ class Connection(object):
 
         def _declare_consumer():
             consumer = consumer_cls(self.channel, topic, callback,
-                    self.consumer_num.next())
+                    self.consumer_num.next(), **kwargs)
             self.consumers.append(consumer)
             return consumer
 
@@ -618,12 +716,20 @@ class Connection(object):
                 "'%(topic)s': %(err_str)s") % log_info)
 
         def _publish():
-            publisher = cls(self.channel, topic, **kwargs)
-            LOG.info("_publish info%s %s %s %s" % (self.channel, topic,
-                                                   kwargs, publisher))
+            key = (cls, topic, tuple(sorted(kwargs.items())))
+            publisher = self.publishers.get(key)
+            if publisher is None:
+                publisher = cls(self.channel, topic, **kwargs)
+                LOG.debug("Declared publisher %s for topic %s" %
+                          (cls.__name__, topic))
+                self.publishers.set(key, publisher)
             publisher.send(msg)
+            if self.confirms:
+                self._published += 1
 
         self.ensure(_error_callback, _publish)
+        if self.confirms and not self._batching:
+            self.wait_for_confirms()
 
     def declare_direct_consumer(self, topic, callback):
         """Create a 'direct' queue.
@@ -632,12 +738,12 @@ class Connection(object):
         """
         self.declare_consumer(DirectConsumer, topic, callback)
         
-    def declare_passive_consumer(self, topic, callback):
+    def declare_passive_consumer(self, topic, callback, queue=None):
         """Create a 'passive' queue.
         In reddwarf's use, this is generally a direct queue used for
         passively listening on phone home message from remote agents
         """
-        self.declare_consumer(PassiveConsumer, topic, callback)        
+        self.declare_consumer(PassiveConsumer, topic, callback, queue=queue)
 
     def declare_topic_consumer(self, topic, callback=None):
         """Create a 'topic' consumer."""
@@ -706,6 +812,11 @@ def multicall(context, topic, msg, timeout=None):
     return rpc_amqp.multicall(context, topic, msg, timeout, Connection.pool)
 
 
+def scatter_call(context, calls, timeout=None):
+    """Make many calls at once and gather their replies."""
+    return rpc_amqp.scatter_call(context, calls, timeout, Connection.pool)
+
+
 def call(context, topic, msg, timeout=None):
     """Sends a message on a topic and wait for a response."""
     return rpc_amqp.call(context, topic, msg, timeout, Connection.pool)
@@ -742,15 +853,24 @@ def cleanup():
     return rpc_amqp.cleanup(Connection.pool)
 
 
-def listen(exchange, msg_handler):
-    """Passively listen on direct exchange for phone home messages."""
+def listen(exchange, msg_handler, prefetch_count=None, queue=None):
+    """Passively listen on direct exchange for phone home messages.
+
+    Declares a consumer on its own connection and returns the waiter;
+    messages are handled once waiter.consume() runs.
+
+    msg_handler is called with each message and its delivery, and must
+    ack (or requeue) the delivery once it has handled the message.
+    'prefetch_count' bounds the messages the broker delivers ahead of
+    their acks.  'queue' names the shared queue when it differs from the exchange.
+    """
     LOG.debug("Listening to exchange: %s" % exchange)
     LOG.debug("Using message handler %s" % msg_handler)
     conn = rpc_amqp.ConnectionContext(Connection.pool)
+    if prefetch_count:
+        conn.set_prefetch_count(prefetch_count)
     wait_msg = PassiveWaiter(conn, msg_handler)
-    conn.declare_passive_consumer(exchange, wait_msg)
-    LOG.debug("Waiting for messages...")
-    list(wait_msg)
+    conn.declare_passive_consumer(exchange, wait_msg, queue=queue)
     return wait_msg
 
 
@@ -763,26 +883,29 @@ class PassiveWaiter(object):
         self._done = False
 
     def done(self):
+        """Close the connection.  Messages delivered but not yet acked
+        go back to the queue for the other consumers."""
+        if self._done:
+            return
         self._done = True
         self._iterator.close()
         self._iterator = None
         self._connection.close()
 
-    def __call__(self, data):
-        """The consume() callback will call this.  Store the result."""
-        LOG.debug(_('rpc.listen raw data received: %r') % (data,))
-        message = data
-        try:
-            message = ast.literal_eval(data)
-        except Exception:
-            LOG.exception('Invalid string received from message.')
+    def consume(self):
+        """Handle incoming messages until done() is called."""
+        LOG.debug("Waiting for messages...")
+        for _ in self:
             pass
+
+    def __call__(self, message, delivery):
+        """The consume() callback will call this with a decoded message."""
+        LOG.debug(_('rpc.listen message received: %r') % (message,))
         # pass the message dictionary to message handler class
-        self._msg_handler(message)
+        self._msg_handler(message, delivery)
 
     def __iter__(self):
         """Keep consuming incoming messages"""
-        if self._done:
-            raise StopIteration
-        while True:
-            self._iterator.next()
\ No newline at end of file
+        while not self._done:
+            self._iterator.next()
+            yield
\ No newline at end of file
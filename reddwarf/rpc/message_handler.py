@@ -19,14 +19,18 @@
 
 import logging
 import time
+
+import eventlet
+import greenlet
 import routes
 
+from reddwarf.common import config
 from reddwarf.common.service import Service
 from reddwarf.database.guest_api import PhoneHomeMessageHandler
 from reddwarf.rpc import impl_kombu
 from reddwarf.common import wsgi
 
-#CONFIG = config.Config
+CONFIG = config.Config
 LOG = logging.getLogger(__name__)
 
 EXCHANGE = "phonehome"
@@ -53,22 +57,50 @@ def app_factory(global_conf, **local_conf):
 
 class MessageHandlerService(Service):
     """A background service to listen on MQ and handle messages pushed from remote agents.
-       It will be started on an independent thread living through the API Server lifetime."""
+       It will be started on an independent thread living through the API Server lifetime.
+
+       Every process runs phonehome_consumers consumers on the durable
+       phonehome_queue, so more processes or hosts can be added to share
+       the load."""
     def __init__(self, *args, **kwargs):
         LOG.debug("MessageHandlerService init")
-        self._listener = None
+        self._listeners = []
+        self._consumers = []
         self._msg_handler = PhoneHomeMessageHandler()
         
     def periodic_tasks(self, raise_on_error=False):
         LOG.info("Launching a periodic task")        
 
     def start(self):
-        """Setup connection to MQ with one single consumer to handle
-           phone home messages from all remote instances"""
+        """Setup connections to MQ with the consumers handling phone home
+           messages from all remote instances"""
         LOG.debug("Starting Message Handler Service...")
-        self._listener = impl_kombu.listen(EXCHANGE, self._msg_handler)
+        prefetch_count = int(CONFIG.get('phonehome_prefetch_count', 1000))
+        queue = CONFIG.get('phonehome_queue', 'phonehome_workers')
+        for i in range(int(CONFIG.get('phonehome_consumers', 1))):
+            listener = impl_kombu.listen(EXCHANGE, self._msg_handler,
+                                         prefetch_count=prefetch_count,
+                                         queue=queue)
+            self._listeners.append(listener)
+            self._consumers.append(eventlet.spawn(listener.consume))
+
+    def wait(self):
+        for consumer in self._consumers:
+            try:
+                consumer.wait()
+            except greenlet.GreenletExit:
+                pass
 
     def stop(self):
-        """Close consumer to MQ"""
-        self._listener.done()
+        """Stop consuming, finish what was taken off the queue, then close
+        the connections.
+
+        Draining first lets the handler ack what it wrote over the still
+        open connections.  Messages prefetched but not yet acked are
+        returned to the queue when the connections close."""
+        for consumer in self._consumers:
+            consumer.kill()
+        self._msg_handler.drain()
+        for listener in self._listeners:
+            listener.done()
         LOG.debug("Message Handler Service is stopped.")
@@ -15,8 +15,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import logging
 
+from eventlet import greenthread
+
+from reddwarf.common import config
+from reddwarf.common import context as rd_context
+from reddwarf.common import exception
+from reddwarf.common import utils
+from reddwarf.database import guest_api
+from reddwarf.database import models
+from reddwarf.database import quota
+from reddwarf.db import archive
+from reddwarf.taskmanager import provisioning
+
+CONFIG = config.Config
 LOG = logging.getLogger(__name__)
 
 
@@ -25,9 +39,156 @@ class TaskManager(object):
 
     def __init__(self, *args, **kwargs):
         LOG.info("TaskManager init %s %s" % (args, kwargs))
+        # Provisioning tasks being worked on, or waiting to be retried, by
+        # this process.
+        self._active_tasks = set()
+        self._retrying_tasks = set()
+        self._last_archive = None
+        self._archiving = False
+        self._last_health_sweep = None
 
     def periodic_tasks(self, raise_on_error=False):
         LOG.info("Launching a periodic task")
+        try:
+            self._resume_stale_provisioning()
+        except Exception:
+            LOG.exception("Failed to resume provisioning tasks")
+            if raise_on_error:
+                raise
+        try:
+            quota.expire_reservations()
+        except Exception:
+            LOG.exception("Failed to expire quota reservations")
+            if raise_on_error:
+                raise
+        try:
+            self._archive_deleted_rows()
+        except Exception:
+            LOG.exception("Failed to start archiving deleted rows")
+            if raise_on_error:
+                raise
+        try:
+            self._sweep_guest_health()
+        except Exception:
+            LOG.exception("Failed to sweep guest health")
+            if raise_on_error:
+                raise
+
+    def _archive_deleted_rows(self):
+        """Archive old soft-deleted rows every archive_interval_seconds.
+
+        The archive runs in its own greenthread, so a long run does not
+        hold up the other periodic tasks, and a new one is not started
+        while it is still going. Setting archive_deleted_after_days to 0
+        turns archival off.
+        """
+        if not int(CONFIG.get('archive_deleted_after_days', 30)):
+            return
+        if self._archiving:
+            return
+        interval = datetime.timedelta(
+            seconds=int(CONFIG.get('archive_interval_seconds', 3600)))
+        now = utils.utcnow()
+        if self._last_archive and now - self._last_archive < interval:
+            return
+        self._last_archive = now
+        self._archiving = True
+        greenthread.spawn_n(self._run_archive)
+
+    def _run_archive(self):
+        try:
+            archive.archive_deleted_rows()
+        except Exception:
+            LOG.exception("Failed to archive deleted rows")
+        finally:
+            self._archiving = False
+
+    def _sweep_guest_health(self):
+        """Refresh every guest's MySQL status every guest_health_interval
+        seconds. An interval of 0 turns the sweep off.
+        """
+        interval = int(CONFIG.get('guest_health_interval', 300))
+        if not interval:
+            return
+        now = utils.utcnow()
+        if (self._last_health_sweep and
+                now - self._last_health_sweep <
+                datetime.timedelta(seconds=interval)):
+            return
+        self._last_health_sweep = now
+        guest_api.API().sweep_mysql_status(
+            rd_context.ReddwarfContext(is_admin=True))
 
     def test_method(self, context):
         LOG.info("test_method called with context %s" % context)
+
+    def provision_instance(self, context, task_id):
+        """Run (or resume) the provisioning task for a new instance.
+
+        A failed step is retried with a growing delay until
+        provisioning_max_attempts is reached, after which the instance is
+        marked as failed.
+        """
+        self._retrying_tasks.discard(task_id)
+        if task_id in self._active_tasks:
+            LOG.debug("Provisioning task %s is already running" % task_id)
+            return
+
+        try:
+            task = models.ProvisioningTask.find_by(id=task_id, deleted=False)
+        except exception.ModelNotFoundError:
+            LOG.error("Provisioning task %s not found" % task_id)
+            return
+        if task['state'] in ('done', 'failed'):
+            return
+
+        self._active_tasks.add(task_id)
+        provisioner = None
+        try:
+            provisioner = provisioning.Provisioner(task)
+            provisioner.run()
+        except Exception, e:
+            LOG.exception("Provisioning task %s failed" % task_id)
+            self._record_failure(context, task_id, provisioner, e)
+        finally:
+            self._active_tasks.discard(task_id)
+
+    def _record_failure(self, context, task_id, provisioner, error):
+        task = models.ProvisioningTask.find_by(id=task_id)
+        attempts = (task['attempts'] or 0) + 1
+        max_attempts = int(CONFIG.get('provisioning_max_attempts', 5))
+        if attempts >= max_attempts or provisioner is None:
+            task.update(state='failed', attempts=attempts,
+                        last_error=str(error))
+            if provisioner is not None:
+                provisioner.fail(error)
+            return
+
+        task.update(state='pending', attempts=attempts, last_error=str(error))
+        delay = (int(CONFIG.get('provisioning_retry_seconds', 30)) *
+                 2 ** (attempts - 1))
+        LOG.info("Retrying provisioning task %s in %s seconds"
+                 % (task_id, delay))
+        self._retrying_tasks.add(task_id)
+        greenthread.spawn_after(delay, self.provision_instance, context,
+                                task_id)
+
+    def _resume_stale_provisioning(self):
+        """Pick up tasks nobody has touched for a while.
+
+        These were left behind by an API request that died before casting
+        them, or by a task manager that stopped part way through.
+        """
+        stale_seconds = int(CONFIG.get('provisioning_stale_seconds', 300))
+        cutoff = utils.utcnow() - datetime.timedelta(seconds=stale_seconds)
+        for state in ('pending', 'running'):
+            for task in models.ProvisioningTask.find_all(state=state,
+                                                         deleted=False):
+                if task['updated_at'] and task['updated_at'] > cutoff:
+                    continue
+                if (task['id'] in self._active_tasks or
+                        task['id'] in self._retrying_tasks):
+                    continue
+                LOG.info("Resuming provisioning task %s at step %s"
+                         % (task['id'], task['step']))
+                greenthread.spawn_n(self.provision_instance, None, task['id'])
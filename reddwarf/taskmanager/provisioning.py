@@ -0,0 +1,242 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Builds a database instance one persisted step at a time.
+
+The API writes the instance, guest status and provisioning task rows and
+hands the task to the task manager. Each step below checks what already
+exists before acting, so a step that failed half way, or whose process
+died, can simply be run again.
+"""
+
+import json
+import logging
+
+from reddwarf import db
+from reddwarf.common import config
+from reddwarf.common import context as rd_context
+from reddwarf.common import exception
+from reddwarf.common import utils
+from reddwarf.database import models
+from reddwarf.database import quota
+from reddwarf.database import worker_api
+from reddwarf.securitygroup import models as secgroup_models
+from reddwarf.securitygroup import service as secgroup_service
+
+CONFIG = config.Config
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SECGROUP_CIDR = "15.0.0.0/0"
+
+
+class Provisioner(object):
+
+    def __init__(self, task):
+        self.task = task
+        self.payload = json.loads(task['payload'] or '{}')
+        self.instance = models.DBInstance.find_by(id=task['instance_id'])
+        self.credential = models.Credential.find_by(
+            id=self.instance['credential'])
+        self.region = self.instance['availability_zone']
+        self.context = rd_context.ReddwarfContext(
+            user=self.instance['user_id'], tenant=self.instance['tenant_id'])
+
+    def run(self):
+        """Run the remaining steps in order, recording each one."""
+        steps = models.ProvisioningTask.STEPS
+        for step in steps[steps.index(self.task['step']):]:
+            LOG.debug("Provisioning instance %s: step %s"
+                      % (self.instance['id'], step))
+            self.task = self.task.update(step=step, state='running')
+            getattr(self, '_provision_%s' % step)()
+
+        # The boot userdata carries the initial password; drop it.
+        self.payload.pop('userdata', None)
+        self.task = self.task.update(step='done', state='done',
+                                     payload=json.dumps(self.payload))
+        LOG.info("Provisioned instance %s" % self.instance['id'])
+
+    def _save_payload(self):
+        # Reloaded so the state the task manager recorded is kept.
+        task = models.ProvisioningTask.find_by(id=self.task['id'])
+        self.task = task.update(payload=json.dumps(self.payload))
+
+    def _security_group(self):
+        association = secgroup_models.SecurityGroupInstances.get_by(
+            instance_id=self.instance['id'], deleted=False)
+        if association is None:
+            return None
+        return secgroup_models.SecurityGroup.find_by(
+            id=association['security_group_id'], deleted=False)
+
+    def _provision_security_group(self):
+        secgroup = self._security_group()
+        if secgroup is None:
+            secgroup = secgroup_service.SecurityGroupController()\
+                ._try_create_secgroup(self.context, self.credential,
+                                      self.region,
+                                      "default_" + self.instance['name'],
+                                      "Default DBaaS Security Group")
+            secgroup_models.SecurityGroupInstances.create(
+                security_group_id=secgroup['id'],
+                instance_id=self.instance['id'])
+
+        rule = secgroup_models.SecurityGroupRule.get_by(
+            security_group_id=secgroup['id'], deleted=False)
+        if rule is None:
+            port = int(self.instance['port'] or 3306)
+            secgroup_service.SecurityGroupRuleController()\
+                ._try_create_secgroup_rule(self.context, self.credential,
+                                           self.region, secgroup, port, port,
+                                           DEFAULT_SECGROUP_CIDR)
+
+    def _provision_server(self):
+        if self.instance['remote_uuid']:
+            return
+
+        # The Nova server is named after the instance id, so a server
+        # created by an attempt that died before saving it is found again.
+        server = models.Instance.find_by_name(self.credential, self.region,
+                                              self.instance['id'])
+        if server is None:
+            security_groups = ['dbaas-instance',
+                               self._security_group()['remote_secgroup_name']]
+            server = models.Instance.create(
+                self.credential, self.region, self.payload,
+                self.payload['image_id'], self.payload['flavor_id'],
+                security_groups=security_groups,
+                key_name=self.payload['keypair_name'],
+                userdata=self.payload['userdata'],
+                files=None,
+                name=self.instance['id'])
+        server = server.data()
+        with db.unit_of_work():
+            self.instance = self.instance.update(
+                remote_id=server['id'],
+                remote_uuid=server['uuid'],
+                remote_hostname=server['name'])
+            models.GuestStatus.find_by(instance_id=self.instance['id'],
+                                       deleted=False).update(state='building')
+
+    def _provision_floating_ip(self):
+        if self.instance['address']:
+            return
+
+        server_id = self.instance['remote_id']
+        floating_ip = models.FloatingIP.find_by_server(self.credential,
+                                                       self.region, server_id)
+        if floating_ip is None:
+            floating_ip = self._allocated_floating_ip()
+            if floating_ip is None:
+                floating_ip = models.FloatingIP.create(self.credential,
+                                                       self.region)
+                # Recorded before assigning, so a retry reuses the address
+                # and fail() can give it back.
+                self.payload['floating_ip_id'] = floating_ip.data()['id']
+                self._save_payload()
+            models.FloatingIP.assign(self.credential, self.region,
+                                     floating_ip.data(), server_id)
+        self.instance = self.instance.update(
+            address=floating_ip.data()['ip'])
+
+    def _release_floating_ip(self, floating_ip_id):
+        """Unassign the floating ip we allocated and give it back."""
+        floating_ip = models.FloatingIP.find(self.credential, self.region,
+                                             floating_ip_id)
+        if floating_ip is None:
+            return
+        if floating_ip.data()['instance_id']:
+            models.FloatingIP.unassign(self.credential, self.region,
+                                       floating_ip.data(),
+                                       self.instance['remote_id'])
+        models.FloatingIP.release(self.credential, self.region,
+                                  floating_ip.data())
+
+    def _allocated_floating_ip(self):
+        """The unassigned floating ip an earlier attempt allocated, if any."""
+        floating_ip_id = self.payload.get('floating_ip_id')
+        if floating_ip_id is None:
+            return None
+        floating_ip = models.FloatingIP.find(self.credential, self.region,
+                                             floating_ip_id)
+        if floating_ip is None or floating_ip.data()['instance_id']:
+            return None
+        return floating_ip
+
+    def _provision_volume(self):
+        reservations = self.payload.get('volume_reservations', [])
+        volume_support = CONFIG.get('reddwarf_volume_support', 'False')
+        if not utils.bool_from_string(volume_support):
+            quota.rollback(self.context, reservations)
+            return
+
+        server_id = self.instance['remote_id']
+        db_volume = models.DBVolume.get_by(instance_id=self.instance['id'],
+                                           deleted=False)
+        if db_volume is None:
+            size = self.payload['volume_size']
+            volume = models.Volume.create(self.credential, self.region, size,
+                                          'mysql-%s' % server_id).data()
+            # Recorded straight away so a retry, or deleting the instance,
+            # finds the volume. The space reserved by the API is used now.
+            with db.unit_of_work():
+                db_volume = models.DBVolume.create(
+                    volume_id=volume['id'],
+                    size=size,
+                    availability_zone=self.region,
+                    instance_id=self.instance['id'],
+                    tenant_id=self.instance['tenant_id'])
+                quota.commit(self.context, reservations)
+        else:
+            volume = models.Volume(credential=self.credential,
+                                   region=self.region,
+                                   id=db_volume['volume_id']).data()
+
+        attached_to = [attachment.get('server_id')
+                       for attachment in volume['attachments'] or []]
+        if server_id not in attached_to:
+            device_name = CONFIG.get('volume_device_name', '/dev/vdc')
+            models.Volume.attach(self.credential, self.region, volume,
+                                 server_id, device_name)
+
+    def _provision_worker(self):
+        worker_api.API().ensure_create_instance(None, self.instance,
+                                                self.payload['userdata'])
+
+    def fail(self, error):
+        """Mark the instance as failed once retries are exhausted."""
+        LOG.error("Giving up provisioning instance %s: %s"
+                  % (self.instance['id'], error))
+        self.instance.update(status='error')
+        quota.rollback(self.context,
+                       self.payload.get('volume_reservations', []))
+        try:
+            models.GuestStatus.find_by(instance_id=self.instance['id'],
+                                       deleted=False).update(state='failed')
+        except exception.ModelNotFoundError:
+            pass
+
+        floating_ip_id = self.payload.pop('floating_ip_id', None)
+        if floating_ip_id is not None:
+            try:
+                self._release_floating_ip(floating_ip_id)
+            except exception.ReddwarfError:
+                LOG.exception("Could not release floating ip %s"
+                              % floating_ip_id)
+        # The boot userdata carries the initial password; drop it.
+        self.payload.pop('userdata', None)
+        self._save_payload()
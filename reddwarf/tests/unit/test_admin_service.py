@@ -0,0 +1,59 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.database import models
+from reddwarf.tests import unit
+
+LOG = logging.getLogger(__name__)
+
+
+class TestAdminController(tests.BaseTest):
+
+    def setUp(self):
+        super(TestAdminController, self).setUp()
+        conf, reddwarf_app = config.Config.load_paste_app('reddwarf',
+                {"config_file": tests.test_config_file()}, None)
+        self.app = unit.TestApp(reddwarf_app)
+        self.tenant = '123'
+        self.path = "/v1.0/" + self.tenant + "/mgmt/service-config/invalidate"
+
+    def _headers(self, role):
+        return {'X-Auth-Token': 'abc:123',
+                'X-Role': role,
+                'X-User-Id': '999',
+                'X-Tenant-Id': self.tenant}
+
+    def test_invalidate_service_config(self):
+        version = models.service_config_cache.version
+        response = self.app.post(self.path,
+                                 headers=self._headers('mysql-admin'))
+
+        self.assertEqual(response.status_int, 202)
+        self.assertTrue(models.service_config_cache.version > version)
+
+    def test_invalidate_service_config_requires_admin(self):
+        version = models.service_config_cache.version
+        response = self.app.post(self.path,
+                                 headers=self._headers('mysql-user'),
+                                 expect_errors=True)
+
+        self.assertEqual(response.status_int, 401)
+        self.assertEqual(models.service_config_cache.version, version)
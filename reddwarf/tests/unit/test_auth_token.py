@@ -0,0 +1,177 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import logging
+import time
+import unittest
+
+import mox
+
+from reddwarf.common import auth_token
+from reddwarf.common import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status):
+        self.status = status
+
+
+def keystone_access(expires=None):
+    if expires is None:
+        expires = utils.utcnow() + datetime.timedelta(hours=1)
+    return {'access': {
+        'user': {'id': 'user-id', 'name': 'user-name',
+                 'roles': [{'name': 'Member'}, {'name': 'admin'}]},
+        'token': {'id': 'token', 'expires': utils.isotime(expires),
+                  'tenant': {'id': 'tenant-id', 'name': 'tenant-name'}}}}
+
+
+class TestTokenBasedAuth(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mox.Mox()
+        self.app = lambda env, start_response: env
+        self.auth = auth_token.TokenBasedAuth(self.app,
+                                              {'auth_protocol': 'http',
+                                               'retry_limit': 0})
+
+    def tearDown(self):
+        self.mock.UnsetStubs()
+
+    def _env(self, token='token'):
+        return {'REQUEST_METHOD': 'GET',
+                'HTTP_X_AUTH_TOKEN': token,
+                'HTTP_X_AUTH_PROJECT_ID': 'tenant-name'}
+
+    def test_identity_is_stored_in_environ(self):
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        self.auth._json_request('POST', '/v2.0/tokens', body=mox.IgnoreArg())\
+            .AndReturn((FakeResponse(200), keystone_access()))
+        self.mock.ReplayAll()
+
+        env = self.auth(self._env(), None)
+
+        self.mock.VerifyAll()
+        identity = env[auth_token.IDENTITY_ENV_KEY]
+        self.assertEqual(identity['user_id'], 'user-id')
+        self.assertEqual(identity['tenant_id'], 'tenant-id')
+        self.assertEqual(env['HTTP_X_ROLES'], 'Member,admin')
+        self.assertFalse(hasattr(self.auth, 'user_id'))
+
+    def test_validated_token_is_cached(self):
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        self.auth._json_request('POST', '/v2.0/tokens', body=mox.IgnoreArg())\
+            .AndReturn((FakeResponse(200), keystone_access()))
+        self.mock.ReplayAll()
+
+        self.auth(self._env(), None)
+        env = self.auth(self._env(), None)
+
+        self.mock.VerifyAll()
+        self.assertEqual(env['HTTP_X_USER_ID'], 'user-id')
+
+    def test_expired_token_is_not_cached(self):
+        expired = utils.utcnow() - datetime.timedelta(minutes=1)
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        self.auth._json_request('POST', '/v2.0/tokens', body=mox.IgnoreArg())\
+            .MultipleTimes().AndReturn((FakeResponse(200),
+                                        keystone_access(expired)))
+        self.mock.ReplayAll()
+
+        self.auth(self._env(), None)
+        self.auth(self._env(), None)
+
+        self.mock.VerifyAll()
+        self.assertEqual(self.auth.token_cache.get('token', 'tenant-name'),
+                         None)
+
+    def test_rejected_token_is_negatively_cached(self):
+        start_response = lambda status, headers: None
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        self.auth._json_request('POST', '/v2.0/tokens', body=mox.IgnoreArg())\
+            .AndReturn((FakeResponse(401), {}))
+        self.mock.ReplayAll()
+
+        self.auth(self._env('bad'), start_response)
+        self.auth(self._env('bad'), start_response)
+
+        self.mock.VerifyAll()
+        self.assertEqual(self.auth.token_cache.get('bad', 'tenant-name'),
+                         auth_token.TokenCache.INVALID)
+
+    def test_retries_use_green_sleep_per_request(self):
+        self.auth.retry_limit = 1
+        self.mock.StubOutWithMock(auth_token.greenthread, 'sleep')
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        for token in ['first', 'second']:
+            self.auth._json_request('POST', '/v2.0/tokens',
+                                    body=mox.IgnoreArg())\
+                .AndReturn((FakeResponse(500), {}))
+            auth_token.greenthread.sleep(mox.IsA(float))
+            self.auth._json_request('POST', '/v2.0/tokens',
+                                    body=mox.IgnoreArg())\
+                .AndReturn((FakeResponse(200), keystone_access()))
+        self.mock.ReplayAll()
+
+        self.auth(self._env('first'), None)
+        env = self.auth(self._env('second'), None)
+
+        self.mock.VerifyAll()
+        self.assertEqual(env['HTTP_X_USER_ID'], 'user-id')
+
+    def test_open_circuit_fails_fast_with_503(self):
+        statuses = []
+        start_response = lambda status, headers: statuses.append(status)
+        self.auth.circuit = auth_token.CircuitBreaker(failure_threshold=1,
+                                                      reset_seconds=60)
+        self.mock.StubOutWithMock(self.auth, '_json_request')
+        self.auth._json_request('POST', '/v2.0/tokens', body=mox.IgnoreArg())\
+            .AndRaise(auth_token.ServiceError("connection refused", None))
+        self.mock.ReplayAll()
+
+        self.auth(self._env('first'), start_response)
+        self.auth(self._env('second'), start_response)
+
+        self.mock.VerifyAll()
+        self.assertTrue(self.auth.circuit.is_open)
+        self.assertEqual([s[:3] for s in statuses], ['503', '503'])
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        circuit = auth_token.CircuitBreaker(failure_threshold=2,
+                                            reset_seconds=60)
+        circuit.record_failure()
+        self.assertTrue(circuit.allow())
+        circuit.record_failure()
+        self.assertFalse(circuit.allow())
+
+    def test_half_open_lets_one_trial_through(self):
+        circuit = auth_token.CircuitBreaker(failure_threshold=1,
+                                            reset_seconds=0.01)
+        circuit.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(circuit.allow())
+        self.assertFalse(circuit.allow())
+        circuit.record_success()
+        self.assertFalse(circuit.is_open)
+        self.assertTrue(circuit.allow())
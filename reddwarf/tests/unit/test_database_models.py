@@ -19,12 +19,17 @@
 
 import mox
 import novaclient.v1_1
+import time
 
+from eventlet import greenthread
+
+from reddwarf import db
 from reddwarf import tests
 from reddwarf.common import exception
 from reddwarf.common import utils
 from reddwarf.database import models
 from reddwarf.db import db_query
+from reddwarf.securitygroup import models as secgroup_models
 from reddwarf.tests import unit
 from reddwarf.tests.factories import models as factory_models
 
@@ -135,6 +140,41 @@ class TestDBInstance(tests.BaseTest):
         data = instance.update(**kwargs).data()
         self.assertEqual(data['name'], "changed")
     
+    def test_save_does_not_read_back(self):
+        self.mock.StubOutWithMock(models.DBInstance, 'find_by')
+        self.mock.ReplayAll()
+
+        instance = models.DBInstance.create(name="dbapi_test",
+                                            availability_zone="az1")
+        self.assertNotEqual(instance['created_at'], None)
+        self.assertNotEqual(instance['updated_at'], None)
+        self.assertEqual(instance['name'], "dbapi_test")
+
+    def test_unit_of_work_commits_together(self):
+        with db.unit_of_work():
+            instance = models.DBInstance.create(name="uow_test",
+                                                availability_zone="az1")
+            models.GuestStatus.create(instance_id=instance['id'],
+                                      state='building')
+
+        self.assertEqual(models.DBInstance.find_by(id=instance['id'])['name'],
+                         "uow_test")
+        self.assertEqual(models.GuestStatus.find_by(
+                             instance_id=instance['id'])['state'], 'building')
+
+    def test_unit_of_work_rolls_back(self):
+        ids = []
+        try:
+            with db.unit_of_work():
+                instance = models.DBInstance.create(name="uow_test",
+                                                    availability_zone="az1")
+                ids.append(instance['id'])
+                raise exception.ReddwarfError("boom")
+        except exception.ReddwarfError:
+            pass
+
+        self.assertEqual(models.DBInstance.get_by(id=ids[0]), None)
+
     def test_retrieve_instance(self):
         name = utils.generate_uuid()
         kwargs = {"name": name,
@@ -146,7 +186,170 @@ class TestDBInstance(tests.BaseTest):
         found_instance = instance.find_by(name=name)
         data = found_instance.data()
         self.assertEqual(data['name'], name)
+
+    def test_instance_summaries_join_status_and_flavor(self):
+        tenant_id = utils.generate_uuid()
+        # instances.flavor is the integer id of the service flavor row.
+        models.ServiceFlavor(id="900", service_name="database",
+                             flavor_name="summary_test", flavor_id="9900",
+                             deleted=False).save()
+        instances = []
+        for i in range(3):
+            instance = factory_models.DBInstance().create(
+                name="summary_%s" % i, tenant_id=tenant_id, flavor=900,
+                availability_zone="az1")
+            models.GuestStatus().create(instance_id=instance['id'],
+                                        state="running")
+            instances.append(instance)
+        instances[2].delete()
+
+        query = db_query.find_instance_summaries(models.DBInstance,
+                                                 tenant_id=tenant_id,
+                                                 deleted=False)
+        page, marker = query.paginated_collection(limit=1)
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page[0].state, "running")
+        self.assertEqual(page[0].flavor_id, "9900")
+        self.assertEqual(marker, page[0].id)
+
+        rest, marker = query.paginated_collection(limit=1, marker=marker)
+        self.assertEqual(len(rest), 1)
+        self.assertEqual(marker, None)
+        self.assertEqual(sorted([page[0].name, rest[0].name]),
+                         ["summary_0", "summary_1"])
+
+    def test_instance_summaries_skip_deleted_flavor(self):
+        tenant_id = utils.generate_uuid()
+        models.ServiceFlavor(id="902", service_name="database",
+                             flavor_name="deleted_test", flavor_id="9902",
+                             deleted=True).save()
+        factory_models.DBInstance().create(
+            name="summary_deleted_flavor", tenant_id=tenant_id, flavor=902,
+            availability_zone="az1")
+
+        rows = db_query.find_instance_summaries(models.DBInstance,
+                                                tenant_id=tenant_id,
+                                                deleted=False).all()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].flavor_id, None)
+
+    def test_find_detail_by(self):
+        models.ServiceFlavor(id="901", service_name="database",
+                             flavor_name="detail_test", flavor_id="9901",
+                             deleted=False).save()
+        instance = factory_models.DBInstance().create(
+            name="detail_test", flavor=901, availability_zone="az1")
+        models.GuestStatus().create(instance_id=instance['id'],
+                                    state="building")
+        for name in ["first", "second"]:
+            group = secgroup_models.SecurityGroup().create(name=name)
+            secgroup_models.SecurityGroupInstances().create(
+                instance_id=instance['id'], security_group_id=group['id'])
+
+        detail = models.DBInstance.find_detail_by(id=instance['id'],
+                                                  deleted=False)
+
+        self.assertEqual(detail['name'], "detail_test")
+        self.assertEqual(detail.guest_status['state'], "building")
+        self.assertEqual(detail.flavor_id, "9901")
+        self.assertEqual(len(detail.security_groups), 2)
+
+    def test_find_detail_by_not_found(self):
+        self.assertRaises(exception.ModelNotFoundError,
+                          models.DBInstance.find_detail_by,
+                          id=utils.generate_uuid(), deleted=False)
     
+class TestRemoteWaits(tests.BaseTest):
+
+    class FakeResource(object):
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    def setUp(self):
+        super(TestRemoteWaits, self).setUp()
+        self.client = self.mock.CreateMock(novaclient.v1_1.Client)
+        self.client.servers = self.mock.CreateMock(novaclient.v1_1.servers.ServerManager)
+        self.client.volumes = self.mock.CreateMock(novaclient.v1_1.volumes.VolumeManager)
+        self.mock.StubOutWithMock(models.RemoteModelBase, 'get_client')
+        models.RemoteModelBase.get_client(mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(self.client)
+        self.mock.StubOutWithMock(greenthread, 'sleep')
+
+    def test_floating_ip_is_added_once(self):
+        building = self.FakeResource(status='BUILD', addresses={})
+        networked = self.FakeResource(status='BUILD', addresses={'private': [{'addr': '10.0.0.4'}]})
+        self.client.servers.get('server').AndReturn(building)
+        greenthread.sleep(mox.IgnoreArg())
+        self.client.servers.get('server').AndReturn(networked)
+        self.client.servers.add_floating_ip('server', '15.1.1.1')
+        self.mock.ReplayAll()
+
+        models.FloatingIP.assign({'id': '1'}, 'az2', {'ip': '15.1.1.1'}, 'server')
+
+    def test_volume_is_attached_once(self):
+        active = self.FakeResource(status='ACTIVE')
+        self.client.servers.get('server').AndReturn(active)
+        self.client.volumes.get('vol').AndReturn(self.FakeResource(status='creating'))
+        greenthread.sleep(mox.IgnoreArg())
+        self.client.servers.get('server').AndReturn(active)
+        self.client.volumes.get('vol').AndReturn(self.FakeResource(status='available'))
+        self.client.volumes.create_server_volume('server', 'vol', '/dev/vdc')
+        self.mock.ReplayAll()
+
+        models.Volume.attach({'id': '1'}, 'az2', {'id': 'vol'}, 'server', '/dev/vdc')
+
+    def test_volume_attach_fails_fast_on_error(self):
+        self.client.servers.get('server').AndReturn(self.FakeResource(status='ERROR'))
+        self.client.volumes.get('vol').AndReturn(self.FakeResource(status='available'))
+        self.mock.ReplayAll()
+
+        self.assertRaises(exception.VolumeAttachmentFailure, models.Volume.attach,
+                          {'id': '1'}, 'az2', {'id': 'vol'}, 'server', '/dev/vdc')
+
+class TestServiceConfigCache(tests.BaseTest):
+
+    def setUp(self):
+        super(TestServiceConfigCache, self).setUp()
+        self.cache = models.ServiceConfigCache()
+        models.ServiceZone.create(service_name='database', tenant_id='t1',
+                                  availability_zone='az1')
+        models.ServiceImage.create(service_name='database', tenant_id='t1',
+                                   availability_zone='az1', image_id='1240')
+        models.ServiceFlavor(id="901", service_name='database',
+                             flavor_name='small', flavor_id='104',
+                             ram=2048, vcpus=1, deleted=False).save()
+        models.ServiceKeypair.create(service_name='database', key_name='dbas')
+        models.Credential.create(user_name='proxy', password='secret',
+                                 tenant_id='t1', type='compute', enabled=True)
+
+    def test_lookups(self):
+        self.assertEqual(self.cache.find_zone('database', 't1')['availability_zone'], 'az1')
+        self.assertEqual(self.cache.find_image('database', 't1', 'az1')['image_id'], '1240')
+        self.assertEqual(self.cache.find_flavor('database', 104)['id'], '901')
+        self.assertEqual(self.cache.find_keypair('database')['key_name'], 'dbas')
+        self.assertEqual(self.cache.find_credential('compute')['user_name'], 'proxy')
+        self.assertRaises(exception.ModelNotFoundError,
+                          self.cache.find_zone, 'database', 'missing')
+
+    def test_lookups_do_not_query_until_invalidated(self):
+        self.cache.find_zone('database', 't1')
+        version = self.cache.version
+        models.ServiceZone.create(service_name='database', tenant_id='t2',
+                                  availability_zone='az2')
+
+        self.assertRaises(exception.ModelNotFoundError,
+                          self.cache.find_zone, 'database', 't2')
+        self.cache.invalidate()
+        self.assertEqual(self.cache.find_zone('database', 't2')['availability_zone'], 'az2')
+        self.assertTrue(self.cache.version > version)
+
+    def test_expired_snapshot_is_reloaded(self):
+        self.cache.find_keypair('database')
+        self.cache._snapshot.loaded_at -= self.cache.ttl
+        version = self.cache.version
+
+        self.cache.find_keypair('database')
+        self.assertEqual(self.cache.version, version + 1)
+
 class TestSnapshotInstance(tests.BaseTest):
     
     def setUp(self):
@@ -193,3 +396,81 @@ class TestSnapshotInstance(tests.BaseTest):
         found_snapshot = snapshot.find_by(name=name)
         data = found_snapshot.data()
         self.assertEqual(data['name'], name)
+
+
+class FakeHTTPClient(object):
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.auth_token = None
+        self.management_url = None
+
+    def authenticate(self):
+        self.counter['authenticate'] += 1
+        self.auth_token = 'token-%d' % self.counter['authenticate']
+        self.management_url = 'http://nova/v1.1/tenant'
+
+
+class FakeNovaClient(object):
+
+    def __init__(self, counter):
+        self.client = FakeHTTPClient(counter)
+
+    def authenticate(self):
+        self.client.authenticate()
+
+
+class TestNovaClientCache(tests.BaseTest):
+
+    CREDENTIAL = {'user_name': 'proxy', 'password': 'secret',
+                  'tenant_id': 'tenant'}
+
+    def setUp(self):
+        super(TestNovaClientCache, self).setUp()
+        self.counter = {'authenticate': 0}
+        self.cache = models.NovaClientCache()
+
+    def _factory(self):
+        return FakeNovaClient(self.counter)
+
+    def test_token_is_shared(self):
+        first = self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        second = self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+
+        self.assertEqual(self.counter['authenticate'], 1)
+        self.assertEqual(first.client.auth_token, 'token-1')
+        self.assertEqual(second.client.auth_token, 'token-1')
+        self.assertFalse(first is second)
+
+    def test_regions_are_cached_separately(self):
+        self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        self.cache.get(self.CREDENTIAL, 'az2', self._factory)
+
+        self.assertEqual(self.counter['authenticate'], 2)
+
+    def test_token_refreshed_before_expiry(self):
+        self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        for entry in self.cache._entries.values():
+            entry.expires_at = time.time() + 10
+
+        client = self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+
+        self.assertEqual(self.counter['authenticate'], 2)
+        self.assertEqual(client.client.auth_token, 'token-2')
+
+    def test_idle_entries_evicted(self):
+        self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        for entry in self.cache._entries.values():
+            entry.last_used = time.time() - self.cache.idle_timeout - 1
+
+        self.cache.get(self.CREDENTIAL, 'az2', self._factory)
+
+        self.assertEqual(len(self.cache._entries), 1)
+
+    def test_reauthentication_updates_cache(self):
+        client = self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        # what novaclient does when a request comes back with a 401
+        client.client.authenticate()
+
+        later = self.cache.get(self.CREDENTIAL, 'az1', self._factory)
+        self.assertEqual(later.client.auth_token, 'token-2')
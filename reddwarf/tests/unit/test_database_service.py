@@ -21,15 +21,19 @@ import mox
 import logging
 import json
 import novaclient.v1_1
+from sqlalchemy.util import NamedTuple
 
 from reddwarf import tests
 from reddwarf import db
 from reddwarf.common import config
+from reddwarf.common import exception
 from reddwarf.common import utils
 from reddwarf.common import wsgi
 from reddwarf.database import models
+from reddwarf.database import quota
 from reddwarf.database import service
 from reddwarf.database import views
+from reddwarf.database import taskmanager_api
 from reddwarf.database import worker_api
 from reddwarf.database import guest_api
 from reddwarf.securitygroup import models as secgroup_models
@@ -49,6 +53,7 @@ class ControllerTestBase(tests.BaseTest):
         conf, reddwarf_app = config.Config.load_paste_app('reddwarf',
                 {"config_file": tests.test_config_file()}, None)
         self.app = unit.TestApp(reddwarf_app)
+        quota.invalidate_limits()
 
 class DummyQueryResult():
             
@@ -108,24 +113,10 @@ class TestInstanceController(ControllerTestBase):
 
     def test_show(self):
         id = self.DUMMY_INSTANCE_ID
-        flavor = self.DUMMY_INSTANCE['flavor']
-        self.mock.StubOutWithMock(models.DBInstance, 'find_by')
-        models.DBInstance.find_by(deleted=False,id=id,tenant_id=self.tenant).AndReturn(self.DUMMY_INSTANCE)
-#        self.mock.StubOutWithMock(models.DBInstance, '__init__')
-#        models.Instance.__init__(context=mox.IgnoreArg(), uuid=mox.IgnoreArg())
+        detail = models.InstanceDetail(self.DUMMY_INSTANCE, 'running', '104', ['234'])
+        self.mock.StubOutWithMock(models.DBInstance, 'find_detail_by')
+        models.DBInstance.find_detail_by(deleted=False,id=id,tenant_id=self.tenant).AndReturn(detail)
 
-        self.mock.StubOutWithMock(models.GuestStatus, 'find_by')
-        models.GuestStatus.find_by(deleted=False,instance_id=id).AndReturn({'instance_id': id, 'state': 'running'})
-
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_by')
-        models.ServiceFlavor.find_by(deleted=False, id=flavor).AndReturn({'id': '4', 'flavor_id': '104'})
-
-        self.mock.StubOutWithMock(secgroup_models.SecurityGroupInstances, 'find_by')
-        secgroup_models.SecurityGroupInstances.find_by(instance_id=id, deleted=False).AndReturn({'security_group_id': '123'})
-        
-        self.mock.StubOutWithMock(secgroup_models.SecurityGroup, 'find_by')
-        secgroup_models.SecurityGroup.find_by(id='123', deleted=False).AndReturn({'id': '234'})
-        
         self.mock.ReplayAll()
 
         response = self.app.get("%s/%s" % (self.instances_path,
@@ -134,22 +125,38 @@ class TestInstanceController(ControllerTestBase):
 
 
         self.assertEqual(response.status_int, 200)
+        instance = response.json['instance']
+        self.assertEqual(instance['status'], 'running')
+        self.assertEqual(instance['flavor']['id'], '104')
+        self.assertEqual(instance['security_groups'][0]['id'], '234')
+        self.mock.UnsetStubs()
+
+    def test_show_without_guest_status(self):
+        id = self.DUMMY_INSTANCE_ID
+        detail = models.InstanceDetail(self.DUMMY_INSTANCE, None, '104', [])
+        self.mock.StubOutWithMock(models.DBInstance, 'find_detail_by')
+        models.DBInstance.find_detail_by(deleted=False,id=id,tenant_id=self.tenant).AndReturn(detail)
+
+        self.mock.ReplayAll()
+
+        response = self.app.get("%s/%s" % (self.instances_path,
+                                           self.DUMMY_INSTANCE_ID),
+                                           headers=self.headers,
+                                           expect_errors=True)
+
+        self.assertEqual(response.status_int, 404)
         self.mock.UnsetStubs()
 
+    def _summary_row(self, id=DUMMY_INSTANCE_ID):
+        return NamedTuple([id, "DUMMY_NAME", "createtime", "running", "104"],
+                          ["id", "name", "created_at", "state", "flavor_id"])
+
     def test_index(self):
-        flavor = self.DUMMY_INSTANCE['flavor']
-        self.mock.StubOutWithMock(models.DBInstance, 'find_all')
-        models.DBInstance.find_all(tenant_id=self.tenant, deleted=False).AndReturn([self.DUMMY_INSTANCE])
-
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_all')
-        models.ServiceFlavor.find_all().AndReturn([{'id': '1', 'flavor_id': '101'},
-                                                  {'id': '2', 'flavor_id': '102'},
-                                                  {'id': '3', 'flavor_id': '103'},
-                                                  {'id': '4', 'flavor_id': '104'},
-                                                  {'id': '5', 'flavor_id': '105'}])
-        
-        self.mock.StubOutWithMock(api, 'find_guest_statuses_for_instances')
-        api.find_guest_statuses_for_instances([self.DUMMY_INSTANCE_ID]).AndReturn([self.DUMMY_GUEST_STATUS])
+        self.mock.StubOutWithMock(api, 'find_all_by_limit')
+        api.find_all_by_limit(api.find_instance_summaries, models.DBInstance,
+                              {'tenant_id': self.tenant, 'deleted': False},
+                              limit=201, marker=None, marker_column=None)\
+            .AndReturn([self._summary_row()])
         
         self.mock.ReplayAll()
         
@@ -157,8 +164,39 @@ class TestInstanceController(ControllerTestBase):
                                         headers=self.headers)
         
         self.assertEqual(response.status_int, 200)
+        instances = response.json['instances']
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(instances[0]['status'], 'running')
+        self.assertEqual(instances[0]['flavor']['id'], '104')
+        self.assertFalse('links' in response.json)
         self.mock.UnsetStubs()
 
+    def test_index_paginated(self):
+        second_id = "22345678-1234-1234-1234-123456789abc"
+        self.mock.StubOutWithMock(api, 'find_all_by_limit')
+        api.find_all_by_limit(api.find_instance_summaries, models.DBInstance,
+                              {'tenant_id': self.tenant, 'deleted': False},
+                              limit=2, marker=None, marker_column=None)\
+            .AndReturn([self._summary_row(), self._summary_row(second_id)])
+
+        self.mock.ReplayAll()
+
+        response = self.app.get("%s?limit=1" % (self.instances_path),
+                                        headers=self.headers)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(len(response.json['instances']), 1)
+        next_link = response.json['links'][0]
+        self.assertEqual(next_link['rel'], 'next')
+        self.assertTrue("marker=%s" % self.DUMMY_INSTANCE_ID in next_link['href'])
+        self.mock.UnsetStubs()
+
+    def test_index_invalid_limit(self):
+        response = self.app.get("%s?limit=abc" % (self.instances_path),
+                                headers=self.headers, expect_errors=True)
+
+        self.assertEqual(response.status_int, 400)
+
     def mock_out_client_create(self):
         """Stubs out a fake server returned from novaclient.
            This is akin to calling Client.servers.get(uuid)
@@ -221,18 +259,18 @@ class TestInstanceController(ControllerTestBase):
         
         self.mock.StubOutWithMock(models.Quota, 'find_all')
         models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
-        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
 
-        self.mock.StubOutWithMock(models.ServiceZone, 'find_by')
-        models.ServiceZone.find_by(service_name="database", tenant_id='123', deleted=False).AndReturn(self.ServiceZone)  
-        self.mock.StubOutWithMock(models.ServiceImage, 'find_by')
-        models.ServiceImage.find_by(service_name="database", tenant_id='123', availability_zone=self.ServiceZone["availability_zone"], deleted=False).AndReturn(self.ServiceImage)
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_by')
-        models.ServiceFlavor.find_by(service_name="database", flavor_id='104', deleted=False).AndReturn(self.ServiceFlavor)
-        self.mock.StubOutWithMock(models.ServiceKeypair, 'find_by')
-        models.ServiceKeypair.find_by(service_name="database", deleted=False).AndReturn(self.ServiceKeypair)  
-        self.mock.StubOutWithMock(models.Credential, 'find_by')
-        models.Credential.find_by(type="compute", deleted=False).AndReturn(self.Credential)                
+        cache = models.service_config_cache
+        self.mock.StubOutWithMock(cache, 'find_zone')
+        cache.find_zone("database", '123').AndReturn(self.ServiceZone)
+        self.mock.StubOutWithMock(cache, 'find_image')
+        cache.find_image("database", '123', self.ServiceZone["availability_zone"]).AndReturn(self.ServiceImage)
+        self.mock.StubOutWithMock(cache, 'find_flavor')
+        cache.find_flavor("database", '104').AndReturn(self.ServiceFlavor)
+        self.mock.StubOutWithMock(cache, 'find_keypair')
+        cache.find_keypair("database").AndReturn(self.ServiceKeypair)
+        self.mock.StubOutWithMock(cache, 'find_credential')
+        cache.find_credential("compute").AndReturn(self.Credential)
         
         mock_server = self.mock.CreateMock(models.Instance(server="server", uuid=utils.generate_uuid()))
         #mock_dbinstance = self.mock.CreateMock(models.DBInstance())
@@ -250,7 +288,7 @@ class TestInstanceController(ControllerTestBase):
         
         service.InstanceController._try_create_server(mox.IgnoreArg(), mox.IgnoreArg(),
                             mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), 
-                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn((self.DUMMY_SERVER, self.DUMMY_GUEST_STATUS, {'/home/nova/agent.config':'blah'}))
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn((self.DUMMY_SERVER, self.DUMMY_GUEST_STATUS, {'/home/nova/agent.config':'blah'}))
 
         self.mock.StubOutWithMock(service.InstanceController, '_try_assign_floating_ip')
         service.InstanceController._try_assign_floating_ip(mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(self.DUMMY_FLOATING_IP)
@@ -258,7 +296,7 @@ class TestInstanceController(ControllerTestBase):
         self.mock.StubOutWithMock(service.InstanceController, '_try_attach_volume')
         
         service.InstanceController._try_attach_volume(mox.IgnoreArg(),
-                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(None)
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(None)
         
         #volume = models.Volume.create(credential, region, volume_size, 'mysql-%s' % instance['remote_id']).data()
         
@@ -274,6 +312,139 @@ class TestInstanceController(ControllerTestBase):
         self.assertEqual(response.status_int, 201)
         self.mock.UnsetStubs()
 
+    def test_create_rolls_back_volume_when_floating_ip_fails(self):
+        body = {
+            "instance": {
+                "name": "json_rack_instance",
+                "flavorRef": "104"
+            }
+        }
+        default_quotas = [{ "tenant_id": self.tenant, "hard_limit": 3, "resource":"instances"},
+                          { "tenant_id": self.tenant, "hard_limit": 10, "resource":"snapshots"},
+                          { "tenant_id": self.tenant, "hard_limit": 20, "resource":"volume_space"}]
+        db_volume = {'volume_id': 'vol-1'}
+
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
+        self.mock.StubOutWithMock(service.InstanceController, '_load_boot_params')
+        service.InstanceController._load_boot_params('123', '104').AndReturn(
+            ("1240", {"id": "1", "flavor_id": "100"}, "dbas-dev", "az2", {'id': '1'}))
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_security_group')
+        service.InstanceController._try_create_security_group(mox.IgnoreArg(), mox.IgnoreArg(),
+                                                              mox.IgnoreArg(), mox.IgnoreArg()).AndReturn({'security_group': {'id': '123'}})
+        self.mock.StubOutWithMock(secgroup_models.SecurityGroup, 'find_by')
+        secgroup_models.SecurityGroup.find_by(id='123', deleted=False).AndReturn({'id': '123', 'remote_secgroup_name': 'test'})
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_server')
+        service.InstanceController._try_create_server(mox.IgnoreArg(), mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn((self.DUMMY_SERVER, self.DUMMY_GUEST_STATUS, {}))
+
+        self.mock.StubOutWithMock(service.InstanceController, '_try_assign_floating_ip')
+        service.InstanceController._try_assign_floating_ip(mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndRaise(
+            exception.ReddwarfError("no floating ips"))
+        self.mock.StubOutWithMock(service.InstanceController, '_try_attach_volume')
+        service.InstanceController._try_attach_volume(mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(db_volume)
+        self.mock.StubOutWithMock(service.InstanceController, '_detach_volume')
+        service.InstanceController._detach_volume({'id': '1'}, "az2", db_volume, self.DUMMY_SERVER)
+        self.mock.StubOutWithMock(worker_api.API, 'ensure_create_instance')
+
+        self.mock.ReplayAll()
+
+        response = self.app.post_json("%s" % (self.instances_path), body=body,
+                                      headers=self.headers, expect_errors=True)
+        self.assertEqual(response.status_int, 500)
+
+    def test_create_releases_floating_ip_when_volume_fails(self):
+        body = {
+            "instance": {
+                "name": "json_rack_instance",
+                "flavorRef": "104"
+            }
+        }
+        default_quotas = [{ "tenant_id": self.tenant, "hard_limit": 3, "resource":"instances"},
+                          { "tenant_id": self.tenant, "hard_limit": 10, "resource":"snapshots"},
+                          { "tenant_id": self.tenant, "hard_limit": 20, "resource":"volume_space"}]
+        floating_ip = {'id': '7', 'ip': '15.1.1.7'}
+
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
+        self.mock.StubOutWithMock(service.InstanceController, '_load_boot_params')
+        service.InstanceController._load_boot_params('123', '104').AndReturn(
+            ("1240", {"id": "1", "flavor_id": "100"}, "dbas-dev", "az2", {'id': '1'}))
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_security_group')
+        service.InstanceController._try_create_security_group(mox.IgnoreArg(), mox.IgnoreArg(),
+                                                              mox.IgnoreArg(), mox.IgnoreArg()).AndReturn({'security_group': {'id': '123'}})
+        self.mock.StubOutWithMock(secgroup_models.SecurityGroup, 'find_by')
+        secgroup_models.SecurityGroup.find_by(id='123', deleted=False).AndReturn({'id': '123', 'remote_secgroup_name': 'test'})
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_server')
+        service.InstanceController._try_create_server(mox.IgnoreArg(), mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn((self.DUMMY_SERVER, self.DUMMY_GUEST_STATUS, {}))
+
+        self.mock.StubOutWithMock(service.InstanceController, '_try_assign_floating_ip')
+        service.InstanceController._try_assign_floating_ip(mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(
+            floating_ip)
+        self.mock.StubOutWithMock(service.InstanceController, '_try_attach_volume')
+        service.InstanceController._try_attach_volume(mox.IgnoreArg(),
+                            mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg()).AndRaise(
+                            exception.VolumeAttachmentFailure("attach failed"))
+        self.mock.StubOutWithMock(models.FloatingIP, 'unassign')
+        models.FloatingIP.unassign({'id': '1'}, "az2", floating_ip, self.DUMMY_SERVER['remote_id'])
+        self.mock.StubOutWithMock(models.FloatingIP, 'release')
+        models.FloatingIP.release({'id': '1'}, "az2", floating_ip)
+        self.mock.StubOutWithMock(worker_api.API, 'ensure_create_instance')
+
+        self.mock.ReplayAll()
+
+        response = self.app.post_json("%s" % (self.instances_path), body=body,
+                                      headers=self.headers, expect_errors=True)
+        self.assertEqual(response.status_int, 500)
+
+    def test_create_async(self):
+        config.Config.instance['reddwarf_async_provisioning'] = 'True'
+        body = {
+            "instance": {
+                "name": "json_rack_instance",
+                "flavorRef": "104"
+            }
+        }
+        default_quotas = [{ "tenant_id": self.tenant, "hard_limit": 3, "resource":"instances"},
+                          { "tenant_id": self.tenant, "hard_limit": 10, "resource":"snapshots"},
+                          { "tenant_id": self.tenant, "hard_limit": 20, "resource":"volume_space"}]
+
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
+        self.mock.StubOutWithMock(service.InstanceController, '_load_boot_params')
+        service.InstanceController._load_boot_params('123', '104').AndReturn(
+            ("1240", {"id": "1", "flavor_id": "100"}, "dbas-dev", "az2", {'id': '1'}))
+
+        # Nothing remote may be touched on the request path
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_security_group')
+        self.mock.StubOutWithMock(service.InstanceController, '_try_create_server')
+        self.mock.StubOutWithMock(taskmanager_api.API, 'provision_instance')
+        taskmanager_api.API.provision_instance(mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(None)
+
+        self.mock.ReplayAll()
+
+        try:
+            response = self.app.post_json("%s" % (self.instances_path), body=body,
+                                          headers=self.headers)
+        finally:
+            del config.Config.instance['reddwarf_async_provisioning']
+        self.assertEqual(response.status_int, 202)
+        instance_id = response.json['instance']['id']
+
+        task = models.ProvisioningTask.find_by(instance_id=instance_id)
+        self.assertEqual(task['state'], 'pending')
+        self.assertEqual(task['step'], 'security_group')
+        payload = json.loads(task['payload'])
+        self.assertEqual(payload['image_id'], '1240')
+        self.assertEqual(payload['flavor_id'], '100')
+        self.assertTrue(payload['userdata'])
+        guest_status = models.GuestStatus.find_by(instance_id=instance_id)
+        self.assertEqual(guest_status['state'], 'scheduling')
+
 #    def test_floating_ip_assignment(self):
 #
 #        class StubModel(models.RemoteModelBase):
@@ -312,7 +483,6 @@ class TestInstanceController(ControllerTestBase):
         
         self.mock.StubOutWithMock(models.Quota, 'find_all')
         models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
-        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
 
         self.mock.ReplayAll()
 
@@ -433,7 +603,6 @@ class TestSnapshotController(ControllerTestBase):
         
         self.mock.StubOutWithMock(models.Quota, 'find_all')
         models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
-        models.Quota.find_all(tenant_id=self.tenant, deleted=False).AndReturn(default_quotas)
         
         self.mock.ReplayAll()
 
@@ -444,3 +613,87 @@ class TestSnapshotController(ControllerTestBase):
         self.assertEqual(response.status_int, 413)
 
  
+
+
+class TestOperationController(ControllerTestBase):
+
+    def setUp(self):
+        super(TestOperationController, self).setUp()
+        self.headers = {'X-Auth-Token': 'abc:123',
+                        'X-Role': 'mysql-user',
+                        'X-User-Id': '999',
+                        'X-Tenant-Id': '123'}
+        self.tenant = self.headers['X-Tenant-Id']
+        self.operations_path = "/v1.0/" + self.tenant + "/operations"
+        self.instance = models.DBInstance().create(
+            name='db1', tenant_id=self.tenant, remote_hostname='host1',
+            address="10.0.0.1", availability_zone="az1")
+        models.GuestStatus().create(instance_id=self.instance['id'],
+                                    state='running')
+
+    def _operation(self, **values):
+        values.setdefault('state', 'pending')
+        return models.Operation().create(tenant_id=self.tenant,
+                                         instance_id=self.instance['id'],
+                                         action='reset-password', **values)
+
+    def test_reset_password_async(self):
+        self.mock.StubOutWithMock(guest_api.API, 'reset_password_async')
+        guest_api.API.reset_password_async(mox.IgnoreArg(),
+                                           self.instance['id'],
+                                           mox.IsA(basestring),
+                                           mox.IsA(basestring))
+        self.mock.ReplayAll()
+
+        headers = dict(self.headers, Prefer='respond-async')
+        response = self.app.post("/v1.0/%s/instances/%s/resetpassword"
+                                 % (self.tenant, self.instance['id']),
+                                 headers=headers)
+
+        self.assertEqual(202, response.status_int)
+        operation = response.json['operation']
+        self.assertEqual('pending', operation['status'])
+        self.assertTrue(response.json['password'])
+        self.assertTrue(response.headers['Location'].endswith(
+            "/operations/%s" % operation['id']))
+        self.assertEqual('pending',
+                         models.Operation.find_by(id=operation['id'])['state'])
+
+    def test_show(self):
+        operation = self._operation()
+        guest_api.PhoneHomeMessageHandler().update_operation_state(
+            {'method': 'update_operation_state',
+             'args': {'operation_id': operation['id'], 'state': 0}})
+
+        response = self.app.get("%s/%s" % (self.operations_path,
+                                           operation['id']),
+                                headers=self.headers)
+
+        self.assertEqual(200, response.status_int)
+        self.assertEqual('success', response.json['operation']['status'])
+
+    def test_stale_operation_is_failed(self):
+        operation = self._operation()
+
+        config.Config.instance['guest_operation_timeout'] = '-1'
+        try:
+            response = self.app.get("%s/%s" % (self.operations_path,
+                                               operation['id']),
+                                    headers=self.headers)
+        finally:
+            del config.Config.instance['guest_operation_timeout']
+
+        self.assertEqual('failed', response.json['operation']['status'])
+        self.assertIn('error', response.json['operation'])
+
+    def test_other_tenants_operation_is_not_found(self):
+        operation = models.Operation().create(tenant_id='other',
+                                              instance_id=self.instance['id'],
+                                              action='reset-password',
+                                              state='pending')
+
+        response = self.app.get("%s/%s" % (self.operations_path,
+                                           operation['id']),
+                                headers=self.headers, status='*')
+
+        self.assertEqual(404, response.status_int)
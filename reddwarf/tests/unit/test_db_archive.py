@@ -0,0 +1,140 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import imp
+import StringIO
+import sys
+
+from eventlet import greenthread
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+
+from reddwarf import db
+from reddwarf import tests
+from reddwarf.common import utils
+from reddwarf.database import models
+from reddwarf.db import archive
+from reddwarf.db.sqlalchemy import session
+
+
+class ArchiveDeletedRowsTest(tests.BaseTest):
+
+    def setUp(self):
+        super(ArchiveDeletedRowsTest, self).setUp()
+        self.long_ago = utils.utcnow() - datetime.timedelta(days=60)
+
+    def _instance(self, name, deleted_at=None):
+        instance = models.DBInstance().create(name=name,
+                                              availability_zone="az1")
+        if deleted_at:
+            instance.update(deleted=True, deleted_at=deleted_at)
+        return instance
+
+    def _shadow_ids(self, table_name):
+        engine = session.get_session().bind
+        shadow = Table('shadow_' + table_name, MetaData(bind=engine),
+                       autoload=True)
+        return [row['id'] for row in engine.execute(shadow.select())]
+
+    def test_tables_with_shadow_tables_are_archived(self):
+        tables = db.db_api.archived_tables()
+
+        self.assertIn('instances', tables)
+        self.assertIn('operations', tables)
+        self.assertNotIn('quotas', tables)
+
+    def test_old_deleted_rows_are_moved(self):
+        old = self._instance("old", deleted_at=self.long_ago)
+        recent = self._instance("recent", deleted_at=utils.utcnow())
+        live = self._instance("live")
+
+        archived = archive.archive_deleted_rows(age_days=30)
+
+        self.assertEqual(archived['instances'], 1)
+        self.assertEqual(self._shadow_ids('instances'), [old['id']])
+        self.assertIsNone(models.DBInstance.get_by(id=old['id']))
+        self.assertIsNotNone(models.DBInstance.get_by(id=recent['id']))
+        self.assertIsNotNone(models.DBInstance.get_by(id=live['id']))
+
+    def test_rows_are_moved_in_throttled_batches(self):
+        for i in range(5):
+            self._instance("old%s" % i, deleted_at=self.long_ago)
+        self.mock.StubOutWithMock(greenthread, 'sleep')
+        greenthread.sleep(0.5)
+        greenthread.sleep(0.5)
+        self.mock.ReplayAll()
+
+        archived = archive.archive_deleted_rows(age_days=30, batch_size=2,
+                                                max_batches=10, pause=0.5)
+
+        self.assertEqual(archived['instances'], 5)
+        self.assertEqual(len(self._shadow_ids('instances')), 5)
+
+    def test_max_batches_bounds_a_run(self):
+        for i in range(5):
+            self._instance("old%s" % i, deleted_at=self.long_ago)
+
+        archived = archive.archive_deleted_rows(age_days=30, batch_size=2,
+                                                max_batches=1, pause=0)
+
+        self.assertEqual(archived['instances'], 2)
+        self.assertEqual(models.DBInstance.find_all(deleted=True).count(), 3)
+
+    def test_operations_of_deleted_instances_are_archived(self):
+        instance = self._instance("old", deleted_at=self.long_ago)
+        operation = models.Operation.create(tenant_id="tenant",
+                                            instance_id=instance['id'],
+                                            action="reset_password",
+                                            state="success")
+
+        models.Operation.delete_for_instance(instance['id'])
+        operation = models.Operation.find_by(id=operation['id'])
+        self.assertTrue(operation['deleted'])
+        operation.update(deleted_at=self.long_ago)
+        archived = archive.archive_deleted_rows(age_days=30)
+
+        self.assertEqual(archived['operations'], 1)
+        self.assertEqual(self._shadow_ids('operations'), [operation['id']])
+
+
+class ManageArchiveCommandTest(tests.BaseTest):
+
+    def setUp(self):
+        super(ManageArchiveCommandTest, self).setUp()
+        self.manage = imp.load_source('reddwarf_manage',
+                                      tests.reddwarf_bin_path(
+                                          'reddwarf-manage'))
+        self.output = StringIO.StringIO()
+        self.mock.stubs.Set(sys, 'stdout', self.output)
+
+    def test_archive_prints_the_rows_moved_per_table(self):
+        conf = {}
+        long_ago = utils.utcnow() - datetime.timedelta(days=60)
+        instance = models.DBInstance().create(name="old",
+                                              availability_zone="az1")
+        instance.update(deleted=True, deleted_at=long_ago)
+        self.mock.StubOutWithMock(db.db_api, 'configure_db')
+        db.db_api.configure_db(conf)
+        self.mock.ReplayAll()
+
+        self.manage.Commands(conf).execute('db_archive_deleted_rows', '30')
+
+        lines = self.output.getvalue().splitlines()
+        self.assertEqual(len(lines), len(db.db_api.archived_tables()))
+        self.assertIn("instances: 1", lines)
+        self.assertIn("operations: 0", lines)
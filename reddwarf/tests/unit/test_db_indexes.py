@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ast
+import os
+
+from sqlalchemy import orm
+
+import reddwarf
+from reddwarf import tests
+from reddwarf.database import models
+from reddwarf.db.sqlalchemy import mappers
+from reddwarf.db.sqlalchemy import session
+from reddwarf.securitygroup import models as secgroup_models
+
+
+LOOKUPS = ('find_by', 'find_all', 'get_by')
+
+
+def _model_lookups():
+    """Yield (model name, columns, path) for every keyword lookup.
+
+    Lookups are found by walking the source, so a new find_by on an
+    unindexed column fails here rather than in production.
+    """
+    root = os.path.dirname(reddwarf.__file__)
+    for dirpath, dirnames, filenames in os.walk(root):
+        if 'tests' in dirpath.split(os.sep):
+            continue
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path) as source:
+                tree = ast.parse(source.read(), path)
+            for node in ast.walk(tree):
+                if not (isinstance(node, ast.Call) and
+                        isinstance(node.func, ast.Attribute) and
+                        node.func.attr in LOOKUPS and node.keywords):
+                    continue
+                target = node.func.value
+                if isinstance(target, ast.Call):
+                    target = target.func
+                if isinstance(target, ast.Attribute):
+                    yield (target.attr, [kw.arg for kw in node.keywords],
+                           path)
+
+
+class IndexCoverageTest(tests.BaseTest):
+
+    def _plan(self, table, columns):
+        predicate = " AND ".join("%s = ?" % column for column in columns)
+        sql = ("EXPLAIN QUERY PLAN SELECT * FROM %s WHERE %s"
+               % (table, predicate))
+        engine = session.get_session().bind
+        rows = engine.execute(sql, *([1] * len(columns)))
+        return [list(row)[-1] for row in rows]
+
+    def _mapped_model(self, name):
+        for module in (models, secgroup_models):
+            model = getattr(module, name, None)
+            if model is not None and mappers.mapping_exists(model):
+                return model
+
+    def test_model_lookups_use_an_index(self):
+        checked = 0
+        for name, columns, path in _model_lookups():
+            model = self._mapped_model(name)
+            if model is None:
+                continue
+            # Whole-table loads of the service configuration are meant
+            # to scan.
+            if columns == ['deleted']:
+                continue
+            table = orm.class_mapper(model).mapped_table.name
+            plan = " ".join(self._plan(table, columns))
+            self.assertTrue("USING" in plan,
+                            "%s lookup on (%s) in %s is not index-backed: %s"
+                            % (name, ", ".join(columns), path, plan))
+            checked += 1
+        self.assertTrue(checked > 0)
+
+    def test_instance_lookup_by_tenant_uses_composite_index(self):
+        plan = " ".join(self._plan('instances', ['tenant_id', 'deleted']))
+        self.assertIn("ix_instances_tenant_id_deleted", plan)
+
+    def test_operations_of_an_instance_use_an_index(self):
+        plan = " ".join(self._plan('operations', ['instance_id', 'deleted']))
+        self.assertIn("ix_operations_instance_id_deleted", plan)
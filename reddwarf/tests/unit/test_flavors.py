@@ -74,11 +74,14 @@ class TestFlavorController(ControllerTestBase):
         self.tenant = self.headers['X-Tenant-Id']
         self.flavors_path = "/v1.0/" + self.tenant + "/flavors"      
         
+    def _create_flavor(self):
+        models.ServiceFlavor(id="901", service_name="database",
+                             flavor_name="xsmall", flavor_id=str(self.FLAVOR_ID),
+                             ram=1, vcpus=1, deleted=False).save()
+        models.service_config_cache.invalidate()
+
     def test_index(self):
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_all')
-        flavors = models.ServiceFlavor().find_all().AndReturn([self.DUMMY_FLAVOR])
-        
-        self.mock.ReplayAll()
+        self._create_flavor()
         
         response = self.app.get("%s" % (self.flavors_path), headers=self.headers)
         self.assertEqual(response.status_int, 200)
@@ -86,11 +89,23 @@ class TestFlavorController(ControllerTestBase):
         response_json = json.loads(response.body)
         self.assertEqual(len(response_json['flavors']), 1, "Unexpected number of flavors returned")
     
+    def test_index_lists_only_live_database_flavors(self):
+        self._create_flavor()
+        models.ServiceFlavor(id="903", service_name="database",
+                             flavor_name="gone", flavor_id="103",
+                             ram=1, vcpus=1, deleted=True).save()
+        models.ServiceFlavor(id="904", service_name="other",
+                             flavor_name="other", flavor_id="104",
+                             ram=1, vcpus=1, deleted=False).save()
+        models.service_config_cache.invalidate()
+
+        response = self.app.get("%s" % (self.flavors_path), headers=self.headers)
+
+        flavors = json.loads(response.body)['flavors']
+        self.assertEqual([flavor['id'] for flavor in flavors], [self.FLAVOR_ID])
+
     def test_index_detail(self):
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_all')
-        flavors = models.ServiceFlavor().find_all().AndReturn([self.DUMMY_FLAVOR])
-        
-        self.mock.ReplayAll()
+        self._create_flavor()
         
         response = self.app.get("%s" % (self.flavors_path + "/detail"), headers=self.headers)
         self.assertEqual(response.status_int, 200)
@@ -99,10 +114,7 @@ class TestFlavorController(ControllerTestBase):
         self.assertEqual(len(response_json['flavors']), 1, "Unexpected number of flavors returned")
     
     def test_show(self):
-        self.mock.StubOutWithMock(models.ServiceFlavor, 'find_by')
-        flavors = models.ServiceFlavor().find_by(flavor_id=self.FLAVOR_ID).AndReturn(self.DUMMY_FLAVOR)
-        
-        self.mock.ReplayAll()
+        self._create_flavor()
         
         response = self.app.get("%s" % (self.flavors_path + "/" + str(self.FLAVOR_ID)), headers=self.headers)
         self.assertEqual(response.status_int, 200)
@@ -111,4 +123,62 @@ class TestFlavorController(ControllerTestBase):
         self.assertEqual(response_json['flavor']['name'], "xsmall", "Unexpected flavor name returned")
         self.assertEqual(response_json['flavor']['id'], self.FLAVOR_ID, "Unexpected id returned")
         self.assertEqual(response_json['flavor']['links'][0]['href'], "http://localhost" + self.flavors_path + "/" + str(self.FLAVOR_ID), "Link href value is incorret")
-            
\ No newline at end of file
+
+    def test_show_not_found(self):
+        self._create_flavor()
+
+        response = self.app.get("%s" % (self.flavors_path + "/999"), headers=self.headers,
+                                expect_errors=True)
+        self.assertEqual(response.status_int, 404)
+
+    def test_index_not_modified(self):
+        self._create_flavor()
+
+        response = self.app.get("%s" % (self.flavors_path), headers=self.headers)
+        etag = response.headers['ETag']
+        self.assertTrue(response.headers['Cache-Control'].startswith('private'))
+        self.assertEqual(response.headers['Vary'], 'Accept')
+
+        headers = dict(self.headers)
+        headers['If-None-Match'] = etag
+        response = self.app.get("%s" % (self.flavors_path), headers=headers)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, "")
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Vary'], 'Accept')
+
+    def test_any_etag_is_not_modified(self):
+        self._create_flavor()
+        headers = dict(self.headers)
+        headers['If-None-Match'] = '*'
+        response = self.app.get("%s" % (self.flavors_path), headers=headers)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, "")
+
+    def test_etag_changes_with_flavors(self):
+        self._create_flavor()
+        response = self.app.get("%s" % (self.flavors_path), headers=self.headers)
+        etag = response.headers['ETag']
+
+        models.ServiceFlavor(id="902", service_name="database",
+                             flavor_name="small", flavor_id="102",
+                             ram=2, vcpus=1, deleted=False).save()
+        models.service_config_cache.invalidate()
+
+        headers = dict(self.headers)
+        headers['If-None-Match'] = etag
+        response = self.app.get("%s" % (self.flavors_path), headers=headers)
+        self.assertEqual(response.status_int, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(json.loads(response.body)['flavors']), 2)
+
+    def test_xml_has_its_own_etag(self):
+        self._create_flavor()
+        json_response = self.app.get("%s" % (self.flavors_path), headers=self.headers)
+        headers = dict(self.headers)
+        headers['Accept'] = 'application/xml'
+        xml_response = self.app.get("%s" % (self.flavors_path), headers=headers)
+
+        self.assertEqual(xml_response.status_int, 200)
+        self.assertTrue("xsmall" in xml_response.body)
+        self.assertNotEqual(json_response.headers['ETag'], xml_response.headers['ETag'])
@@ -0,0 +1,339 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mox
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.common import result_state
+from reddwarf.database import dbutils
+from reddwarf.database import guest_api
+from reddwarf.database import models
+
+
+class FakeDelivery(object):
+
+    def __init__(self):
+        self.acked = False
+        self.requeued = False
+
+    def ack(self):
+        self.acked = True
+
+    def requeue(self):
+        self.requeued = True
+
+
+class PhoneHomeMessageHandlerTest(tests.BaseTest):
+
+    def setUp(self):
+        super(PhoneHomeMessageHandlerTest, self).setUp()
+        self.handler = guest_api.PhoneHomeMessageHandler()
+
+    def tearDown(self):
+        self.handler.drain()
+        super(PhoneHomeMessageHandlerTest, self).tearDown()
+
+    def _instance(self, hostname):
+        instance = models.DBInstance().create(name=hostname,
+                                              remote_hostname=hostname,
+                                              address="10.0.0.1",
+                                              availability_zone="az1")
+        models.GuestStatus().create(instance_id=instance['id'],
+                                    state='building')
+        return instance
+
+    def _heartbeat(self, hostname, state):
+        """A heartbeat message; state is a ResultState name."""
+        return {'method': 'update_instance_state',
+                'args': {'hostname': hostname,
+                         'state': getattr(result_state.ResultState, state)}}
+
+    def _state(self, instance):
+        return models.GuestStatus.find_by(instance_id=instance['id'])['state']
+
+    def test_heartbeats_are_coalesced(self):
+        instance = self._instance('host1')
+
+        self.handler(self._heartbeat('host1', 'NOSTATE'))
+        self.handler(self._heartbeat('host1', 'SUCCESS'))
+        self.assertEqual('building', self._state(instance))
+
+        self.handler.drain()
+        self.assertEqual('running', self._state(instance))
+
+    def test_one_update_per_state(self):
+        first = self._instance('host1')
+        second = self._instance('host2')
+        third = self._instance('host3')
+
+        self.mock.StubOutWithMock(dbutils, 'update_guest_statuses')
+        dbutils.update_guest_statuses(
+            mox.SameElementsAs([first['id'], second['id']]), 'running')
+        dbutils.update_guest_statuses([third['id']], 'failed')
+        self.mock.ReplayAll()
+
+        self.handler(self._heartbeat('host1', 'RUNNING'))
+        self.handler(self._heartbeat('host2', 'SUCCESS'))
+        self.handler(self._heartbeat('host3', 'FAILED'))
+        self.handler.drain()
+
+    def test_unknown_host_is_skipped(self):
+        instance = self._instance('host1')
+
+        self.handler(self._heartbeat('host1', 'FAILED'))
+        self.handler(self._heartbeat('gone', 'FAILED'))
+        self.handler.drain()
+
+        self.assertEqual('failed', self._state(instance))
+
+    def test_hosts_are_looked_up_once(self):
+        instance = self._instance('host1')
+
+        self.handler(self._heartbeat('host1', 'RUNNING'))
+        self.handler.drain()
+
+        self.mock.StubOutWithMock(dbutils, 'get_instances_by_hostnames')
+        self.mock.StubOutWithMock(dbutils, 'update_guest_statuses')
+        dbutils.update_guest_statuses([instance['id']], 'running')
+        dbutils.update_guest_statuses([instance['id']], 'failed')
+        self.mock.ReplayAll()
+
+        self.handler(self._heartbeat('host1', 'SUCCESS'))
+        self.handler.drain()
+        self.handler(self._heartbeat('host1', 'FAILED'))
+        self.handler.drain()
+
+    def test_state_changed_by_another_writer_is_restored(self):
+        instance = self._instance('host1')
+
+        self.handler(self._heartbeat('host1', 'RUNNING'))
+        self.handler.drain()
+        models.GuestStatus.find_by(instance_id=instance['id']).update(
+            state='unresponsive')
+        self.handler(self._heartbeat('host1', 'RUNNING'))
+        self.handler.drain()
+
+        self.assertEqual('running', self._state(instance))
+
+    def test_heartbeats_are_recorded(self):
+        instance = self._instance('host1')
+        self.assertIsNone(models.GuestStatus.find_by(
+            instance_id=instance['id'])['heartbeat_at'])
+
+        self.handler(self._heartbeat('host1', 'RUNNING'))
+        self.handler.drain()
+
+        guest = models.GuestStatus.find_by(instance_id=instance['id'])
+        self.assertIsNotNone(guest['heartbeat_at'])
+
+    def test_update_states_skips_rows_in_that_state(self):
+        first = self._instance('host1')
+        second = self._instance('host2')
+        models.GuestStatus.find_by(instance_id=second['id']).update(
+            state='running')
+
+        written = models.GuestStatus.update_states(
+            [first['id'], second['id']], 'running')
+
+        self.assertEqual(1, written)
+        self.assertEqual('running', self._state(first))
+
+    def test_heartbeats_are_acked_after_the_write(self):
+        instance = self._instance('host1')
+        first, second = FakeDelivery(), FakeDelivery()
+
+        self.handler(self._heartbeat('host1', 'NOSTATE'),
+                     first)
+        self.handler(self._heartbeat('host1', 'RUNNING'),
+                     second)
+        self.assertFalse(first.acked or second.acked)
+
+        self.handler.drain()
+        self.assertEqual('running', self._state(instance))
+        self.assertTrue(first.acked and second.acked)
+
+    def test_heartbeats_are_requeued_when_the_write_fails(self):
+        self._instance('host1')
+        self._instance('host2')
+        self.mock.StubOutWithMock(dbutils, 'update_guest_statuses')
+        dbutils.update_guest_statuses(
+            mox.IgnoreArg(), 'running').InAnyOrder().AndRaise(
+                Exception("database gone"))
+        dbutils.update_guest_statuses(mox.IgnoreArg(), 'failed').InAnyOrder()
+        self.mock.ReplayAll()
+        running, failed = FakeDelivery(), FakeDelivery()
+
+        self.handler(self._heartbeat('host1', 'RUNNING'),
+                     running)
+        self.handler(self._heartbeat('host2', 'FAILED'),
+                     failed)
+        self.handler.drain()
+
+        self.assertTrue(running.requeued)
+        self.assertFalse(running.acked)
+        self.assertTrue(failed.acked)
+
+    def test_invalid_message_is_acked(self):
+        delivery = FakeDelivery()
+
+        self.handler({'method': '', 'args': {}}, delivery)
+
+        self.assertTrue(delivery.acked)
+
+    def test_other_messages_run_on_the_pool(self):
+        msg = {'method': 'update_snapshot_state', 'args': {'sid': 'sid'}}
+        self.mock.StubOutWithMock(self.handler, 'update_snapshot_state')
+        self.handler.update_snapshot_state(msg)
+        self.mock.ReplayAll()
+
+        delivery = FakeDelivery()
+        self.handler(msg, delivery)
+        self.handler.drain()
+        self.assertTrue(delivery.acked)
+
+
+class RoutingKeyCacheTest(tests.BaseTest):
+
+    def setUp(self):
+        super(RoutingKeyCacheTest, self).setUp()
+        guest_api.invalidate_routing_key()
+        self.api = guest_api.API()
+        self.instance = models.DBInstance().create(
+            name='db1', remote_hostname='host1.example.com',
+            address="10.0.0.1", availability_zone="az1")
+
+    def tearDown(self):
+        guest_api.invalidate_routing_key()
+        super(RoutingKeyCacheTest, self).tearDown()
+
+    def test_routing_key(self):
+        self.assertEqual('guest.host1',
+                         self.api._get_routing_key(None, self.instance['id']))
+
+    def test_hostname_is_looked_up_once(self):
+        self.mock.StubOutWithMock(dbutils, 'get_instance')
+        dbutils.get_instance(self.instance['id']).AndReturn(self.instance)
+        self.mock.StubOutWithMock(guest_api.rpc, 'cast')
+        guest_api.rpc.cast(None, 'guest.host1', {"method": "upgrade"})
+        guest_api.rpc.cast(None, 'guest.host1', {"method": "upgrade"})
+        self.mock.ReplayAll()
+
+        self.api.upgrade(None, self.instance['id'])
+        self.api.upgrade(None, self.instance['id'])
+
+    def test_invalidate_routing_key(self):
+        self.api._get_routing_key(None, self.instance['id'])
+        self.instance.update(remote_hostname='host2.example.com')
+        guest_api.invalidate_routing_key(self.instance['id'])
+
+        self.assertEqual('guest.host2',
+                         self.api._get_routing_key(None, self.instance['id']))
+
+    def test_unset_hostname_is_not_cached(self):
+        self.instance.update(remote_hostname=None)
+        self.assertIsNone(guest_api._get_hostname(self.instance['id']))
+
+        self.instance.update(remote_hostname='host2.example.com')
+        self.assertEqual('host2.example.com',
+                         guest_api._get_hostname(self.instance['id']))
+
+
+class MySQLStatusSweepTest(tests.BaseTest):
+
+    def setUp(self):
+        super(MySQLStatusSweepTest, self).setUp()
+        self.api = guest_api.API()
+
+    def _instance(self, hostname, state='running'):
+        instance = models.DBInstance().create(name=hostname,
+                                              remote_hostname=hostname,
+                                              address="10.0.0.1",
+                                              availability_zone="az1")
+        models.GuestStatus().create(instance_id=instance['id'], state=state)
+        return instance
+
+    def _state(self, instance):
+        return models.GuestStatus.find_by(instance_id=instance['id'])['state']
+
+    def test_sweep(self):
+        alive = self._instance('host1', 'unresponsive')
+        stopped = self._instance('host2')
+        silent = self._instance('host3')
+        building = self._instance('host4', 'building')
+        failed = self._instance('host5', 'failed')
+
+        self.mock.StubOutWithMock(guest_api.rpc, 'scatter_call')
+        guest_api.rpc.scatter_call(
+            None,
+            {alive['id']: ('host1', {"method": "check_mysql_status"}),
+             stopped['id']: ('host2', {"method": "check_mysql_status"}),
+             silent['id']: ('host3', {"method": "check_mysql_status"})},
+            mox.IgnoreArg()).AndReturn(
+                {alive['id']: result_state.ResultState.SUCCESS,
+                 stopped['id']: result_state.ResultState.STOP})
+        self.mock.ReplayAll()
+
+        states, unresponsive = self.api.sweep_mysql_status(None)
+
+        self.assertEqual({'running': [alive['id']], 'stop': [stopped['id']]},
+                         states)
+        self.assertEqual([silent['id']], unresponsive)
+        self.assertEqual('running', self._state(alive))
+        self.assertEqual('stop', self._state(stopped))
+        self.assertEqual('unresponsive', self._state(silent))
+        self.assertEqual('building', self._state(building))
+        self.assertEqual('failed', self._state(failed))
+        guest = models.GuestStatus.find_by(instance_id=alive['id'])
+        self.assertIsNotNone(guest['heartbeat_at'])
+
+    def test_statuses_are_written_in_batches(self):
+        first = self._instance('host1', 'unresponsive')
+        second = self._instance('host2', 'unresponsive')
+
+        self.mock.StubOutWithMock(guest_api.rpc, 'scatter_call')
+        guest_api.rpc.scatter_call(None, mox.IgnoreArg(),
+                                   mox.IgnoreArg()).AndReturn(
+            {first['id']: result_state.ResultState.RUNNING,
+             second['id']: result_state.ResultState.RUNNING})
+        self.mock.StubOutWithMock(dbutils, 'update_guest_statuses')
+        dbutils.update_guest_statuses(mox.IsA(list), 'running',
+                                      from_states=guest_api.SWEPT_STATES)
+        dbutils.update_guest_statuses(mox.IsA(list), 'running',
+                                      from_states=guest_api.SWEPT_STATES)
+        self.mock.ReplayAll()
+
+        config.Config.instance['guest_health_batch_size'] = '1'
+        try:
+            self.api.sweep_mysql_status(None)
+        finally:
+            del config.Config.instance['guest_health_batch_size']
+
+    def test_guest_moved_on_during_the_sweep_is_kept(self):
+        silent = self._instance('host1')
+
+        def _restart(*args):
+            models.GuestStatus.find_by(instance_id=silent['id']).update(
+                state='restarting')
+        self.mock.StubOutWithMock(guest_api.rpc, 'scatter_call')
+        guest_api.rpc.scatter_call(None, mox.IgnoreArg(), mox.IgnoreArg()).\
+            WithSideEffects(_restart).AndReturn({})
+        self.mock.ReplayAll()
+
+        self.api.sweep_mysql_status(None)
+
+        self.assertEqual('restarting', self._state(silent))
@@ -0,0 +1,128 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from eventlet import event
+import kombu.entity
+import kombu.messaging
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.rpc import envelope
+from reddwarf.rpc import impl_kombu
+from reddwarf.rpc import message_handler
+
+
+class FakeListener(object):
+
+    def __init__(self):
+        self.stopped = event.Event()
+        self.closed = False
+
+    def consume(self):
+        self.stopped.wait()
+
+    def done(self):
+        self.closed = True
+
+
+class MessageHandlerServiceTest(tests.BaseTest):
+
+    def setUp(self):
+        super(MessageHandlerServiceTest, self).setUp()
+        config.Config.instance['phonehome_consumers'] = 3
+        self.service = message_handler.MessageHandlerService()
+        self.listeners = []
+
+        def listen(exchange, msg_handler, prefetch_count=None, queue=None):
+            self.assertEqual('phonehome', exchange)
+            self.assertEqual('phonehome_workers', queue)
+            self.listeners.append(FakeListener())
+            return self.listeners[-1]
+
+        self.mock.stubs.Set(impl_kombu, 'listen', listen)
+
+    def tearDown(self):
+        del config.Config.instance['phonehome_consumers']
+        super(MessageHandlerServiceTest, self).tearDown()
+
+    def test_stop_drains_then_closes_consumers(self):
+        self.service.start()
+        self.assertEqual(3, len(self.listeners))
+
+        drained = []
+        self.service._msg_handler.drain = lambda: drained.append(
+            [listener.closed for listener in self.listeners])
+        self.service.stop()
+        self.service.wait()
+
+        self.assertEqual([[False, False, False]], drained)
+        self.assertEqual([True, True, True],
+                         [listener.closed for listener in self.listeners])
+
+
+class SharedQueueTest(tests.BaseTest):
+
+    EXCHANGE = 'phonehome_test'
+    QUEUE = 'phonehome_test_workers'
+
+    def setUp(self):
+        super(SharedQueueTest, self).setUp()
+        config.Config.instance['fake_rabbit'] = True
+        self.conn = impl_kombu.Connection()
+        exchange = kombu.entity.Exchange(self.EXCHANGE, type='direct',
+                                         durable=False, auto_delete=True)
+        self.producer = kombu.messaging.Producer(self.conn.channel,
+                                                 exchange=exchange,
+                                                 routing_key=self.EXCHANGE)
+
+    def tearDown(self):
+        self.conn.close()
+        del config.Config.instance['fake_rabbit']
+        super(SharedQueueTest, self).tearDown()
+
+    def _publish(self, i):
+        self.producer.publish(envelope.serialize({'method': 'm',
+                                                  'args': {'i': i}}),
+                              content_type=envelope.JSON,
+                              content_encoding='utf-8')
+
+    def _listen(self, received):
+        def handle(message, delivery):
+            received.append(message)
+            delivery.ack()
+        return impl_kombu.listen(self.EXCHANGE, handle,
+                                 prefetch_count=1, queue=self.QUEUE)
+
+    def test_consumers_compete_for_messages(self):
+        first, second = [], []
+        waiters = [iter(self._listen(first)), iter(self._listen(second))]
+        for i in range(4):
+            self._publish(i)
+
+        for waiter in waiters * 2:
+            waiter.next()
+
+        self.assertEqual(4, len(first) + len(second))
+        self.assertTrue(first and second)
+
+    def test_queue_outlives_its_consumers(self):
+        self._listen([]).done()
+        self._publish(1)
+
+        received = []
+        iter(self._listen(received)).next()
+        self.assertEqual([{'method': 'm', 'args': {'i': 1}}], received)
@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import logging
 import unittest
 
@@ -21,7 +22,10 @@ from sqlalchemy.orm import query
 
 from reddwarf.database import quota
 from reddwarf.database import models
+from reddwarf.common import config
 from reddwarf.common import context as rd_context
+from reddwarf.common import exception
+from reddwarf.common import utils
 from reddwarf import tests
 
 LOG = logging.getLogger(__name__)
@@ -34,6 +38,10 @@ class QuotaTest(tests.BaseTest):
     DUMMY_CONTEXT =  rd_context.ReddwarfContext(
                           auth_tok='Auth_ABCDEFG',
                           tenant='12345')
+
+    def setUp(self):
+        super(QuotaTest, self).setUp()
+        quota.invalidate_limits()
     
     def test_get_default_quotas(self):
         """Tests the default quota for instances and snapshots is 0,
@@ -210,16 +218,23 @@ class QuotaTest(tests.BaseTest):
         
         
     
+    def _create_volume(self, size, tenant_id='12345', deleted=False):
+        volume = models.DBVolume.create(tenant_id=tenant_id, size=size,
+                                        volume_id=utils.generate_uuid(),
+                                        availability_zone='az1')
+        if deleted:
+            volume.delete()
+
+    def _create_volumes(self, *sizes):
+        for size in sizes:
+            self._create_volume(size)
+
     def test_allowed_volume_size(self):
         """Tests that given a quota on volume_space, the size of 
         volume allowed to be created is calculated appropriately"""
 
-        DUMMY_DBVOLUME_LIST = [ { 'size': 4 },
-                                { 'size': 2 } ]
-        
         # Pretend that 2 volume exists for this tenant
-        self.mock.StubOutWithMock(models.DBVolume, 'find_all')
-        models.DBVolume.find_all(tenant_id='12345', deleted=False).AndReturn(DUMMY_DBVOLUME_LIST)
+        self._create_volumes(4, 2)
 
         # Allow up to 20 GBs of volume space
         default_quotas = [{ "tenant_id": "12345", "hard_limit": 20, "resource":"volume_space"}]        
@@ -236,40 +251,162 @@ class QuotaTest(tests.BaseTest):
     def test_allowed_volume_size_truncated(self):
         """ Ensure that the request for a volume size that exceeds quota
         gets truncated to the maximum allowed """
-        DUMMY_DBVOLUME_LIST = [ { 'size': 4 },
-                                { 'size': 2 } ]
-        
+
         # Pretend that 2 volumes exists for this tenant
-        self.mock.StubOutWithMock(models.DBVolume, 'find_all')
-        models.DBVolume.find_all(tenant_id='12345', deleted=False).AndReturn(DUMMY_DBVOLUME_LIST)
+        self._create_volumes(4, 2)
 
-        # Allow up to 5 snapshots to be created
+        # Allow up to 10 GBs of volume space
         default_quotas = [{ "tenant_id": "12345", "hard_limit": 10, "resource":"volume_space"}]        
         self.mock.StubOutWithMock(models.Quota, 'find_all')
         models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn(default_quotas)
         
         self.mock.ReplayAll()
         
-        # Check if we are allowed to create 1 snapshot
+        # Check if we are allowed to create a 5 GB volume
         allowed = quota.allowed_volume_size(self.DUMMY_CONTEXT, 5)
         self.assertTrue(allowed == 4, 'Expected 4 GB allowed volume space, instead got %s' % allowed)
 
     def test_allowed_volume_size_exceeds_quota(self):
         """ Ensure that a 0 is returned when used volume size == quota limit """
-        DUMMY_DBVOLUME_LIST = [ { 'size': 4 },
-                                { 'size': 6 } ]
-        
+
         # Pretend that 2 volume exists for this tenant
-        self.mock.StubOutWithMock(models.DBVolume, 'find_all')
-        models.DBVolume.find_all(tenant_id='12345', deleted=False).AndReturn(DUMMY_DBVOLUME_LIST)
+        self._create_volumes(4, 6)
 
-        # Allow up to 20 GBs of volume space
+        # Allow up to 10 GBs of volume space
         default_quotas = [{ "tenant_id": "12345", "hard_limit": 10, "resource":"volume_space"}]        
         self.mock.StubOutWithMock(models.Quota, 'find_all')
         models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn(default_quotas)
         
         self.mock.ReplayAll()
 
-        # Check if we are allowed to create 1 snapshot
+        # Check if we are allowed to create a 1 GB volume
         allowed = quota.allowed_volume_size(self.DUMMY_CONTEXT, 1)
         self.assertTrue(allowed == 0, 'Expected 0 allowed volume space, instead got %s' % allowed)
+
+    def test_allowed_volume_size_unlimited(self):
+        """ Ensure an unlimited (-1) quota allows the whole request """
+        self._create_volumes(4, 6)
+        config.Config.instance['quota_volume_space'] = -1
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn([])
+        self.mock.ReplayAll()
+
+        try:
+            allowed = quota.allowed_volume_size(self.DUMMY_CONTEXT, 50)
+        finally:
+            del config.Config.instance['quota_volume_space']
+        self.assertEqual(50, allowed)
+
+    def test_volume_usage_ignores_deleted_volumes(self):
+        """ Ensure deleted volumes are left out of the summed usage """
+        self._create_volumes(4, 6)
+        self._create_volume(8, deleted=True)
+        self._create_volume(8, tenant_id='other')
+
+        self.assertEqual(10, quota._count_usage('12345', 'volume_space'))
+
+    def test_volume_usage_without_volumes(self):
+        self.assertEqual(0, quota._count_usage('12345', 'volume_space'))
+
+    def test_tenant_quotas_are_cached(self):
+        """ Ensure the limits are read from the database once per tenant """
+        default_quotas = [{ "tenant_id": "12345", "hard_limit": 3, "resource":"instances"}]
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn(default_quotas)
+
+        self.mock.ReplayAll()
+
+        first = quota.get_tenant_quotas(self.DUMMY_CONTEXT, '12345')
+        first['instances'] = 100
+        second = quota.get_tenant_quotas(self.DUMMY_CONTEXT, '12345')
+        self.assertEqual(3, second['instances'])
+
+    def test_invalidate_limits_reloads(self):
+        self.mock.StubOutWithMock(models.Quota, 'find_all')
+        models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn([])
+        models.Quota.find_all(tenant_id='12345', deleted=False).AndReturn(
+            [{ "tenant_id": "12345", "hard_limit": 3, "resource":"instances"}])
+
+        self.mock.ReplayAll()
+
+        self.assertEqual(0, quota.get_tenant_quotas(self.DUMMY_CONTEXT, '12345')['instances'])
+        quota.invalidate_limits('12345')
+        self.assertEqual(3, quota.get_tenant_quotas(self.DUMMY_CONTEXT, '12345')['instances'])
+
+
+class QuotaReservationTest(tests.BaseTest):
+
+    DUMMY_CONTEXT = rd_context.ReddwarfContext(auth_tok='Auth_ABCDEFG',
+                                               tenant='12345')
+
+    def setUp(self):
+        super(QuotaReservationTest, self).setUp()
+        quota.invalidate_limits()
+        models.Quota.create(tenant_id='12345', resource='instances',
+                            hard_limit=2)
+
+    def _usage(self, resource='instances'):
+        return models.QuotaUsage.find_by(tenant_id='12345', resource=resource)
+
+    def test_usage_is_counted_on_first_use(self):
+        models.DBInstance.create(tenant_id='12345', name='one',
+                                 availability_zone='az1')
+
+        quota.reserve(self.DUMMY_CONTEXT, instances=1)
+
+        self.assertEqual(self._usage()['in_use'], 1)
+        self.assertEqual(self._usage()['reserved'], 1)
+
+    def test_commit_moves_reservation_to_in_use(self):
+        reservations = quota.reserve(self.DUMMY_CONTEXT, instances=1)
+        quota.commit(self.DUMMY_CONTEXT, reservations)
+
+        self.assertEqual(self._usage()['in_use'], 1)
+        self.assertEqual(self._usage()['reserved'], 0)
+        self.assertIsNone(models.Reservation.get_by(id=reservations[0]))
+
+        # A second commit, or a rollback, of the same reservation is a no-op
+        quota.rollback(self.DUMMY_CONTEXT, reservations)
+        self.assertEqual(self._usage()['in_use'], 1)
+
+    def test_reservations_count_against_the_limit(self):
+        quota.reserve(self.DUMMY_CONTEXT, instances=1)
+        quota.reserve(self.DUMMY_CONTEXT, instances=1)
+
+        self.assertRaises(exception.QuotaError, quota.reserve,
+                          self.DUMMY_CONTEXT, instances=1)
+        self.assertEqual(self._usage()['reserved'], 2)
+
+    def test_failed_reserve_holds_nothing(self):
+        models.Quota.create(tenant_id='12345', resource='volume_space',
+                            hard_limit=10)
+
+        self.assertRaises(exception.QuotaError, quota.reserve,
+                          self.DUMMY_CONTEXT, instances=1, volume_space=20)
+        self.assertEqual(self._usage()['reserved'], 0)
+        self.assertEqual(self._usage('volume_space')['reserved'], 0)
+
+    def test_rollback_gives_quota_back(self):
+        reservations = quota.reserve(self.DUMMY_CONTEXT, instances=2)
+        quota.rollback(self.DUMMY_CONTEXT, reservations)
+
+        self.assertEqual(self._usage()['in_use'], 0)
+        self.assertEqual(self._usage()['reserved'], 0)
+
+    def test_release_takes_deleted_resources_off(self):
+        quota.commit(self.DUMMY_CONTEXT,
+                     quota.reserve(self.DUMMY_CONTEXT, instances=2))
+        quota.release(self.DUMMY_CONTEXT, instances=1)
+
+        self.assertEqual(self._usage()['in_use'], 1)
+
+    def test_expired_reservations_are_rolled_back(self):
+        quota.reserve(self.DUMMY_CONTEXT, instances=1)
+        later = utils.utcnow() + datetime.timedelta(days=2)
+        self.mock.StubOutWithMock(utils, 'utcnow')
+        utils.utcnow().MultipleTimes().AndReturn(later)
+        self.mock.ReplayAll()
+
+        quota.expire_reservations()
+
+        self.assertEqual(self._usage()['reserved'], 0)
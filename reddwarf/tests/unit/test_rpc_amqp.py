@@ -0,0 +1,229 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.common import context
+from reddwarf.rpc import amqp as rpc_amqp
+from reddwarf.rpc import common as rpc_common
+
+
+class FakeConnection(object):
+    """Records what is sent and declared instead of talking to a broker."""
+
+    instances = []
+
+    def __init__(self, connection_pool, pooled=True, server_params=None):
+        self.consumers = {}
+        self.sent = []
+        FakeConnection.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def declare_direct_consumer(self, topic, callback):
+        self.consumers[topic] = callback
+
+    def consume_in_thread(self):
+        pass
+
+    @contextlib.contextmanager
+    def confirm_batch(self):
+        yield
+
+    def topic_send(self, topic, msg):
+        self.sent.append((topic, msg))
+
+    def direct_send(self, msg_id, msg):
+        self.sent.append((msg_id, msg))
+
+    def close(self):
+        pass
+
+
+class ReplyProxyTest(tests.BaseTest):
+
+    def setUp(self):
+        super(ReplyProxyTest, self).setUp()
+        FakeConnection.instances = []
+        self.mock.stubs.Set(rpc_amqp, 'ConnectionContext', FakeConnection)
+        self.proxy = rpc_amqp.ReplyProxy(None)
+
+    def tearDown(self):
+        rpc_amqp.cleanup(rpc_amqp.Pool(connection_cls=FakeConnection))
+        config.Config.instance.pop('rpc_single_reply_queue', None)
+        super(ReplyProxyTest, self).tearDown()
+
+    def _reply(self, msg_id, result=None, failure=None, ending=False):
+        self.proxy._process_data({'_msg_id': msg_id, 'result': result,
+                                  'failure': failure, 'ending': ending})
+
+    def test_replies_reach_their_callers(self):
+        first = rpc_amqp.ReplyWaiter(self.proxy, 'first', 1)
+        second = rpc_amqp.ReplyWaiter(self.proxy, 'second', 1)
+
+        self._reply('second', 'b')
+        self._reply('first', 'a1')
+        self._reply('first', 'a2')
+        self._reply('second', ending=True)
+        self._reply('first', ending=True)
+
+        self.assertEqual(['a1', 'a2'], list(first))
+        self.assertEqual(['b'], list(second))
+        self.assertEqual({}, self.proxy._waiters)
+
+    def test_legacy_string_reply(self):
+        waiter = rpc_amqp.ReplyWaiter(self.proxy, 'id', 1)
+        self.proxy._process_data(repr({'_msg_id': 'id', 'result': 4,
+                                       'failure': None}))
+        self._reply('id', ending=True)
+        self.assertEqual([4], list(waiter))
+
+    def test_failure_is_raised(self):
+        waiter = rpc_amqp.ReplyWaiter(self.proxy, 'id', 1)
+        self._reply('id', failure=('ValueError', 'bad', ''))
+        self.assertRaises(rpc_common.RemoteError, list, waiter)
+        self.assertEqual({}, self.proxy._waiters)
+
+    def test_timeout(self):
+        waiter = rpc_amqp.ReplyWaiter(self.proxy, 'id', 0.01)
+        self.assertRaises(rpc_common.Timeout, list, waiter)
+        self.assertEqual({}, self.proxy._waiters)
+
+    def test_late_reply_is_dropped(self):
+        self._reply('nobody', 'x')
+        self.assertEqual({}, self.proxy._waiters)
+
+    def test_orphaned_waiters_are_swept(self):
+        self.proxy.add_call_waiter('orphan', -1)
+        self.proxy.add_call_waiter('live', 60)
+        self.assertEqual(['live'], self.proxy._waiters.keys())
+
+    def test_calls_share_one_reply_queue(self):
+        config.Config.instance['rpc_single_reply_queue'] = 'True'
+        ctxt = context.ReddwarfContext(tenant='12345')
+
+        waiters = [rpc_amqp.multicall(ctxt, 'guest', {'method': 'm'}, 1,
+                                      None) for i in range(2)]
+
+        reply_q = rpc_amqp._reply_proxy.reply_q
+        declared = [conn for conn in FakeConnection.instances
+                    if reply_q in conn.consumers]
+        self.assertEqual(1, len(declared))
+        sent = [msg for conn in FakeConnection.instances
+                for topic, msg in conn.sent]
+        self.assertEqual([reply_q, reply_q],
+                         [msg['_reply_q'] for msg in sent])
+        for waiter in waiters:
+            waiter.done()
+
+    def test_reply_goes_to_the_reply_queue(self):
+        rpc_amqp.msg_reply('id', None, reply=3, reply_q='reply_q')
+        self.assertEqual([('reply_q', {'result': 3, 'failure': None,
+                                       '_msg_id': 'id'})],
+                         FakeConnection.instances[-1].sent)
+
+
+class AnsweringConnection(FakeConnection):
+    """Guests on the topics in answers reply as soon as they are called."""
+
+    answers = {}
+
+    def topic_send(self, topic, msg):
+        super(AnsweringConnection, self).topic_send(topic, msg)
+        if topic in self.answers:
+            reply = {'_msg_id': msg['_msg_id'], 'failure': None}
+            rpc_amqp._reply_proxy._process_data(
+                dict(reply, result=self.answers[topic]))
+            rpc_amqp._reply_proxy._process_data(
+                dict(reply, result=None, ending=True))
+
+
+class ScatterCallTest(tests.BaseTest):
+
+    def setUp(self):
+        super(ScatterCallTest, self).setUp()
+        FakeConnection.instances = []
+        self.mock.stubs.Set(rpc_amqp, 'ConnectionContext', AnsweringConnection)
+        self.ctxt = context.ReddwarfContext(tenant='12345')
+        config.Config.instance['rpc_single_reply_queue'] = 'True'
+
+    def tearDown(self):
+        rpc_amqp.cleanup(rpc_amqp.Pool(connection_cls=FakeConnection))
+        config.Config.instance.pop('rpc_single_reply_queue', None)
+        super(ScatterCallTest, self).tearDown()
+
+    def _calls(self, *topics):
+        return dict((topic, (topic, {'method': 'check_mysql_status'}))
+                    for topic in topics)
+
+    def test_replies_are_gathered(self):
+        AnsweringConnection.answers = {'host1': 1, 'host2': 3}
+
+        results = rpc_amqp.scatter_call(self.ctxt,
+                                        self._calls('host1', 'host2'),
+                                        1, None)
+
+        self.assertEqual({'host1': 1, 'host2': 3}, results)
+        self.assertEqual({}, rpc_amqp._reply_proxy._waiters)
+
+    def test_silent_calls_are_left_out(self):
+        AnsweringConnection.answers = {'host1': 1}
+
+        results = rpc_amqp.scatter_call(self.ctxt,
+                                        self._calls('host1', 'host2'),
+                                        0.01, None)
+
+        self.assertEqual({'host1': 1}, results)
+        self.assertEqual({}, rpc_amqp._reply_proxy._waiters)
+
+    def test_calls_share_one_connection(self):
+        AnsweringConnection.answers = {}
+
+        rpc_amqp.scatter_call(self.ctxt, self._calls('host1', 'host2'),
+                              0.01, None)
+
+        senders = [conn for conn in FakeConnection.instances if conn.sent]
+        self.assertEqual(1, len(senders))
+        msgs = [msg for topic, msg in senders[0].sent]
+        self.assertEqual(2, len(set(msg['_msg_id'] for msg in msgs)))
+        self.assertEqual(set([rpc_amqp._reply_proxy.reply_q]),
+                         set(msg['_reply_q'] for msg in msgs))
+
+    def test_calls_are_made_one_by_one_without_the_reply_queue(self):
+        config.Config.instance['rpc_single_reply_queue'] = 'False'
+
+        def _call(ctxt, topic, msg, timeout, connection_pool):
+            if topic == 'host2':
+                raise rpc_common.Timeout()
+            if topic == 'host3':
+                raise rpc_common.RemoteError('ValueError', 'bad', '')
+            return 1
+        self.mock.stubs.Set(rpc_amqp, 'call', _call)
+
+        results = rpc_amqp.scatter_call(
+            self.ctxt, self._calls('host1', 'host2', 'host3'), 1, None)
+
+        self.assertEqual(['host1', 'host3'], sorted(results))
+        self.assertEqual(1, results['host1'])
+        self.assertTrue(isinstance(results['host3'], rpc_common.RemoteError))
+        self.assertIsNone(rpc_amqp._reply_proxy)
@@ -0,0 +1,113 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import kombu
+import kombu.entity
+import kombu.messaging
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.rpc import common as rpc_common
+from reddwarf.rpc import envelope
+from reddwarf.rpc import impl_kombu
+
+
+MSG = {'method': 'update_instance_state',
+       'args': {'hostname': 'host1', 'state': 1}}
+
+
+class EnvelopeTest(tests.BaseTest):
+
+    def tearDown(self):
+        config.Config.instance.pop('rpc_legacy_messages', None)
+        super(EnvelopeTest, self).tearDown()
+
+    def test_json_round_trip(self):
+        body = envelope.serialize(MSG)
+        self.assertEqual(MSG, envelope.deserialize(body, envelope.JSON))
+
+    def test_legacy_literal(self):
+        self.assertEqual(MSG, envelope.deserialize(repr(MSG)))
+        self.assertEqual(MSG, envelope.deserialize(repr(MSG),
+                                                   'application/data'))
+
+    def test_legacy_bare_json(self):
+        body = envelope.json.dumps(MSG)
+        self.assertEqual(MSG, envelope.deserialize(body, envelope.JSON))
+
+    def test_legacy_messages_can_be_refused(self):
+        config.Config.instance['rpc_legacy_messages'] = 'False'
+        self.assertRaises(rpc_common.InvalidMessage,
+                          envelope.deserialize, repr(MSG))
+
+    def test_unsupported_version(self):
+        body = envelope.json.dumps({'version': '2.0', 'message': MSG})
+        self.assertRaises(rpc_common.InvalidMessage,
+                          envelope.deserialize, body, envelope.JSON)
+
+    def test_malformed_bodies(self):
+        for body, content_type in [('{"version": ', envelope.JSON),
+                                   ('os.system("ls")', None),
+                                   ('[1, 2]', None)]:
+            self.assertRaises(rpc_common.InvalidMessage,
+                              envelope.deserialize, body, content_type)
+
+    def test_schema(self):
+        for msg in [{'args': {}},
+                    {'method': '', 'args': {}},
+                    {'method': 'update_instance_state', 'args': 'x'}]:
+            self.assertRaises(rpc_common.InvalidMessage,
+                              envelope.deserialize, envelope.serialize(msg),
+                              envelope.JSON)
+
+
+class PassiveConsumerTest(tests.BaseTest):
+
+    TOPIC = 'phonehome_test'
+
+    def setUp(self):
+        super(PassiveConsumerTest, self).setUp()
+        config.Config.instance['fake_rabbit'] = True
+        self.conn = impl_kombu.Connection()
+        self.received = []
+        self.conn.declare_passive_consumer(self.TOPIC, self._receive)
+        exchange = kombu.entity.Exchange(self.TOPIC, type='direct',
+                                         durable=False, auto_delete=True)
+        self.producer = kombu.messaging.Producer(self.conn.channel,
+                                                 exchange=exchange,
+                                                 routing_key=self.TOPIC)
+
+    def tearDown(self):
+        self.conn.close()
+        del config.Config.instance['fake_rabbit']
+        super(PassiveConsumerTest, self).tearDown()
+
+    def _receive(self, message, delivery):
+        self.received.append(message)
+        delivery.ack()
+
+    def test_malformed_messages_never_reach_the_callback(self):
+        self.producer.publish(envelope.serialize(MSG),
+                              content_type=envelope.JSON,
+                              content_encoding='utf-8')
+        self.producer.publish('{"version": ', content_type=envelope.JSON,
+                              content_encoding='utf-8')
+        self.producer.publish(repr(MSG))
+
+        self.conn.consume(limit=3)
+
+        self.assertEqual([MSG, MSG], self.received)
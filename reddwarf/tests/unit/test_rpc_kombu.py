@@ -0,0 +1,118 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.rpc import impl_kombu
+
+
+class FakePublisher(object):
+
+    created = 0
+
+    def __init__(self, channel, topic, **kwargs):
+        FakePublisher.created += 1
+        self.channel = channel
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+        self.channel.published += 1
+
+
+class FakeConfirmChannel(object):
+    """Acks everything published so far, one frame per wait()."""
+
+    def __init__(self):
+        self.events = collections.defaultdict(set)
+        self.published = 0
+        self.waits = 0
+
+    def confirm_select(self):
+        pass
+
+    def wait(self, allowed_methods=None):
+        self.waits += 1
+        for callback in self.events['basic_ack']:
+            callback(self.published, True)
+
+
+class PublisherCacheTest(tests.BaseTest):
+
+    def setUp(self):
+        super(PublisherCacheTest, self).setUp()
+        config.Config.instance['fake_rabbit'] = True
+        FakePublisher.created = 0
+        self.conn = impl_kombu.Connection()
+
+    def tearDown(self):
+        self.conn.close()
+        del config.Config.instance['fake_rabbit']
+        config.Config.instance.pop('rabbit_publisher_confirms', None)
+        super(PublisherCacheTest, self).tearDown()
+
+    def test_publishers_are_reused(self):
+        self.conn.topic_send('guest.host1', {'method': 'a'})
+        self.conn.topic_send('guest.host1', {'method': 'b'})
+        self.conn.topic_send('guest.host2', {'method': 'c'})
+
+        self.assertEqual(2, len(self.conn.publishers))
+
+    def test_reset_keeps_a_publishing_channel(self):
+        channel = self.conn.channel
+        self.conn.topic_send('guest.host1', {'method': 'a'})
+
+        self.conn.reset()
+
+        self.assertTrue(self.conn.channel is channel)
+        self.assertEqual(1, len(self.conn.publishers))
+
+    def test_reset_after_consuming_drops_publishers(self):
+        channel = self.conn.channel
+        self.conn.topic_send('guest.host1', {'method': 'a'})
+        self.conn.declare_direct_consumer('reply', lambda msg: None)
+
+        self.conn.reset()
+
+        self.assertFalse(self.conn.channel is channel)
+        self.assertEqual(0, len(self.conn.publishers))
+
+    def test_confirms_are_waited_for_once_per_batch(self):
+        self.conn.channel = FakeConfirmChannel()
+        self.conn.confirms = True
+        self.conn._select_confirms()
+
+        with self.conn.confirm_batch():
+            for i in range(5):
+                self.conn.publisher_send(FakePublisher, 'topic', {'i': i})
+            self.assertEqual(0, self.conn.channel.waits)
+
+        self.assertEqual(1, self.conn.channel.waits)
+        self.assertEqual(1, FakePublisher.created)
+
+        self.conn.publisher_send(FakePublisher, 'topic', {'i': 5})
+        self.assertEqual(2, self.conn.channel.waits)
+
+    def test_confirms_need_transport_support(self):
+        config.Config.instance['rabbit_publisher_confirms'] = 'True'
+        conn = impl_kombu.Connection()
+        try:
+            self.assertFalse(conn.confirms)
+        finally:
+            conn.close()
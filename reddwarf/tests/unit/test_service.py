@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+from eventlet import event
+
+from reddwarf import tests
+from reddwarf.common import service
+
+
+class FakeServer(object):
+
+    def __init__(self):
+        self.started = event.Event()
+        self.finished = event.Event()
+
+    def start(self):
+        self.started.send()
+
+    def wait(self):
+        self.finished.wait()
+
+
+class StoppableServer(FakeServer):
+
+    def __init__(self):
+        super(StoppableServer, self).__init__()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+class LauncherTest(tests.BaseTest):
+
+    def test_stop_stops_servers_then_kills_them(self):
+        launcher = service.Launcher()
+        stoppable, plain = StoppableServer(), FakeServer()
+        launcher.launch_server(stoppable)
+        launcher.launch_server(plain)
+        stoppable.started.wait()
+        plain.started.wait()
+
+        launcher.stop()
+        launcher.wait()
+
+        self.assertTrue(stoppable.stopped)
+        self.assertTrue(all(gt.dead for gt in launcher._services))
@@ -0,0 +1,282 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import datetime
+import json
+import logging
+
+import mox
+from eventlet import greenthread
+
+from reddwarf import tests
+from reddwarf.common import config
+from reddwarf.common import utils
+from reddwarf.database import guest_api
+from reddwarf.database import models
+from reddwarf.db import archive
+from reddwarf.taskmanager import manager
+from reddwarf.taskmanager import provisioning
+
+LOG = logging.getLogger(__name__)
+
+
+class TaskManagerProvisioningTest(tests.BaseTest):
+
+    def setUp(self):
+        super(TaskManagerProvisioningTest, self).setUp()
+        self.task_manager = manager.TaskManager()
+        self.task = models.ProvisioningTask().create(
+            instance_id=utils.generate_uuid(),
+            step=models.ProvisioningTask.STEPS[0],
+            state='pending',
+            attempts=0,
+            payload=json.dumps({'image_id': '1240'}))
+
+    def _stub_provisioner(self, error=None):
+        provisioner = self.mock.CreateMock(provisioning.Provisioner)
+        self.mock.StubOutWithMock(provisioning, 'Provisioner')
+        provisioning.Provisioner(mox.IgnoreArg()).AndReturn(provisioner)
+        if error:
+            provisioner.run().AndRaise(error)
+        else:
+            provisioner.run().AndReturn(None)
+        return provisioner
+
+    def test_provision_instance(self):
+        self._stub_provisioner()
+        self.mock.ReplayAll()
+
+        self.task_manager.provision_instance(None, self.task['id'])
+        self.assertEqual(set(), self.task_manager._active_tasks)
+
+    def test_provision_instance_skips_finished_task(self):
+        self.task.update(state='done')
+        self.mock.StubOutWithMock(provisioning, 'Provisioner')
+        self.mock.ReplayAll()
+
+        self.task_manager.provision_instance(None, self.task['id'])
+
+    def test_failed_step_is_retried_with_backoff(self):
+        config.Config.instance['provisioning_retry_seconds'] = '10'
+        self.task.update(attempts=1)
+        self._stub_provisioner(Exception("nova is down"))
+        self.mock.StubOutWithMock(greenthread, 'spawn_after')
+        greenthread.spawn_after(20, self.task_manager.provision_instance,
+                                None, self.task['id'])
+        self.mock.ReplayAll()
+
+        try:
+            self.task_manager.provision_instance(None, self.task['id'])
+        finally:
+            del config.Config.instance['provisioning_retry_seconds']
+
+        task = models.ProvisioningTask.find_by(id=self.task['id'])
+        self.assertEqual(task['state'], 'pending')
+        self.assertEqual(task['attempts'], 2)
+        self.assertEqual(task['last_error'], 'nova is down')
+        self.assertTrue(self.task['id'] in self.task_manager._retrying_tasks)
+
+    def test_task_fails_after_max_attempts(self):
+        self.task.update(attempts=4)
+        error = Exception("nova is down")
+        provisioner = self._stub_provisioner(error)
+        provisioner.fail(error)
+        self.mock.StubOutWithMock(greenthread, 'spawn_after')
+        self.mock.ReplayAll()
+
+        self.task_manager.provision_instance(None, self.task['id'])
+
+        task = models.ProvisioningTask.find_by(id=self.task['id'])
+        self.assertEqual(task['state'], 'failed')
+        self.assertEqual(task['attempts'], 5)
+
+    def test_resume_stale_provisioning(self):
+        self.task.update(state='running')
+        retrying = models.ProvisioningTask().create(
+            instance_id=utils.generate_uuid(),
+            step='server',
+            state='pending',
+            attempts=1,
+            payload='{}')
+        self.task_manager._retrying_tasks.add(retrying['id'])
+        models.ProvisioningTask().create(instance_id=utils.generate_uuid(),
+                                         step='done',
+                                         state='done',
+                                         attempts=0,
+                                         payload='{}')
+
+        later = datetime.datetime.utcnow() + datetime.timedelta(seconds=600)
+        self.mock.StubOutWithMock(utils, 'utcnow')
+        utils.utcnow().AndReturn(later)
+        self.mock.StubOutWithMock(greenthread, 'spawn_n')
+        greenthread.spawn_n(self.task_manager.provision_instance,
+                            None, self.task['id'])
+        self.mock.ReplayAll()
+
+        self.task_manager._resume_stale_provisioning()
+
+    def test_recent_tasks_are_not_resumed(self):
+        self.mock.StubOutWithMock(greenthread, 'spawn_n')
+        self.mock.ReplayAll()
+
+        self.task_manager._resume_stale_provisioning()
+
+    def test_deleted_rows_archived_once_per_interval(self):
+        self.mock.StubOutWithMock(greenthread, 'spawn_n')
+        greenthread.spawn_n(self.task_manager._run_archive)
+        self.mock.ReplayAll()
+
+        self.task_manager._archive_deleted_rows()
+        self.task_manager._archive_deleted_rows()
+
+    def test_archive_not_restarted_while_running(self):
+        self.task_manager._archiving = True
+        self.mock.StubOutWithMock(greenthread, 'spawn_n')
+        self.mock.ReplayAll()
+
+        self.task_manager._archive_deleted_rows()
+
+    def test_archive_run_clears_running_flag_on_error(self):
+        self.task_manager._archiving = True
+        self.mock.StubOutWithMock(archive, 'archive_deleted_rows')
+        archive.archive_deleted_rows().AndRaise(Exception("boom"))
+        self.mock.ReplayAll()
+
+        self.task_manager._run_archive()
+
+        self.assertFalse(self.task_manager._archiving)
+
+    def test_guest_health_swept_once_per_interval(self):
+        self.mock.StubOutWithMock(guest_api.API, 'sweep_mysql_status')
+        guest_api.API.sweep_mysql_status(mox.IgnoreArg())
+        self.mock.ReplayAll()
+
+        self.task_manager._sweep_guest_health()
+        self.task_manager._sweep_guest_health()
+
+    def test_archival_disabled(self):
+        config.Config.instance['archive_deleted_after_days'] = '0'
+        self.mock.StubOutWithMock(archive, 'archive_deleted_rows')
+        self.mock.ReplayAll()
+
+        try:
+            self.task_manager._archive_deleted_rows()
+        finally:
+            del config.Config.instance['archive_deleted_after_days']
+
+
+FakeFloatingIP = collections.namedtuple('FakeFloatingIP',
+                                        'id ip instance_id fixed_ip')
+
+
+class ProvisionerTest(tests.BaseTest):
+
+    def setUp(self):
+        super(ProvisionerTest, self).setUp()
+        credential = models.Credential().create(user_name='user',
+                                                password='secret',
+                                                tenant_id='123')
+        self.instance = models.DBInstance().create(
+            name='db1', tenant_id='123', user_id='999',
+            credential=credential['id'], remote_id='server',
+            availability_zone='az1')
+        models.GuestStatus().create(instance_id=self.instance['id'],
+                                    state='building')
+        self.task = models.ProvisioningTask().create(
+            instance_id=self.instance['id'],
+            step='floating_ip',
+            state='running',
+            attempts=0,
+            payload=json.dumps({'userdata': 'password=secret'}))
+
+    def _payload(self):
+        task = models.ProvisioningTask.find_by(id=self.task['id'])
+        return json.loads(task['payload'])
+
+    def _flip(self, id, instance_id=None):
+        return models.FloatingIP(floating_ip=FakeFloatingIP(
+            id, '15.1.1.%s' % id, instance_id, None))
+
+    def test_floating_ip_is_recorded_before_it_is_assigned(self):
+        self.mock.StubOutWithMock(models.FloatingIP, 'find_by_server')
+        self.mock.StubOutWithMock(models.FloatingIP, 'create')
+        self.mock.StubOutWithMock(models.FloatingIP, 'assign')
+        models.FloatingIP.find_by_server(mox.IgnoreArg(), 'az1',
+                                         'server').AndReturn(None)
+        models.FloatingIP.create(mox.IgnoreArg(), 'az1').AndReturn(
+            self._flip('7'))
+        models.FloatingIP.assign(mox.IgnoreArg(), 'az1', mox.IgnoreArg(),
+                                 'server').AndRaise(Exception("nova is down"))
+        self.mock.ReplayAll()
+
+        provisioner = provisioning.Provisioner(self.task)
+        self.assertRaises(Exception, provisioner._provision_floating_ip)
+        self.assertEqual('7', self._payload()['floating_ip_id'])
+
+    def test_retry_reuses_the_allocated_floating_ip(self):
+        self.task.update(payload=json.dumps({'floating_ip_id': '7'}))
+        self.mock.StubOutWithMock(models.FloatingIP, 'find_by_server')
+        self.mock.StubOutWithMock(models.FloatingIP, 'find')
+        self.mock.StubOutWithMock(models.FloatingIP, 'create')
+        self.mock.StubOutWithMock(models.FloatingIP, 'assign')
+        models.FloatingIP.find_by_server(mox.IgnoreArg(), 'az1',
+                                         'server').AndReturn(None)
+        models.FloatingIP.find(mox.IgnoreArg(), 'az1', '7').AndReturn(
+            self._flip('7'))
+        models.FloatingIP.assign(mox.IgnoreArg(), 'az1', mox.IgnoreArg(),
+                                 'server')
+        self.mock.ReplayAll()
+
+        provisioning.Provisioner(self.task)._provision_floating_ip()
+
+        instance = models.DBInstance.find_by(id=self.instance['id'])
+        self.assertEqual('15.1.1.7', instance['address'])
+
+    def test_fail_releases_the_floating_ip_and_drops_the_password(self):
+        self.task.update(payload=json.dumps({'floating_ip_id': '7',
+                                             'userdata': 'password=secret'}))
+        self.mock.StubOutWithMock(models.FloatingIP, 'find')
+        self.mock.StubOutWithMock(models.FloatingIP, 'unassign')
+        self.mock.StubOutWithMock(models.FloatingIP, 'release')
+        flip = self._flip('7', instance_id='server')
+        models.FloatingIP.find(mox.IgnoreArg(), 'az1', '7').AndReturn(flip)
+        models.FloatingIP.unassign(mox.IgnoreArg(), 'az1', flip.data(),
+                                   'server')
+        models.FloatingIP.release(mox.IgnoreArg(), 'az1', flip.data())
+        self.mock.ReplayAll()
+
+        provisioner = provisioning.Provisioner(
+            models.ProvisioningTask.find_by(id=self.task['id']))
+        models.ProvisioningTask.find_by(id=self.task['id']).update(
+            state='failed')
+        provisioner.fail(Exception("nova is down"))
+
+        task = models.ProvisioningTask.find_by(id=self.task['id'])
+        self.assertEqual({}, json.loads(task['payload']))
+        self.assertEqual('failed', task['state'])
+
+    def test_fail_releases_an_unassigned_floating_ip(self):
+        self.task.update(payload=json.dumps({'floating_ip_id': '7'}))
+        self.mock.StubOutWithMock(models.FloatingIP, 'find')
+        self.mock.StubOutWithMock(models.FloatingIP, 'release')
+        flip = self._flip('7')
+        models.FloatingIP.find(mox.IgnoreArg(), 'az1', '7').AndReturn(flip)
+        models.FloatingIP.release(mox.IgnoreArg(), 'az1', flip.data())
+        self.mock.ReplayAll()
+
+        provisioning.Provisioner(self.task).fail(Exception("nova is down"))
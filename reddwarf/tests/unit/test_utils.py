@@ -19,6 +19,8 @@ import logging
 import time
 import unittest
 
+from eventlet import greenthread
+
 from reddwarf.common import utils
 
 LOG = logging.getLogger(__name__)
@@ -97,3 +99,115 @@ class StringifyExcludeTest(unittest.TestCase):
         new_keys = utils.exclude(key_values, *exclude_keys)
         self.assertEqual(len(new_keys), 1)
         self.assertEqual(new_keys, {'two': 2 })
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_get_returns_default_on_miss(self):
+        cache = utils.LRUCache(max_size=2, ttl=60)
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = utils.LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertFalse('a' in cache)
+
+
+class RunConcurrentlyTest(unittest.TestCase):
+
+    def test_steps_run_concurrently(self):
+        started = []
+
+        def step(name):
+            started.append(name)
+            greenthread.sleep(0)
+            # Both steps are started before either one finishes
+            self.assertEqual(len(started), 2)
+            return name
+
+        results = utils.run_concurrently([(step, ('a',), None),
+                                          (step, ('b',), None)])
+        self.assertEqual(results, ['a', 'b'])
+
+    def test_failure_compensates_completed_steps(self):
+        compensated = []
+
+        def fail():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, utils.run_concurrently,
+                          [(lambda: 'volume', (), compensated.append),
+                           (fail, (), compensated.append),
+                           (lambda: 'ip', (), None)])
+        self.assertEqual(compensated, ['volume'])
+
+
+class BackoffPollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.now = 0
+        self.real_sleep = greenthread.sleep
+        self.real_time = utils.time.time
+        greenthread.sleep = self._sleep
+        utils.time.time = lambda: self.now
+
+    def tearDown(self):
+        greenthread.sleep = self.real_sleep
+        utils.time.time = self.real_time
+
+    def _sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+    def test_delay_grows_until_max_delay(self):
+        values = iter([False, False, False, False, True])
+        poller = utils.BackoffPoller(lambda: values.next(), initial_delay=1,
+                                     max_delay=3, jitter=0)
+
+        self.assertTrue(poller.wait())
+        self.assertEqual(self.sleeps, [1, 2, 3, 3])
+        self.assertEqual(poller.attempts, 5)
+        self.assertEqual(poller.waited, 9)
+
+    def test_jitter_stays_in_bounds(self):
+        values = iter([False] * 20 + [True])
+        poller = utils.BackoffPoller(lambda: values.next(), initial_delay=1,
+                                     max_delay=1, jitter=0.2)
+        poller.wait()
+        for delay in self.sleeps:
+            self.assertTrue(0.8 <= delay <= 1.2)
+
+    def test_times_out_at_deadline(self):
+        from reddwarf.common import exception
+        poller = utils.BackoffPoller(lambda: False, initial_delay=4,
+                                     jitter=0, time_out=10)
+
+        self.assertRaises(exception.PollTimeOut, poller.wait)
+        self.assertEqual(self.sleeps, [4, 6])
+        self.assertEqual(poller.waited, 10)
+
+    def test_probe_time_counts_towards_the_deadline(self):
+        from reddwarf.common import exception
+
+        def slow_probe():
+            self.now += 3
+            return False
+        poller = utils.BackoffPoller(slow_probe, initial_delay=1, jitter=0,
+                                     time_out=10)
+
+        self.assertRaises(exception.PollTimeOut, poller.wait)
+        self.assertEqual(self.sleeps, [1, 2])
+        self.assertEqual(poller.attempts, 3)